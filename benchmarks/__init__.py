@@ -0,0 +1,5 @@
+"""
+Benchmarks for the paralympics app. Run each one as a module from the project root, e.g.
+
+    python -m benchmarks.bench_serializers --events 100000
+"""
@@ -0,0 +1,52 @@
+"""
+Compares the throughput of adding events one per request with POST /events and in batches with POST /events/batch.
+
+The response cache is turned off as it is not used by writes. The routes are registered with the first app created
+in a process, so all the methods use the same app and database.
+
+    python -m benchmarks.bench_batch_writes --events 2000 --batch-sizes 100 1000
+"""
+import argparse
+import time
+
+from paralympics import db
+from paralympics.models import Region
+from benchmarks.synthetic import EventFaker, create_bench_app, remove_bench_db
+
+
+def time_writes(client, events, batch_size):
+    """Adds the events with POST /events if batch_size is None, otherwise with POST /events/batch."""
+    start = time.perf_counter()
+    if batch_size is None:
+        for event in events:
+            assert client.post("/events", json=event).status_code == 200
+    else:
+        for i in range(0, len(events), batch_size):
+            assert client.post("/events/batch", json=events[i:i + batch_size]).status_code == 200
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=2000, help="number of events to add with each method")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[100, 1000], help="events per batch request")
+    args = parser.parse_args()
+
+    app, db_path = create_bench_app(RESPONSE_CACHE="paralympics.cache.NullCache")
+    try:
+        with app.app_context():
+            faker = EventFaker(db.session.execute(db.select(Region.NOC)).scalars().all())
+        events = [faker.json_row() for _ in range(args.events)]
+        client = app.test_client()
+
+        print(f"{'method':<24} {'seconds':>8} {'events/s':>10}")
+        for batch_size in [None] + args.batch_sizes:
+            seconds = time_writes(client, events, batch_size)
+            name = "POST /events" if batch_size is None else f"POST /events/batch {batch_size}"
+            print(f"{name:<24} {seconds:>8.2f} {args.events / seconds:>10,.0f}")
+    finally:
+        remove_bench_db(db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Measures the rows/second of loading synthetic events from a CSV file.
+
+bulk_load_csv() is compared with the per-row ORM loop that add_data() used before, i.e. one Event object and one
+db.session.add() per row. The ORM loop is slow, so by default it is only run for the smaller sizes.
+
+    python -m benchmarks.bench_bulk_load --sizes 10000 100000 1000000 --legacy-max 100000
+"""
+import argparse
+import csv
+import os
+import tempfile
+import time
+
+from paralympics import db
+from paralympics.models import Event, Region
+from paralympics.utils import bulk_load_csv, event_values
+from benchmarks.synthetic import EventFaker, create_bench_app, remove_bench_db
+
+COLUMNS = ["type", "year", "country", "host", "NOC", "start", "end", "duration", "disabilities_included",
+           "countries", "events", "sports", "participants_m", "participants_f", "participants", "highlights"]
+
+
+def write_events_csv(path, n, nocs):
+    """Writes n synthetic events to a CSV file in the same format as data/paralympic_events.csv"""
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(COLUMNS)
+        faker = EventFaker(nocs)
+        for _ in range(n):
+            values = faker.json_row()
+            writer.writerow(["" if values[c] is None else values[c] for c in COLUMNS])
+
+
+def orm_load_csv(csv_file):
+    """The per-row loop from the previous version of add_data()"""
+    with open(csv_file, "r", newline="", encoding="utf-8-sig") as file:
+        csv_reader = csv.reader(file)
+        next(csv_reader)
+        for row in csv_reader:
+            db.session.add(Event(**event_values(row)))
+
+
+def time_load(load, csv_file):
+    """Times a load function in a new database, including the commit, and returns the seconds taken."""
+    app, db_path = create_bench_app()
+    try:
+        with app.app_context():
+            start = time.perf_counter()
+            load(csv_file)
+            db.session.commit()
+            return time.perf_counter() - start
+    finally:
+        remove_bench_db(db_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000],
+                        help="numbers of synthetic events to load")
+    parser.add_argument("--legacy-max", type=int, default=100000,
+                        help="largest size to also load with the per-row ORM loop")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="rows per executemany for bulk_load_csv")
+    args = parser.parse_args()
+
+    app, db_path = create_bench_app()
+    with app.app_context():
+        nocs = db.session.execute(db.select(Region.NOC)).scalars().all()
+    remove_bench_db(db_path)
+
+    print(f"{'rows':>10} {'method':>14} {'seconds':>9} {'rows/s':>12}")
+    for size in args.sizes:
+        fd, csv_file = tempfile.mkstemp(suffix=".csv", prefix="paralympics_bench_")
+        os.close(fd)
+        try:
+            write_events_csv(csv_file, size, nocs)
+            methods = [("bulk_load_csv", lambda f: bulk_load_csv(db, Event, f, event_values, args.chunk_size))]
+            if size <= args.legacy_max:
+                methods.append(("orm per-row", orm_load_csv))
+            for name, load in methods:
+                seconds = time_load(load, csv_file)
+                print(f"{size:>10} {name:>14} {seconds:>9.2f} {size / seconds:>12,.0f}")
+        finally:
+            os.unlink(csv_file)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Concurrent read/write stress test of the SQLite engine settings.
+
+Several worker processes, each with several threads, share one SQLite file, like a multi-worker server. Each thread
+repeatedly makes a read request (a page of /events or one event) or, with probability --write-ratio, a write (add
+an event, update it and delete it). Requests that fail with a 5xx status, e.g. "database is locked", are counted as
+errors, and the throughput and latency percentiles of the reads and writes are reported.
+
+Run with --no-profile to compare with SQLite's default journal mode and no busy timeout.
+
+    python -m benchmarks.bench_concurrency --processes 4 --threads 4 --seconds 10 --write-ratio 0.2
+"""
+import argparse
+import multiprocessing
+import random
+import threading
+import time
+
+from benchmarks.synthetic import create_bench_app, remove_bench_db
+from benchmarks.timing import summarise
+
+# Config for --no-profile, which turns off the settings in paralympics.engine
+NO_PROFILE = {"SQLITE_PRAGMAS": {"journal_mode": "DELETE"}, "SQLITE_IMMEDIATE_WRITES": False}
+
+NEW_EVENT = {"type": "summer", "year": 2048, "country": "Australia", "host": "Adelaide", "NOC": "AUS",
+             "region": "AUS", "highlights": "Stress test"}
+
+
+def read(client, rnd, max_id):
+    """Makes one read request and returns its status code."""
+    if rnd.random() < 0.5:
+        return client.get("/events", query_string={"limit": 50, "after": rnd.randint(0, max_id)}).status_code
+    return client.get(f"/events/{rnd.randint(1, max_id)}").status_code
+
+
+def write(client, rnd):
+    """Adds, updates and deletes an event, and returns the worst status code of the three requests."""
+    response = client.post("/events", json=NEW_EVENT)
+    if response.status_code != 200:
+        return response.status_code
+    event_id = int(response.json["message"].split("=")[-1])
+    patched = client.patch(f"/events/{event_id}", json={"participants": rnd.randint(100, 5000)}).status_code
+    deleted = client.delete(f"/events/{event_id}").status_code
+    return max(patched, deleted)
+
+
+def run_worker(db_path, config, threads, seconds, write_ratio, max_id, seed):
+    """Runs the requests of one worker process and returns the latencies and error counts of its threads."""
+    app, _ = create_bench_app(db_path=db_path, **config)
+    results = {"read": [], "write": [], "read_errors": 0, "write_errors": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def run_thread(thread_seed):
+        rnd = random.Random(thread_seed)
+        client = app.test_client()
+        while time.perf_counter() < deadline:
+            kind = "write" if rnd.random() < write_ratio else "read"
+            start = time.perf_counter()
+            status = write(client, rnd) if kind == "write" else read(client, rnd, max_id)
+            elapsed = time.perf_counter() - start
+            with lock:
+                results[kind].append(elapsed)
+                if status >= 500:
+                    results[f"{kind}_errors"] += 1
+
+    workers = [threading.Thread(target=run_thread, args=(seed * 1000 + i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=4, help="number of worker processes")
+    parser.add_argument("--threads", type=int, default=4, help="threads in each worker process")
+    parser.add_argument("--seconds", type=float, default=10, help="how long to run the requests for")
+    parser.add_argument("--write-ratio", type=float, default=0.2, help="fraction of the requests that are writes")
+    parser.add_argument("--events", type=int, default=100000, help="number of synthetic events to add")
+    parser.add_argument("--no-profile", action="store_true", help="use SQLite's defaults instead of the profile")
+    args = parser.parse_args()
+
+    # The response cache is per process, so turn it off to make every read use the database
+    config = {"RESPONSE_CACHE": "paralympics.cache.NullCache"}
+    if args.no_profile:
+        config.update(NO_PROFILE)
+    app, db_path = create_bench_app(events=args.events, **config)
+    try:
+        # Spawn rather than fork, so the workers do not share the connections of this process
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(args.processes) as pool:
+            jobs = [(db_path, config, args.threads, args.seconds, args.write_ratio, args.events, seed)
+                    for seed in range(args.processes)]
+            worker_results = pool.starmap(run_worker, jobs)
+    finally:
+        remove_bench_db(db_path)
+
+    print(f"{args.processes} processes x {args.threads} threads for {args.seconds}s, "
+          f"{'SQLite defaults' if args.no_profile else 'SQLITE_PRAGMAS profile'}")
+    print(f"{'kind':>6} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for kind in ("read", "write"):
+        samples = [s for result in worker_results for s in result[kind]]
+        errors = sum(result[f"{kind}_errors"] for result in worker_results)
+        stats = summarise(samples, args.seconds)
+        print(f"{kind:>6} {stats['requests']:>9} {errors:>7} {stats['throughput']:>8.1f} {stats['p50_ms']:>8.2f} "
+              f"{stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
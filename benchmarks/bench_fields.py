@@ -0,0 +1,58 @@
+"""
+Compares GET /events with all the fields against narrow projections chosen with ?fields=.
+
+Each projection is requested through the test client with the response cache turned off, so the times include the
+query, the serialization and the JSON encoding. The size of the response body is reported with the time.
+
+    python -m benchmarks.bench_fields --events 100000 --repeat 3
+"""
+import argparse
+import time
+
+from benchmarks.synthetic import create_bench_app, remove_bench_db
+
+# name -> value of ?fields=, None for all the fields
+PROJECTIONS = {
+    "all fields": None,
+    "year,host": "year,host",
+    "id,type,year,NOC": "id,type,year,NOC",
+    "no highlights": "id,type,year,country,host,NOC,start,end,duration,disabilities_included,countries,events,"
+                     "sports,participants_m,participants_f,participants",
+}
+
+
+def best_time(client, url, repeat):
+    """Returns the fastest of repeat requests for url and the size of the response body in bytes."""
+    times = []
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get(url)
+        times.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.data
+        size = len(response.data)
+    return min(times), size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=100000, help="number of synthetic events to add")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed requests for each projection")
+    args = parser.parse_args()
+
+    app, db_path = create_bench_app(events=args.events, RESPONSE_CACHE="paralympics.cache.NullCache")
+    try:
+        client = app.test_client()
+        print(f"{'fields':>18} {'seconds':>8} {'MB':>8} {'speedup':>8}")
+        full_seconds = None
+        for name, fields in PROJECTIONS.items():
+            url = "/events" if fields is None else f"/events?fields={fields}"
+            seconds, size = best_time(client, url, args.repeat)
+            full_seconds = full_seconds or seconds
+            print(f"{name:>18} {seconds:>8.3f} {size / 1e6:>8.2f} {full_seconds / seconds:>7.1f}x")
+    finally:
+        remove_bench_db(db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Latency of the GET routes while a large CSV import runs, inline or as a background job.
+
+Several threads make light reads (a page of /events or one event) through the test client, like the request threads
+of one web worker. The reads are timed with nothing else running, while a CSV file of --rows synthetic events is
+imported inline on another thread of the same process, as a route would if it imported the file in the request, and
+while the same file is imported by POST /jobs on the worker pool of paralympics.jobs. Each import also reports how
+long it took, from the request to the job's status being 'succeeded'.
+
+    python -m benchmarks.bench_jobs --events 50000 --rows 200000 --threads 4
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from benchmarks.bench_bulk_load import write_events_csv
+from benchmarks.synthetic import create_bench_app, remove_bench_db
+from benchmarks.timing import summarise
+from paralympics import db
+from paralympics.analytics import rebuild_summaries
+from paralympics.models import Event, Region
+from paralympics.utils import bulk_load_csv, event_values
+
+MODES = ("idle", "inline", "job")
+
+
+def read_while(app, threads, max_id, running):
+    """Makes light reads on the threads until running() returns False, and returns their latencies and errors."""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def run_thread(seed):
+        rnd = random.Random(seed)
+        client = app.test_client()
+        while running():
+            if rnd.random() < 0.5:
+                url = f"/events?limit=50&after={rnd.randint(0, max_id)}"
+            else:
+                url = f"/events/{rnd.randint(1, max_id)}"
+            start = time.perf_counter()
+            status = client.get(url).status_code
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += status != 200
+
+    workers = [threading.Thread(target=run_thread, args=(seed,)) for seed in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return latencies, errors[0]
+
+
+def import_inline(app, csv_file):
+    """Imports the CSV file in one transaction in this process, as a route would if it imported the file itself."""
+    with app.app_context():
+        bulk_load_csv(db, Event, csv_file, event_values, app.config["JOB_CHUNK_SIZE"])
+        rebuild_summaries(db)
+        db.session.commit()
+
+
+def import_job(client, headers, csv_file):
+    """Posts an import-events job and waits for it to finish."""
+    with open(csv_file, "rb") as file:
+        response = client.post("/jobs", data={"type": "import-events", "file": (file, "events.csv")}, headers=headers)
+    wait_for_job(client, headers, response)
+
+
+def wait_for_job(client, headers, response):
+    """Waits for the job posted in response to finish, and checks it succeeded."""
+    assert response.status_code == 202, response.json
+    while True:
+        job = client.get(response.headers["Location"], headers=headers).json
+        if job["status"] not in ("queued", "running"):
+            assert job["status"] == "succeeded", job
+            return
+        time.sleep(0.05)
+
+
+def run_mode(mode, app, args, csv_file, max_id, headers):
+    """Times the reads during one mode, and returns the latencies, errors and the seconds the import took."""
+    done = threading.Event()
+    start = time.perf_counter()
+    if mode == "idle":
+        timer = threading.Timer(args.idle_seconds, done.set)
+        timer.start()
+    else:
+        def run_import():
+            try:
+                if mode == "inline":
+                    import_inline(app, csv_file)
+                else:
+                    import_job(app.test_client(), headers, csv_file)
+            finally:
+                done.set()
+
+        importer = threading.Thread(target=run_import)
+        importer.start()
+    latencies, errors = read_while(app, args.threads, max_id, lambda: not done.is_set())
+    seconds = time.perf_counter() - start
+    if mode != "idle":
+        importer.join()
+    return latencies, errors, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=50000, help="number of synthetic events in the database")
+    parser.add_argument("--rows", type=int, default=200000, help="number of events in the CSV file to import")
+    parser.add_argument("--threads", type=int, default=4, help="threads making reads")
+    parser.add_argument("--idle-seconds", type=float, default=5, help="how long to time the reads with no import")
+    args = parser.parse_args()
+
+    # The response cache is off so every read uses the database
+    jobs_dir = tempfile.mkdtemp(prefix="paralympics_bench_jobs_")
+    app, db_path = create_bench_app(events=args.events, RESPONSE_CACHE="paralympics.cache.NullCache",
+                                    JOBS_DIR=jobs_dir)
+    fd, csv_file = tempfile.mkstemp(suffix=".csv", prefix="paralympics_bench_")
+    os.close(fd)
+    results = {}
+    try:
+        with app.app_context():
+            nocs = db.session.execute(db.select(Region.NOC)).scalars().all()
+            max_id = db.session.execute(db.select(db.func.max(Event.id))).scalar_one()
+        write_events_csv(csv_file, args.rows, nocs)
+        client = app.test_client()
+        user = {"email": "bench@example.com", "password": "bench-password"}
+        client.post("/register", json=user)
+        headers = {"Authorization": client.post("/login", json=user).json["token"]}
+        # Start the worker pool before timing, as a server that has run a job before would have
+        wait_for_job(client, headers, client.post("/jobs", json={"type": "export-events"}, headers=headers))
+        for mode in MODES:
+            results[mode] = run_mode(mode, app, args, csv_file, max_id, headers)
+    finally:
+        app.extensions["job_runner"].shutdown()
+        os.unlink(csv_file)
+        shutil.rmtree(jobs_dir)
+        remove_bench_db(db_path)
+
+    print(f"{args.threads} reading threads, {args.events} events in the database, importing {args.rows} events")
+    print(f"{'mode':>7} {'import s':>9} {'reads':>7} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8}")
+    for mode, (latencies, errors, seconds) in results.items():
+        stats = summarise(latencies, seconds)
+        import_seconds = "-" if mode == "idle" else f"{seconds:.1f}"
+        print(f"{mode:>7} {import_seconds:>9} {stats['requests']:>7} {errors:>7} {stats['throughput']:>8.1f} "
+              f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
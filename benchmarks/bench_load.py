@@ -0,0 +1,248 @@
+"""
+Load test of the app served over HTTP on localhost by several worker processes.
+
+The benchmarks that use the Flask test client skip the WSGI server, the sockets and the contention between processes.
+This one serves the app from create_app() with werkzeug's threaded server in --workers processes that share one
+listening socket on 127.0.0.1, like a pre-fork server such as gunicorn. It then drives the server from --clients
+client processes, each with --threads threads that keep their connection open between requests.
+
+Each request is chosen from the route mix, a comma separated list of name=weight, e.g. --mix events=4,event=4,patch=1.
+The routes that need a token, PATCH /regions/<code>, use a JWT that each thread gets from POST /login, and get a new
+one if it expires. The throughput, the p50, p95 and p99 latency and the error rate are reported for each route and in
+total. A 5xx response or a failed connection is an error, and 4xx responses are counted separately.
+
+    python -m benchmarks.bench_load --events 100000 --workers 4 --clients 2 --threads 4 --seconds 20
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import random
+import socket
+import threading
+import time
+from collections import Counter
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from benchmarks.synthetic import create_bench_app, remove_bench_db
+from benchmarks.timing import summarise
+
+HOST = "127.0.0.1"
+
+USER = {"email": "load@example.com", "password": "load-password"}
+
+# name -> function(rnd, keys) that returns (method, path, JSON body or None)
+ROUTES = {
+    "regions": lambda rnd, keys: ("GET", "/regions", None),
+    "region": lambda rnd, keys: ("GET", f"/regions/{rnd.choice(keys['nocs'])}", None),
+    "events": lambda rnd, keys: ("GET", f"/events?limit=50&after={rnd.randint(0, keys['max_id'])}", None),
+    "events_filtered": lambda rnd, keys: ("GET", f"/events?NOC={rnd.choice(keys['nocs'])}&limit=50", None),
+    "event": lambda rnd, keys: ("GET", f"/events/{rnd.randint(1, keys['max_id'])}", None),
+    "search": lambda rnd, keys: ("GET", f"/events/search?q={rnd.choice(('story', 'whole', 'network'))}", None),
+    "medals": lambda rnd, keys: ("GET", "/medals", None),
+    "analytics": lambda rnd, keys: ("GET", "/analytics/participants", None),
+    "patch": lambda rnd, keys: ("PATCH", f"/regions/{rnd.choice(keys['nocs'])}", {"notes": f"Load {rnd.random()}"}),
+}
+
+# Routes that need the Authorization header
+AUTH_ROUTES = {"patch"}
+
+DEFAULT_MIX = "regions=1,region=2,events=4,events_filtered=2,event=4,search=1,medals=1,analytics=1,patch=1"
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Request handler that does not log each request, as writing the log lines would slow the server down."""
+
+    def log_request(self, code="-", size="-"):
+        pass
+
+
+def parse_mix(mix):
+    """Returns the route names and weights from a string such as 'events=4,event=2'."""
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in ROUTES:
+            raise argparse.ArgumentTypeError(f"unknown route {name!r}, choose from {', '.join(ROUTES)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def prepare_database(events):
+    """Creates the benchmark database and returns its path and the keys the requests choose from.
+
+    This runs in its own process, so the server processes forked later do not inherit its app or connections.
+    """
+    from paralympics import db
+    from paralympics.models import Event, Region
+
+    app, db_path = create_bench_app(events=events)
+    with app.app_context():
+        keys = {
+            "nocs": db.session.execute(db.select(Region.NOC)).scalars().all(),
+            "max_id": db.session.execute(db.select(db.func.max(Event.id))).scalar_one(),
+        }
+    return db_path, keys
+
+
+def serve(fd, db_path, config):
+    """Serves the app on the listening socket fd until the process is terminated."""
+    app, _ = create_bench_app(db_path=db_path, **config)
+    server = make_server(HOST, 0, app, threaded=True, request_handler=QuietRequestHandler, fd=fd)
+    server.serve_forever()
+
+
+def wait_for_server(port, timeout=30):
+    """Waits until the server accepts connections, raising TimeoutError if it has not started after timeout seconds."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            connection = http.client.HTTPConnection(HOST, port, timeout=5)
+            connection.request("GET", "/regions?limit=1")
+            connection.getresponse().read()
+            connection.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"the server did not start on port {port}")
+            time.sleep(0.1)
+
+
+def send(connection, method, path, body=None, token=None):
+    """Sends a request and returns the status code and decoded JSON body, or None if the body is not JSON."""
+    headers = {}
+    if body is not None:
+        body = json.dumps(body)
+        headers["Content-Type"] = "application/json"
+    if token is not None:
+        headers["Authorization"] = token
+    connection.request(method, path, body=body, headers=headers)
+    response = connection.getresponse()
+    data = response.read()
+    if response.getheader("Content-Type", "").startswith("application/json"):
+        return response.status, json.loads(data)
+    return response.status, None
+
+
+def login(connection):
+    """Returns a new token for the load test user."""
+    status, data = send(connection, "POST", "/login", USER)
+    if status != 201:
+        raise RuntimeError(f"login failed with status {status}: {data}")
+    return data["token"]
+
+
+def run_client(port, keys, weights, threads, seconds, seed):
+    """Runs the request threads of one client process and returns their latencies and status counts by route."""
+    names = list(weights)
+    route_weights = list(weights.values())
+    latencies = {name: [] for name in names}
+    statuses = {name: Counter() for name in names}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def run_thread(thread_seed):
+        rnd = random.Random(thread_seed)
+        connection = http.client.HTTPConnection(HOST, port, timeout=30)
+        token = login(connection) if AUTH_ROUTES & set(names) else None
+        while time.perf_counter() < deadline:
+            name = rnd.choices(names, route_weights)[0]
+            method, path, body = ROUTES[name](rnd, keys)
+            start = time.perf_counter()
+            try:
+                status, _ = send(connection, method, path, body, token if name in AUTH_ROUTES else None)
+                if status == 401 and name in AUTH_ROUTES:
+                    # The token has expired, get a new one and send the request again
+                    token = login(connection)
+                    start = time.perf_counter()
+                    status, _ = send(connection, method, path, body, token)
+            except (OSError, http.client.HTTPException):
+                status = "connection error"
+                connection.close()
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies[name].append(elapsed)
+                statuses[name][status] += 1
+        connection.close()
+
+    workers = [threading.Thread(target=run_thread, args=(seed * 1000 + i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return latencies, statuses
+
+
+def report(name, latencies, statuses, elapsed):
+    """Prints one line of the results table."""
+    summary = summarise(latencies, elapsed)
+    total = sum(statuses.values())
+    errors = sum(count for status, count in statuses.items() if not isinstance(status, int) or status >= 500)
+    client_errors = sum(count for status, count in statuses.items() if isinstance(status, int) and 400 <= status < 500)
+    print(f"{name:>16} {summary['requests']:>8} {summary['throughput']:>8.1f} {summary['p50_ms']:>8.2f} "
+          f"{summary['p95_ms']:>8.2f} {summary['p99_ms']:>8.2f} {errors / total if total else 0:>8.2%} "
+          f"{client_errors:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=10000, help="number of synthetic events to add")
+    parser.add_argument("--workers", type=int, default=4, help="number of server processes")
+    parser.add_argument("--clients", type=int, default=2, help="number of client processes")
+    parser.add_argument("--threads", type=int, default=4, help="threads in each client process")
+    parser.add_argument("--seconds", type=float, default=20, help="how long to send requests for")
+    parser.add_argument("--port", type=int, default=0, help="port on 127.0.0.1 to serve on, 0 for any free port")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"route weights, default {DEFAULT_MIX}")
+    parser.add_argument("--no-cache", action="store_true", help="turn off the response cache")
+    args = parser.parse_args()
+
+    config = {"RESPONSE_CACHE": "paralympics.cache.NullCache"} if args.no_cache else {}
+    spawn = multiprocessing.get_context("spawn")
+    print(f"Creating the database with {args.events} events")
+    with spawn.Pool(1) as pool:
+        db_path, keys = pool.apply(prepare_database, (args.events,))
+
+    # The workers inherit the listening socket and the kernel shares the connections between them
+    listener = socket.create_server((HOST, args.port), backlog=128)
+    port = listener.getsockname()[1]
+    fork = multiprocessing.get_context("fork")
+    servers = [fork.Process(target=serve, args=(listener.fileno(), db_path, config), daemon=True)
+               for _ in range(args.workers)]
+    try:
+        for server in servers:
+            server.start()
+        wait_for_server(port)
+        connection = http.client.HTTPConnection(HOST, port)
+        send(connection, "POST", "/register", USER)
+        connection.close()
+
+        print(f"Sending requests to http://{HOST}:{port} from {args.clients} processes with {args.threads} threads "
+              f"each, served by {args.workers} processes, for {args.seconds} seconds")
+        with spawn.Pool(args.clients) as pool:
+            client_args = [(port, keys, args.mix, args.threads, args.seconds, seed) for seed in range(args.clients)]
+            results = pool.starmap(run_client, client_args)
+    finally:
+        for server in servers:
+            server.terminate()
+        for server in servers:
+            server.join()
+        listener.close()
+        remove_bench_db(db_path)
+
+    print(f"{'route':>16} {'requests':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>8} "
+          f"{'4xx':>6}")
+    all_latencies, all_statuses = [], Counter()
+    for name in args.mix:
+        latencies = [latency for client_latencies, _ in results for latency in client_latencies[name]]
+        statuses = sum((client_statuses[name] for _, client_statuses in results), Counter())
+        report(name, latencies, statuses, args.seconds)
+        all_latencies += latencies
+        all_statuses += statuses
+    report("total", all_latencies, all_statuses, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Measures the logging cost per request with a synchronous FileHandler and with the queue in paralympics.logs.
+
+PATCH /regions/<code> logs two records on every request, and GET of a region that does not exist logs one. Each is
+timed with the app's logger set up in three ways:
+
+    off    no handlers, the records are not written
+    sync   a FileHandler on the request thread, as configure_logging() used to add
+    queue  the LogQueueHandler, with the listener writing JSON lines to the file
+
+--slow-disk adds a delay to every write to the file, to show what a request waits for when the disk is slow or busy.
+
+    python -m benchmarks.bench_logging --requests 2000 --slow-disk 0.001
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import create_bench_app, remove_bench_db
+from paralympics.logs import JSONFormatter, get_queue_handler, start_queue_logging
+from paralympics.utils import LOG_FORMAT
+
+USER = {"email": "logging@example.com", "password": "logging-password"}
+
+
+class SlowFileHandler(logging.FileHandler):
+    """FileHandler that sleeps for delay seconds after each record, like a slow disk."""
+
+    def __init__(self, filename, delay):
+        super().__init__(filename)
+        self.write_delay = delay
+
+    def emit(self, record):
+        super().emit(record)
+        if self.write_delay:
+            time.sleep(self.write_delay)
+
+
+def set_logging(logger, mode, log_path, delay):
+    """Replaces the handlers of the logger with those for the mode and returns them."""
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    if mode == "sync":
+        handler = SlowFileHandler(log_path, delay)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        logger.addHandler(handler)
+    elif mode == "queue":
+        file_handler = SlowFileHandler(log_path, delay)
+        file_handler.setFormatter(JSONFormatter())
+        logger.addHandler(start_queue_logging([file_handler]))
+    logger.disabled = mode == "off"
+    # Only time the handler of the mode, not the root logger's handlers
+    logger.propagate = False
+
+
+def time_requests(send, requests):
+    """Returns the mean seconds per request."""
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = send()
+        assert response.status_code in (200, 404), response.data
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000, help="timed requests for each scenario and mode")
+    parser.add_argument("--slow-disk", type=float, default=0.0, help="seconds added to every write to the log file")
+    args = parser.parse_args()
+
+    app, db_path = create_bench_app(RESPONSE_CACHE="paralympics.cache.NullCache")
+    fd, log_path = tempfile.mkstemp(suffix=".log", prefix="paralympics_bench_")
+    os.close(fd)
+    try:
+        client = app.test_client()
+        client.post("/register", json=USER)
+        token = client.post("/login", json=USER).json["token"]
+        scenarios = {
+            "PATCH /regions/<code>": lambda: client.patch("/regions/GBR", json={"notes": "Logging benchmark"},
+                                                          headers={"Authorization": token}),
+            "GET /regions/<missing>": lambda: client.get("/regions/ZZ9"),
+        }
+        print(f"{'scenario':>24} {'off us':>8} {'sync us':>8} {'queue us':>9} {'sync cost':>10} {'queue cost':>11}")
+        for name, send in scenarios.items():
+            times = {}
+            for mode in ("off", "sync", "queue"):
+                set_logging(app.logger, mode, log_path, args.slow_disk)
+                # Warm up
+                time_requests(send, 50)
+                times[mode] = time_requests(send, args.requests) * 1e6
+                # Include the time the listener needs to catch up, so the queue is empty for the next mode
+                handler = get_queue_handler(app.logger)
+                if handler is not None:
+                    handler.close()
+            off = times["off"]
+            print(f"{name:>24} {off:>8.1f} {times['sync']:>8.1f} {times['queue']:>9.1f} "
+                  f"{times['sync'] - off:>10.1f} {times['queue'] - off:>11.1f}")
+    finally:
+        set_logging(app.logger, "off", log_path, 0)
+        os.unlink(log_path)
+        remove_bench_db(db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Load test of read-route latency during a storm of logins.
+
+Reader threads call GET /events?limit=20 for a fixed time, first on their own and then while login threads call
+POST /login as fast as they can. The response cache is turned off so every read uses the database. With the hashing
+pool, the reads stay fast during the storm and the logins that do not fit in the queue get 503. Setting --workers and
+--queue to at least the number of login threads approximates hashing on the request thread, for comparison.
+
+    python -m benchmarks.bench_login_storm --logins 16 --workers 2 --queue 8
+"""
+import argparse
+import threading
+import time
+from collections import Counter
+
+from benchmarks.synthetic import create_bench_app, remove_bench_db
+from benchmarks.timing import summarise
+
+USER = {"email": "storm@example.com", "password": "storm-password"}
+
+
+def read_loop(app, stop, latencies):
+    client = app.test_client()
+    while not stop.is_set():
+        start = time.perf_counter()
+        client.get("/events?limit=20")
+        latencies.append(time.perf_counter() - start)
+
+
+def login_loop(app, stop, statuses):
+    client = app.test_client()
+    while not stop.is_set():
+        response = client.post("/login", json=USER)
+        statuses[response.status_code] += 1
+        if response.status_code == 503:
+            # Back off as a well-behaved client would
+            stop.wait(float(response.headers["Retry-After"]))
+
+
+def run_phase(app, readers, logins, seconds):
+    """Runs the reader threads, and login threads if logins > 0, for seconds and returns the results."""
+    stop = threading.Event()
+    latencies = []
+    statuses = Counter()
+    threads = [threading.Thread(target=read_loop, args=(app, stop, latencies)) for _ in range(readers)]
+    threads += [threading.Thread(target=login_loop, args=(app, stop, statuses)) for _ in range(logins)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return summarise(latencies, time.perf_counter() - start), statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readers", type=int, default=2, help="number of threads calling GET /events")
+    parser.add_argument("--logins", type=int, default=16, help="number of threads calling POST /login")
+    parser.add_argument("--workers", type=int, default=2, help="PASSWORD_HASH_WORKERS")
+    parser.add_argument("--queue", type=int, default=8, help="PASSWORD_HASH_QUEUE")
+    parser.add_argument("--seconds", type=float, default=5, help="length of each phase")
+    args = parser.parse_args()
+
+    app, db_path = create_bench_app(RESPONSE_CACHE="paralympics.cache.NullCache",
+                                    PASSWORD_HASH_WORKERS=args.workers, PASSWORD_HASH_QUEUE=args.queue)
+    try:
+        app.test_client().post("/register", json=USER)
+        quiet, _ = run_phase(app, args.readers, 0, args.seconds)
+        storm, statuses = run_phase(app, args.readers, args.logins, args.seconds)
+    finally:
+        remove_bench_db(db_path)
+
+    print(f"hashing pool: {args.workers} workers, queue {args.queue}; {args.logins} login threads")
+    print(f"{'GET /events':<14} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, result in (("no logins", quiet), ("login storm", storm)):
+        print(f"{name:<14} {result['throughput']:>8.0f} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} "
+              f"{result['p99_ms']:>8.2f}")
+    print("login responses: " + ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items())))
+
+
+if __name__ == "__main__":
+    main()
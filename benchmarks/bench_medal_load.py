@@ -0,0 +1,48 @@
+"""
+Compares the time to load the medals from data/medals.xlsx with the time to load them from the Parquet cache.
+
+Each load is repeated and the median and fastest times are reported. The Parquet cache is written to a temporary
+directory, so the cache in the instance folder is not changed.
+
+    python -m benchmarks.bench_medal_load --repeat 10
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from paralympics.utils import DATA_DIR, load_medal_frame, read_medals_xlsx
+
+
+def time_calls(fn, repeat):
+    """Calls fn repeat times and returns the seconds taken by each call."""
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10, help="number of times to load with each method")
+    args = parser.parse_args()
+
+    xlsx_file = DATA_DIR.joinpath("medals.xlsx")
+    with tempfile.TemporaryDirectory(prefix="paralympics_bench_") as cache_dir:
+        parquet_file = os.path.join(cache_dir, "medals.parquet")
+        # The first call writes the cache, which is not included in the Parquet times
+        rows = len(load_medal_frame(xlsx_file, parquet_file))
+        methods = [("xlsx", lambda: read_medals_xlsx(xlsx_file)),
+                   ("parquet cache", lambda: load_medal_frame(xlsx_file, parquet_file))]
+        print(f"{rows} medal rows, {args.repeat} loads each")
+        print(f"{'method':>14} {'median ms':>10} {'min ms':>8}")
+        for name, load in methods:
+            seconds = time_calls(load, args.repeat)
+            print(f"{name:>14} {statistics.median(seconds) * 1000:>10.1f} {min(seconds) * 1000:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
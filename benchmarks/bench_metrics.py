@@ -0,0 +1,61 @@
+"""
+Measures the cost per request of the metrics recorded by paralympics.metrics.
+
+The same requests are timed in an app with METRICS_ENABLED and in one without, each in its own process as a process
+only registers the routes for its first app. The runs alternate between the two apps to spread out any noise from
+the machine. A cached response is the cheapest request, so it shows the largest relative overhead, and a page of
+/events shows the cost of the SQL events.
+
+    python -m benchmarks.bench_metrics --requests 5000 --rounds 3
+"""
+import argparse
+import multiprocessing
+import statistics
+import time
+
+from benchmarks.synthetic import create_bench_app, remove_bench_db
+
+# name -> (path, config)
+SCENARIOS = {
+    "cached GET /events/1": ("/events/1", {}),
+    "GET /events?limit=20": ("/events?limit=20", {"RESPONSE_CACHE": "paralympics.cache.NullCache"}),
+}
+
+
+def time_requests(enabled, path, config, requests):
+    """Returns the mean seconds per request for path in a new app with metrics enabled or not."""
+    app, db_path = create_bench_app(METRICS_ENABLED=enabled, **config)
+    try:
+        client = app.test_client()
+        # Warm up the cache and the connection pool
+        for _ in range(50):
+            client.get(path)
+        start = time.perf_counter()
+        for _ in range(requests):
+            client.get(path)
+        return (time.perf_counter() - start) / requests
+    finally:
+        remove_bench_db(db_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000, help="requests timed in each run")
+    parser.add_argument("--rounds", type=int, default=3, help="runs with each setting")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{'scenario':>24} {'off us':>8} {'on us':>8} {'cost us':>8} {'cost %':>7}")
+    for name, (path, config) in SCENARIOS.items():
+        times = {False: [], True: []}
+        for _ in range(args.rounds):
+            for enabled in (False, True):
+                with context.Pool(1) as pool:
+                    times[enabled].append(pool.apply(time_requests, (enabled, path, config, args.requests)))
+        off = statistics.median(times[False]) * 1e6
+        on = statistics.median(times[True]) * 1e6
+        print(f"{name:>24} {off:>8.1f} {on:>8.1f} {on - off:>8.1f} {(on - off) / off * 100:>6.1f}%")
+
+
+if __name__ == "__main__":
+    main()
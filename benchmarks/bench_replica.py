@@ -0,0 +1,164 @@
+"""
+Mixed read and write workload with and without a read replica.
+
+Several worker processes, each with several threads, share the database like a multi-worker server. Each thread
+repeatedly makes a heavy read (a CSV export of one year of events, or the analytics), a light read (a page of /events)
+or, with probability --write-ratio, a write (a PATCH of an event, followed by a GET of it from the same client).
+
+With --mode primary every request uses one SQLite file. With --mode replica, READ_REPLICA_BIND is set to a second
+file, the GET requests read it, and the main process copies the primary to it with sync_replica() every
+--sync-interval seconds. The default, --mode both, runs one after the other. The GET after each write checks
+read-your-writes: if it does not return the value just written it is counted as stale, which should never happen.
+
+    python -m benchmarks.bench_replica --events 50000 --processes 4 --threads 4 --seconds 10 --write-ratio 0.2
+"""
+import argparse
+import multiprocessing
+import random
+import threading
+import time
+
+from benchmarks.synthetic import create_bench_app, remove_bench_db
+from benchmarks.timing import summarise
+from paralympics.replica import sync_replica
+
+KINDS = ("heavy", "light", "write")
+
+
+def replica_config(replica_path):
+    """Returns the config that reads the GET requests from the replica file."""
+    return {"SQLALCHEMY_BINDS": {"replica": "sqlite:///" + replica_path}, "READ_REPLICA_BIND": "replica"}
+
+
+def heavy_read(client, rnd):
+    """Exports the events of one year as CSV, or reads the analytics, and returns the status code."""
+    if rnd.random() < 0.5:
+        return client.get("/events/export", query_string={"format": "csv", "year": rnd.randint(1960, 2024)}).status_code
+    return client.get("/analytics/participants").status_code
+
+
+def light_read(client, rnd, max_id):
+    """Reads a page of events and returns the status code."""
+    return client.get("/events", query_string={"limit": 50, "after": rnd.randint(0, max_id)}).status_code
+
+
+def write(client, rnd, max_id):
+    """Updates an event and reads it back. Returns the worst status code and whether the read was stale."""
+    event_id = rnd.randint(1, max_id)
+    participants = rnd.randint(100, 5000)
+    patched = client.patch(f"/events/{event_id}", json={"participants": participants}).status_code
+    response = client.get(f"/events/{event_id}")
+    stale = patched == 200 and response.status_code == 200 and response.json["participants"] != participants
+    return max(patched, response.status_code), stale
+
+
+def run_worker(db_path, config, threads, seconds, ratios, max_id, seed):
+    """Runs the requests of one worker process and returns the latencies and error counts of its threads."""
+    app, _ = create_bench_app(db_path=db_path, **config)
+    results = {kind: [] for kind in KINDS}
+    results.update({f"{kind}_errors": 0 for kind in KINDS}, stale=0)
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def run_thread(thread_seed):
+        rnd = random.Random(thread_seed)
+        # Each thread is a client with its own cookies
+        client = app.test_client()
+        while time.perf_counter() < deadline:
+            kind = rnd.choices(KINDS, ratios)[0]
+            stale = False
+            start = time.perf_counter()
+            if kind == "heavy":
+                status = heavy_read(client, rnd)
+            elif kind == "light":
+                status = light_read(client, rnd, max_id)
+            else:
+                status, stale = write(client, rnd, max_id)
+            elapsed = time.perf_counter() - start
+            with lock:
+                results[kind].append(elapsed)
+                results["stale"] += stale
+                if status >= 500:
+                    results[f"{kind}_errors"] += 1
+
+    workers = [threading.Thread(target=run_thread, args=(seed * 1000 + i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results
+
+
+def run_mode(mode, db_path, args):
+    """Runs the workload with or without the replica, and returns the results of each worker and the sync times."""
+    # The response cache is per process, so turn it off to make every read use the database
+    config = {"RESPONSE_CACHE": "paralympics.cache.NullCache"}
+    syncs = []
+    stop = threading.Event()
+    replica_path = db_path + ".replica.sqlite"
+    if mode == "replica":
+        config.update(replica_config(replica_path))
+        app, _ = create_bench_app(db_path=db_path, **config)
+        syncs.append(sync_replica(app))
+
+        def run_syncs():
+            while not stop.wait(args.sync_interval):
+                syncs.append(sync_replica(app))
+
+        syncer = threading.Thread(target=run_syncs)
+        syncer.start()
+    try:
+        # Spawn rather than fork, so the workers do not share the connections of this process
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(args.processes) as pool:
+            ratios = ((1 - args.write_ratio) * args.heavy_ratio, (1 - args.write_ratio) * (1 - args.heavy_ratio),
+                      args.write_ratio)
+            jobs = [(db_path, config, args.threads, args.seconds, ratios, args.events, seed)
+                    for seed in range(args.processes)]
+            worker_results = pool.starmap(run_worker, jobs)
+    finally:
+        if mode == "replica":
+            stop.set()
+            syncer.join()
+            remove_bench_db(replica_path)
+    return worker_results, syncs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("primary", "replica", "both"), default="both",
+                        help="read the GET requests from the primary, the replica or run both")
+    parser.add_argument("--processes", type=int, default=4, help="number of worker processes")
+    parser.add_argument("--threads", type=int, default=4, help="threads in each worker process")
+    parser.add_argument("--seconds", type=float, default=10, help="how long to run the requests for")
+    parser.add_argument("--write-ratio", type=float, default=0.2, help="fraction of the requests that are writes")
+    parser.add_argument("--heavy-ratio", type=float, default=0.3, help="fraction of the reads that are heavy")
+    parser.add_argument("--sync-interval", type=float, default=2, help="seconds between syncs of the replica")
+    parser.add_argument("--events", type=int, default=50000, help="number of synthetic events to add")
+    args = parser.parse_args()
+
+    _, db_path = create_bench_app(events=args.events)
+    modes = ("primary", "replica") if args.mode == "both" else (args.mode,)
+    try:
+        results = {mode: run_mode(mode, db_path, args) for mode in modes}
+    finally:
+        remove_bench_db(db_path)
+
+    print(f"{args.processes} processes x {args.threads} threads for {args.seconds}s, {args.events} events, "
+          f"write ratio {args.write_ratio}, heavy read ratio {args.heavy_ratio}")
+    print(f"{'mode':>8} {'kind':>6} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8}")
+    for mode, (worker_results, syncs) in results.items():
+        for kind in KINDS:
+            samples = [s for result in worker_results for s in result[kind]]
+            errors = sum(result[f"{kind}_errors"] for result in worker_results)
+            stats = summarise(samples, args.seconds)
+            print(f"{mode:>8} {kind:>6} {stats['requests']:>9} {errors:>7} {stats['throughput']:>8.1f} "
+                  f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+        stale = sum(result["stale"] for result in worker_results)
+        sync_note = f", {len(syncs)} syncs of {max(syncs):.2f}s at most" if syncs else ""
+        print(f"{mode:>8} stale reads after a write: {stale}{sync_note}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+Benchmark of every route in routes.py on a database of synthetic regions, events and users.
+
+The database has the real data plus the synthetic rows from benchmarks.synthetic, so it can be scaled from a few
+thousand to millions of events. Each scenario sends the same number of requests through the Flask test client, one
+at a time, choosing a new event id, region code or page for each request from a seeded random generator so that the
+runs are repeatable. The response cache is turned off unless --cache is given, so the times are those of the routes
+rather than of the cache.
+
+The throughput and the p50, p95 and p99 latency of each scenario can be saved as JSON with --output. Given a
+--baseline file saved by an earlier run, each scenario is compared with it, and the exit status is 1 if the chosen
+percentile of any scenario is slower than the baseline by more than --threshold.
+
+    python -m benchmarks.bench_routes --events 100000 --output baseline.json
+    python -m benchmarks.bench_routes --events 100000 --baseline baseline.json --threshold 0.2
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+from benchmarks.synthetic import EventFaker, create_bench_app, insert_users, remove_bench_db
+from benchmarks.timing import summarise
+from paralympics import db
+from paralympics.models import Event, Region
+
+USER = {"email": "bench@example.com", "password": "bench-password"}
+
+# Words from the Faker sentences in the event highlights, for the searches
+SEARCH_WORDS = ("story", "develop", "whole", "network", "wonder", "possible", "economy", "national")
+
+
+class Dataset:
+    """The keys of the rows in the benchmark database, and a seeded random generator to choose from them.
+
+    Args:
+        app: The benchmark app
+        token (str): Token of the benchmark user for the routes that need one
+        seed (int): Seed for the random choices
+    """
+
+    def __init__(self, app, token, seed=0):
+        self.random = random.Random(seed)
+        self.token = token
+        with app.app_context():
+            self.nocs = db.session.execute(db.select(Region.NOC).order_by(Region.NOC)).scalars().all()
+            self.medal_nocs = db.session.execute(
+                db.text("SELECT DISTINCT NOC FROM medal ORDER BY NOC")).scalars().all()
+            self.max_id = db.session.execute(db.select(db.func.max(Event.id))).scalar_one()
+        self.event_faker = EventFaker(self.nocs, seed=seed)
+        # Events added by POST /events are deleted by DELETE /events/<id>, so the size of the table does not change
+        self.added_ids = []
+        self.new_regions = 0
+
+    def event_id(self):
+        return self.random.randint(1, self.max_id)
+
+    def noc(self):
+        return self.random.choice(self.nocs)
+
+    def new_noc(self):
+        """Returns a code for a new region, the codes are digits so they are not used by the real or synthetic ones."""
+        self.new_regions += 1
+        return f"{self.new_regions % 1000:03d}"
+
+
+def auth(dataset):
+    return {"Authorization": dataset.token}
+
+
+def add_event(client, dataset):
+    response = client.post("/events", json=dataset.event_faker.json_row())
+    dataset.added_ids.append(int(response.json["message"].rsplit("=", 1)[1]))
+    return response
+
+
+def delete_event(client, dataset):
+    return client.delete(f"/events/{dataset.added_ids.pop()}")
+
+
+def add_and_delete_region(client, dataset):
+    code = dataset.new_noc()
+    client.post("/regions", json={"NOC": code, "region": "Benchmark"})
+    return client.delete(f"/regions/{code}")
+
+
+# name -> function(client, dataset) that sends one request and returns the response. The scenarios run in this
+# order, so POST /events comes before the DELETE that removes its events.
+SCENARIOS = {
+    "GET /regions": lambda c, d: c.get("/regions"),
+    "GET /regions?limit=50": lambda c, d: c.get(f"/regions?limit=50&after={d.noc()}"),
+    "GET /regions?embed=events": lambda c, d: c.get(f"/regions?embed=events&limit=5&after={d.noc()}"),
+    "GET /regions/<code>": lambda c, d: c.get(f"/regions/{d.noc()}"),
+    "GET /events?limit=100": lambda c, d: c.get(f"/events?limit=100&after={d.event_id()}"),
+    "GET /events?NOC=&type=": lambda c, d: c.get(f"/events?NOC={d.noc()}&type=summer&limit=100"),
+    "GET /events?year=": lambda c, d: c.get(f"/events?year={d.random.randint(1960, 2024)}&limit=100"),
+    "GET /events?start_after=": lambda c, d: c.get(f"/events?start_after=01/01/{d.random.randint(1960, 2024)}"
+                                                   f"&limit=100"),
+    "GET /events?end_before=": lambda c, d: c.get(f"/events?end_before=20/08/{d.random.randint(1960, 1962)}&limit=100"),
+    "GET /events?fields=": lambda c, d: c.get(f"/events?fields=year,host&limit=1000&after={d.event_id()}"),
+    "GET /events?embed=region": lambda c, d: c.get(f"/events?embed=region&limit=100&after={d.event_id()}"),
+    "GET /events/<id>": lambda c, d: c.get(f"/events/{d.event_id()}"),
+    "GET /events/<id>?embed=region": lambda c, d: c.get(f"/events/{d.event_id()}?embed=region"),
+    "GET /events/export?NOC=": lambda c, d: c.get(f"/events/export?NOC={d.noc()}"),
+    "GET /events/export?format=csv": lambda c, d: c.get(f"/events/export?format=csv&NOC={d.noc()}"),
+    "GET /events/search": lambda c, d: c.get(f"/events/search?q={d.random.choice(SEARCH_WORDS)}"),
+    "GET /medals": lambda c, d: c.get("/medals"),
+    "GET /medals/<code>": lambda c, d: c.get(f"/medals/{d.random.choice(d.medal_nocs)}"),
+    "GET /analytics/participants": lambda c, d: c.get("/analytics/participants"),
+    "GET /analytics/female-ratio": lambda c, d: c.get("/analytics/female-ratio"),
+    "GET /analytics/hosts": lambda c, d: c.get("/analytics/hosts"),
+    "POST /events": add_event,
+    "PATCH /events/<id>": lambda c, d: c.patch(f"/events/{d.event_id()}", json={"sports": d.random.randint(2, 25)}),
+    "DELETE /events/<id>": delete_event,
+    "POST+DELETE /regions": add_and_delete_region,
+    "PATCH /regions/<code>": lambda c, d: c.patch(f"/regions/{d.noc()}", json={"notes": "Benchmark"},
+                                                  headers=auth(d)),
+    "POST /login": lambda c, d: c.post("/login", json=USER),
+}
+
+
+def run_scenario(client, dataset, send, requests, warmup):
+    """Sends warmup and then requests requests with send and returns the summary of the timed requests."""
+    for _ in range(warmup):
+        send(client, dataset)
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(requests):
+        request_start = time.perf_counter()
+        response = send(client, dataset)
+        # Read the whole body, so the streamed responses are included
+        response.get_data()
+        latencies.append(time.perf_counter() - request_start)
+        assert response.status_code < 400, (response.status_code, response.get_data(as_text=True)[:200])
+    return summarise(latencies, time.perf_counter() - start)
+
+
+def compare(results, baseline, metric, threshold):
+    """Returns a dict of scenario -> (baseline, current, change) and the list of scenarios that regressed.
+
+    Args:
+        results (dict): Summaries of this run by scenario
+        baseline (dict): Summaries of the baseline run by scenario, scenarios missing from it are skipped
+        metric (str): Key of the summaries to compare, e.g. p95_ms
+        threshold (float): Largest allowed increase as a fraction of the baseline, e.g. 0.2 for 20%
+    """
+    changes = {}
+    regressions = []
+    for name, summary in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name][metric], summary[metric]
+        change = (after - before) / before if before else 0.0
+        changes[name] = (before, after, change)
+        if change > threshold:
+            regressions.append(name)
+    return changes, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=10000, help="number of synthetic events to add")
+    parser.add_argument("--regions", type=int, default=0, help="number of synthetic regions to add")
+    parser.add_argument("--users", type=int, default=1000, help="number of synthetic users to add")
+    parser.add_argument("--requests", type=int, default=200, help="timed requests for each scenario")
+    parser.add_argument("--warmup", type=int, default=10, help="untimed requests before each scenario")
+    parser.add_argument("--routes", help="only run the scenarios whose names contain this text")
+    parser.add_argument("--cache", action="store_true", help="keep the response cache turned on")
+    parser.add_argument("--output", help="file to save the results to as JSON")
+    parser.add_argument("--baseline", help="JSON file of earlier results to compare with")
+    parser.add_argument("--metric", default="p95_ms", choices=("p50_ms", "p95_ms", "p99_ms", "mean_ms"),
+                        help="latency compared with the baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="largest allowed increase of --metric as a fraction of the baseline")
+    args = parser.parse_args()
+
+    settings = {"events": args.events, "regions": args.regions, "users": args.users, "requests": args.requests,
+                "cache": args.cache}
+    config = {} if args.cache else {"RESPONSE_CACHE": "paralympics.cache.NullCache"}
+    print(f"Creating the database with {args.events} events, {args.regions} extra regions and {args.users} users")
+    app, db_path = create_bench_app(events=args.events, regions=args.regions, **config)
+    try:
+        client = app.test_client()
+        client.post("/register", json=USER)
+        with app.app_context():
+            insert_users(args.users, "synthetic-password")
+        dataset = Dataset(app, client.post("/login", json=USER).json["token"])
+        scenarios = {name: send for name, send in SCENARIOS.items() if not args.routes or args.routes in name}
+        if "DELETE /events/<id>" in scenarios and "POST /events" not in scenarios:
+            scenarios = {"POST /events": add_event, **scenarios}
+
+        results = {}
+        print(f"{'scenario':>30} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for name, send in scenarios.items():
+            # DELETE removes the events added by POST, so it is not warmed up in case that removes too many
+            warmup = 0 if name == "DELETE /events/<id>" else args.warmup
+            summary = results[name] = run_scenario(client, dataset, send, args.requests, warmup)
+            print(f"{name:>30} {summary['throughput']:>8.0f} {summary['p50_ms']:>8.2f} {summary['p95_ms']:>8.2f} "
+                  f"{summary['p99_ms']:>8.2f}")
+    finally:
+        remove_bench_db(db_path)
+
+    if args.output:
+        run = {
+            "settings": settings,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(run, f, indent=2)
+        print(f"Saved the results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["settings"] != settings:
+            print(f"Warning: the baseline was run with different settings {baseline['settings']}")
+        changes, regressions = compare(results, baseline["results"], args.metric, args.threshold)
+        print(f"\n{'scenario':>30} {'baseline':>9} {'current':>9} {'change':>8}   ({args.metric})")
+        for name, (before, after, change) in changes.items():
+            flag = "  REGRESSION" if name in regressions else ""
+            print(f"{name:>30} {before:>9.2f} {after:>9.2f} {change * 100:>7.1f}%{flag}")
+        if regressions:
+            print(f"{len(regressions)} scenario(s) slower than the baseline by more than {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Measures the latency of /events/search on a database of synthetic events.
+
+The queries are taken from the synthetic values: a host city, which matches few events, a word from the highlights,
+which matches many, and two words from the highlights. The response cache is turned off so that every request runs
+the search. --candidates sets SEARCH_RANK_CANDIDATES, use 0 to rank every match as the app does by default.
+
+    python -m benchmarks.bench_search --events 1000000 --requests 200 --candidates 1000
+"""
+import argparse
+import time
+
+from benchmarks.synthetic import EventFaker, create_bench_app, remove_bench_db
+from benchmarks.timing import summarise
+
+
+def search_queries(seed=0):
+    """Returns a dict of query name to q values, built from the same pools of values as the synthetic events."""
+    faker = EventFaker([], seed=seed)
+    words = [word.strip(".").lower() for word in faker.highlights[0].split()]
+    return {
+        "host": [host.split()[0] for host in faker.hosts[:50]],
+        "one word": words[:5],
+        "two words": [f"{a} {b}" for a, b in zip(words, words[1:])][:5],
+    }
+
+
+def time_queries(client, queries, requests, limit):
+    """Requests /events/search for each query in turn and returns the latencies in seconds and the elapsed time."""
+    samples = []
+    start = time.perf_counter()
+    for i in range(requests):
+        q = queries[i % len(queries)]
+        request_start = time.perf_counter()
+        response = client.get("/events/search", query_string={"q": q, "limit": limit})
+        samples.append(time.perf_counter() - request_start)
+        assert response.status_code == 200, response.data
+    return samples, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=1000000, help="number of synthetic events to add")
+    parser.add_argument("--requests", type=int, default=200, help="requests for each kind of query")
+    parser.add_argument("--limit", type=int, default=20, help="results per search")
+    parser.add_argument("--candidates", type=int, default=1000, help="SEARCH_RANK_CANDIDATES, 0 ranks every match")
+    args = parser.parse_args()
+
+    print(f"Creating a database with {args.events} synthetic events")
+    app, db_path = create_bench_app(events=args.events, RESPONSE_CACHE="paralympics.cache.NullCache",
+                                    SEARCH_RANK_CANDIDATES=args.candidates)
+    try:
+        client = app.test_client()
+        print(f"{'query':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for name, queries in search_queries().items():
+            samples, elapsed = time_queries(client, queries, args.requests, args.limit)
+            stats = summarise(samples, elapsed)
+            print(f"{name:>10} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f}")
+    finally:
+        remove_bench_db(db_path)
+
+
+if __name__ == "__main__":
+    main()
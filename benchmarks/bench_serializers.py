@@ -0,0 +1,65 @@
+"""
+Compares dumping events with the EventSchema against the RowSerializer generated from it.
+
+The schema path is what GET /events used to do: select ORM objects and dump them through Marshmallow. The fast path
+selects Core rows and dumps them with the compiled serializer. Both are timed through to the JSON text.
+
+    python -m benchmarks.bench_serializers --events 100000 --repeat 3
+"""
+import argparse
+import time
+
+from flask import current_app
+
+from paralympics import db
+from paralympics.models import Event
+from paralympics.schemas import EventSchema, RowSerializer
+from benchmarks.synthetic import create_bench_app, remove_bench_db
+
+
+def schema_dump():
+    events = db.session.execute(db.select(Event).order_by(Event.id)).scalars()
+    return current_app.json.dumps(EventSchema(many=True).dump(events))
+
+
+def serializer_dump(serializer):
+    rows = db.session.execute(serializer.select().order_by(Event.id)).all()
+    return current_app.json.dumps(serializer.dump(rows))
+
+
+def best_time(func, repeat):
+    """Returns the fastest of repeat runs of func, and the result of the last run."""
+    times = []
+    for _ in range(repeat):
+        # Start each run with an empty identity map so the ORM path loads every object
+        db.session.expunge_all()
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=100000, help="number of synthetic events to add")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed runs of each path")
+    args = parser.parse_args()
+
+    app, db_path = create_bench_app(events=args.events)
+    try:
+        with app.app_context():
+            serializer = RowSerializer(EventSchema())
+            schema_seconds, schema_json = best_time(schema_dump, args.repeat)
+            fast_seconds, fast_json = best_time(lambda: serializer_dump(serializer), args.repeat)
+            rows = db.session.scalar(db.select(db.func.count(Event.id)))
+        print(f"events:           {rows}")
+        print(f"EventSchema:      {schema_seconds:.3f}s ({rows / schema_seconds:,.0f} rows/s)")
+        print(f"RowSerializer:    {fast_seconds:.3f}s ({rows / fast_seconds:,.0f} rows/s)")
+        print(f"speedup:          {schema_seconds / fast_seconds:.1f}x")
+        print(f"identical output: {schema_json == fast_json}")
+    finally:
+        remove_bench_db(db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Measures the GET routes served from the database and from a snapshot built with paralympics.snapshot.
+
+The app is created with SNAPSHOT_FILE set to a file that does not exist yet, so the requests fall through to the
+routes and the database. Each scenario is timed, the snapshot is built, and each scenario is timed again now that it
+is served from the mmap. The time to build the snapshot and its size are also reported.
+
+The response cache is off unless --cache is given, which compares the snapshot with the cached routes. Use --gzip to
+send Accept-Encoding: gzip, so the routes compress each response and the snapshot serves its compressed copy.
+
+    python -m benchmarks.bench_snapshot --events 100000 --requests 2000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.synthetic import create_bench_app, remove_bench_db
+from benchmarks.timing import summarise
+from paralympics import db
+from paralympics.models import Event, Region
+from paralympics.snapshot import build_snapshot
+
+
+def scenarios(nocs, max_id):
+    """Returns name -> function(rnd) that returns the URL to request."""
+    return {
+        "GET /regions": lambda rnd: "/regions",
+        "GET /regions/<code>": lambda rnd: f"/regions/{rnd.choice(nocs)}",
+        "GET /regions?limit=50": lambda rnd: "/regions?limit=50",
+        "GET /events?limit=50&after=": lambda rnd: f"/events?limit=50&after={rnd.randrange(50, max_id, 50)}",
+        "GET /events/<id>": lambda rnd: f"/events/{rnd.randint(1, max_id)}",
+        "GET /medals": lambda rnd: "/medals",
+        "GET /analytics/participants": lambda rnd: "/analytics/participants",
+    }
+
+
+def time_scenario(client, make_url, requests, headers, seed=0):
+    """Returns the latencies of requests to the scenario's URLs, and checks which source served them."""
+    rnd = random.Random(seed)
+    latencies = []
+    sources = set()
+    for _ in range(requests):
+        url = make_url(rnd)
+        start = time.perf_counter()
+        response = client.get(url, headers=headers)
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 200, (url, response.status_code)
+        sources.add(response.headers.get("X-Snapshot", "database"))
+    return latencies, sources
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=100000, help="number of synthetic events to add")
+    parser.add_argument("--regions", type=int, default=0, help="number of synthetic regions to add")
+    parser.add_argument("--requests", type=int, default=2000, help="timed requests for each scenario and mode")
+    parser.add_argument("--cache", action="store_true", help="keep the response cache on for the database")
+    parser.add_argument("--gzip", action="store_true", help="send Accept-Encoding: gzip")
+    args = parser.parse_args()
+
+    config = {} if args.cache else {"RESPONSE_CACHE": "paralympics.cache.NullCache"}
+    fd, snapshot_file = tempfile.mkstemp(suffix=".snapshot", prefix="paralympics_bench_")
+    os.close(fd)
+    # Until the snapshot is built the requests use the database
+    os.unlink(snapshot_file)
+    app, db_path = create_bench_app(events=args.events, regions=args.regions, SNAPSHOT_FILE=snapshot_file,
+                                    **config)
+    headers = {"Accept-Encoding": "gzip"} if args.gzip else {}
+    try:
+        with app.app_context():
+            nocs = db.session.execute(db.select(Region.NOC)).scalars().all()
+            max_id = db.session.execute(db.select(db.func.max(Event.id))).scalar_one()
+        client = app.test_client()
+        results = {}
+        for name, make_url in scenarios(nocs, max_id).items():
+            # Warm up
+            time_scenario(client, make_url, 20, headers)
+            results[name] = {"database": time_scenario(client, make_url, args.requests, headers)}
+
+        start = time.perf_counter()
+        with app.app_context():
+            count = build_snapshot(app, snapshot_file)
+        build_seconds = time.perf_counter() - start
+        print(f"Built a snapshot of {count} responses, {os.path.getsize(snapshot_file) / 1e6:.1f} MB, "
+              f"in {build_seconds:.1f}s")
+
+        for name, make_url in scenarios(nocs, max_id).items():
+            time_scenario(client, make_url, 20, headers)
+            results[name]["snapshot"] = time_scenario(client, make_url, args.requests, headers)
+    finally:
+        if os.path.exists(snapshot_file):
+            os.unlink(snapshot_file)
+        remove_bench_db(db_path)
+
+    print(f"{'scenario':>30} {'database p50 ms':>16} {'p95 ms':>8} {'snapshot p50 ms':>16} {'p95 ms':>8} "
+          f"{'speed up':>9}")
+    for name, modes in results.items():
+        (database, database_sources), (snapshot, snapshot_sources) = modes["database"], modes["snapshot"]
+        assert database_sources == {"database"} and snapshot_sources == {"HIT"}, (name, snapshot_sources)
+        database, snapshot = summarise(database, 1), summarise(snapshot, 1)
+        print(f"{name:>30} {database['p50_ms']:>16.3f} {database['p95_ms']:>8.3f} {snapshot['p50_ms']:>16.3f} "
+              f"{snapshot['p95_ms']:>8.3f} {database['p50_ms'] / snapshot['p50_ms']:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Measures the cold start of the app against a time budget.
+
+Each run starts a new Python process, so nothing is already imported, and times three stages:
+
+- import: importing the paralympics package
+- create_app: creating the app for a database that has already been initialised
+- first request: the first GET /regions, which imports nothing further but has to connect to the database
+
+The median of the runs is compared with the budget for each stage and the exit status is 1 if any is over budget.
+
+    python -m benchmarks.bench_startup --runs 5
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+from benchmarks.synthetic import create_bench_app, remove_bench_db
+
+# Run in the child process, prints the time of each stage as JSON
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+from paralympics import create_app
+imported = time.perf_counter()
+app = create_app(test_config={"SQLALCHEMY_DATABASE_URI": sys.argv[1]})
+created = time.perf_counter()
+response = app.test_client().get("/regions")
+assert response.status_code == 200
+responded = time.perf_counter()
+print(json.dumps({"import": imported - start, "create_app": created - imported, "first request": responded - created}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="number of new processes to time")
+    parser.add_argument("--import-budget", type=float, default=1.0, help="seconds allowed to import the package")
+    parser.add_argument("--create-budget", type=float, default=0.5, help="seconds allowed for create_app()")
+    parser.add_argument("--first-request-budget", type=float, default=0.25,
+                        help="seconds allowed for the first request")
+    args = parser.parse_args()
+    budgets = {"import": args.import_budget, "create_app": args.create_budget,
+               "first request": args.first_request_budget}
+
+    # Initialise the database first so the timed processes find the seed marker is current
+    _, db_path = create_bench_app()
+    try:
+        runs = []
+        for _ in range(args.runs):
+            output = subprocess.run([sys.executable, "-c", CHILD, "sqlite:///" + db_path], check=True,
+                                    capture_output=True, text=True).stdout
+            runs.append(json.loads(output.splitlines()[-1]))
+    finally:
+        remove_bench_db(db_path)
+
+    over_budget = False
+    print(f"{'stage':<15} {'median':>8} {'budget':>8}")
+    for stage, budget in budgets.items():
+        median = statistics.median(run[stage] for run in runs)
+        status = "OK" if median <= budget else "OVER"
+        over_budget = over_budget or median > budget
+        print(f"{stage:<15} {median:>7.3f}s {budget:>7.3f}s {status}")
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Synthetic data for the benchmarks.
+
+Faker is slow compared to the code being measured, so it is only used to generate small pools of realistic values.
+The rows are then built by choosing from the pools, which makes millions of rows quick to generate.
+"""
+import datetime
+import itertools
+import os
+import random
+import string
+import tempfile
+
+from faker import Faker
+from werkzeug.security import generate_password_hash
+
+from paralympics import create_app, db
+from paralympics.analytics import rebuild_summaries
+from paralympics.models import Event, Region, User
+from paralympics.schemas import DATE_FORMAT
+
+
+class EventFaker:
+    """Generates dicts of synthetic column values for the Event model.
+
+    Args:
+        nocs (list): NOC codes to use for the events, these should be regions in the database
+        seed (int): Seed for Faker and random so that the same rows are generated each run
+    """
+
+    def __init__(self, nocs, seed=0):
+        fake = Faker()
+        Faker.seed(seed)
+        self.random = random.Random(seed)
+        self.nocs = list(nocs)
+        self.countries = [fake.country() for _ in range(200)]
+        self.hosts = [fake.city() for _ in range(500)]
+        self.highlights = [fake.sentence(nb_words=12) for _ in range(1000)]
+        self.disabilities = ["Spinal injury", "Spinal injury, Amputee", "Spinal injury, Amputee, Visual impairment"]
+
+    def row(self):
+        """Returns the column values for one event."""
+        rnd = self.random
+        year = rnd.randint(1960, 2024)
+        day = rnd.randint(1, 20)
+        duration = rnd.randint(4, 12)
+        start = datetime.date(year, 8, day)
+        participants_m = rnd.randint(100, 3000)
+        participants_f = rnd.randint(50, 2000)
+        return {
+            "type": rnd.choice(("summer", "winter")),
+            "year": year,
+            "country": rnd.choice(self.countries),
+            "host": rnd.choice(self.hosts),
+            "NOC": rnd.choice(self.nocs),
+            "start": start,
+            "end": start + datetime.timedelta(days=duration),
+            "duration": duration,
+            "disabilities_included": rnd.choice(self.disabilities),
+            "countries": rnd.randint(10, 180),
+            "events": rnd.randint(50, 600),
+            "sports": rnd.randint(2, 25),
+            "participants_m": participants_m,
+            "participants_f": participants_f,
+            "participants": participants_m + participants_f,
+            "highlights": rnd.choice(self.highlights),
+        }
+
+    def json_row(self):
+        """Returns one event in the JSON format of EventSchema, which is also the format of the CSV data.
+
+        The dates are dd/mm/yyyy and countries is a string, and 'region' is set as well as 'NOC' as the schema loads
+        the relationship.
+        """
+        values = self.row()
+        values["start"] = values["start"].strftime(DATE_FORMAT)
+        values["end"] = values["end"].strftime(DATE_FORMAT)
+        values["countries"] = str(values["countries"])
+        values["region"] = values["NOC"]
+        return values
+
+    def rows(self, n):
+        """Yields the column values for n events."""
+        for _ in range(n):
+            yield self.row()
+
+
+def insert_events(n, batch_size=10000, seed=0):
+    """Inserts n synthetic events into the database of the current app context.
+
+    Args:
+        n (int): Number of events to add
+        batch_size (int): Number of rows sent to the database in each executemany
+        seed (int): Seed for the generated values
+    """
+    nocs = db.session.execute(db.select(Region.NOC)).scalars().all()
+    faker = EventFaker(nocs, seed=seed)
+    remaining = n
+    while remaining > 0:
+        size = min(batch_size, remaining)
+        db.session.execute(db.insert(Event), list(faker.rows(size)))
+        remaining -= size
+    # The bulk insert does not run the mapper events that maintain the summary tables
+    rebuild_summaries(db)
+    db.session.commit()
+
+
+def insert_regions(n, seed=0):
+    """Inserts n synthetic regions, with 3 letter codes not already used, into the database of the current app context.
+
+    Args:
+        n (int): Number of regions to add, at most the number of unused 3 letter codes
+        seed (int): Seed for the generated values
+    """
+    fake = Faker()
+    Faker.seed(seed)
+    used = set(db.session.execute(db.select(Region.NOC)).scalars())
+    codes = ("".join(letters) for letters in itertools.product(string.ascii_uppercase, repeat=3))
+    codes = itertools.islice((code for code in codes if code not in used), n)
+    rows = [{"NOC": code, "region": fake.country(), "notes": None} for code in codes]
+    db.session.execute(db.insert(Region), rows)
+    db.session.commit()
+
+
+def insert_users(n, password, method="pbkdf2:sha256:1", seed=0):
+    """Inserts n synthetic users, who all have the same password, into the database of the current app context.
+
+    The app's scrypt method would take minutes for thousands of users, so the hashes use a cheap method by default.
+    Each hash still has its own salt, as the password_hash column is unique.
+
+    Args:
+        n (int): Number of users to add
+        password (str): Password of every user
+        method (str): werkzeug hash method for the passwords
+        seed (int): Seed for the generated values
+    Returns:
+        list of the email addresses of the users
+    """
+    fake = Faker()
+    Faker.seed(seed)
+    # Faker's emails repeat, so the number makes each one unique
+    emails = [f"{i}.{fake.email()}" for i in range(n)]
+    rows = [{"email": email, "password_hash": generate_password_hash(password, method)} for email in emails]
+    db.session.execute(db.insert(User), rows)
+    db.session.commit()
+    return emails
+
+
+def create_bench_app(events=0, db_path=None, regions=0, **config):
+    """Creates an app with a new SQLite database that contains the real data plus synthetic regions and events.
+
+    Args:
+        events (int): Number of synthetic events to add
+        db_path (str): Path for the database file, defaults to a new temporary file
+        regions (int): Number of synthetic regions to add, the events are spread across these and the real regions
+        config: Any other config values for the app
+    Returns:
+        tuple (app, db_path)
+    """
+    if db_path is None:
+        fd, db_path = tempfile.mkstemp(suffix=".sqlite", prefix="paralympics_bench_")
+        os.close(fd)
+    test_config = {"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite:///" + db_path}
+    test_config.update(config)
+    app = create_app(test_config=test_config)
+    with app.app_context():
+        if regions:
+            insert_regions(regions)
+        if events:
+            insert_events(events)
+    return app, db_path
+
+
+def remove_bench_db(db_path):
+    """Deletes a database created by create_bench_app() and the files SQLite, init_db() and sync_replica() keep next to
+    it, including the jobs database of paralympics.jobs."""
+    jobs_path = os.path.splitext(db_path)[0] + "_jobs.sqlite"
+    for path in (db_path, jobs_path):
+        for suffix in ("", ".seed.json", ".sync.json", "-wal", "-shm", "-journal"):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
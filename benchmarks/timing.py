@@ -0,0 +1,35 @@
+"""
+Helpers for summarising the timings measured by the benchmarks.
+"""
+import statistics
+
+
+def percentile(samples, p):
+    """Returns the p-th percentile of samples using the nearest-rank method.
+
+    Args:
+        samples (list): Measured values, e.g. latencies in seconds
+        p (float): Percentile between 0 and 100
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return float("nan")
+    rank = max(1, round(p / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarise(samples, elapsed):
+    """Returns a dict with the count, throughput and latency percentiles in milliseconds of the samples.
+
+    Args:
+        samples (list): Latencies in seconds
+        elapsed (float): Wall time in seconds the samples were measured over
+    """
+    return {
+        "requests": len(samples),
+        "throughput": len(samples) / elapsed if elapsed else float("nan"),
+        "mean_ms": statistics.fmean(samples) * 1000 if samples else float("nan"),
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+    }
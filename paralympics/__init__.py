@@ -1,7 +1,8 @@
 import os
 
-from flask import Flask, jsonify
+from flask import Flask, g, has_request_context, jsonify
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 from flask_marshmallow import Marshmallow
 from sqlalchemy.orm import DeclarativeBase
 
@@ -11,6 +12,24 @@ class Base(DeclarativeBase):
     pass
 
 
+class RoutingSession(Session):
+    """Session that runs the statements of a request on the engine in g.read_engine, if it is set.
+
+    paralympics.replica sets g.read_engine to the read replica for the GET requests that can read from it. Otherwise
+    the engine is chosen from the bind key of the tables as usual. Tables with a bind key of their own are never read
+    from the replica.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        # Only the statements for the primary are routed, the jobs of paralympics.jobs have their own bind
+        if bind is None and has_request_context():
+            read_engine = g.get("read_engine")
+            if read_engine is not None and engine is self._db.engine:
+                return read_engine
+        return engine
+
+
 def handle_404_error(e):
     """ Error handler for 404.
 
@@ -26,7 +45,7 @@ def handle_404_error(e):
 
 # First create the db object using the SQLAlchemy constructor.
 # Pass a subclass of either DeclarativeBase or DeclarativeBaseNoMeta to the constructor.
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={"class_": RoutingSession})
 
 # Create the Marshmallow instance after SQLAlchemy
 # See https://flask-marshmallow.readthedocs.io/en/latest/#optional-flask-sqlalchemy-integration
@@ -41,7 +60,76 @@ def create_app(test_config=None):
         # Generate your own SECRET_KEY using python secrets
         SECRET_KEY='l-tirPCf1S44mWAGoWqWlA',
         # configure the SQLite database, relative to the app instance folder
-        SQLALCHEMY_DATABASE_URI="sqlite:///" + os.path.join(app.instance_path, 'paralympics.sqlite')
+        SQLALCHEMY_DATABASE_URI="sqlite:///" + os.path.join(app.instance_path, 'paralympics.sqlite'),
+        # Pragmas set on every SQLite connection. WAL lets readers run while a write is in progress, busy_timeout is
+        # how many milliseconds a writer waits for another writer before 'database is locked', and mmap_size and
+        # cache_size (negative is KiB) are the memory each connection uses to read the database file.
+        SQLITE_PRAGMAS={"journal_mode": "WAL", "synchronous": "NORMAL", "busy_timeout": 5000,
+                        "mmap_size": 268435456, "cache_size": -32000},
+        # Start the transactions of POST, PUT, PATCH and DELETE requests with BEGIN IMMEDIATE, see paralympics.engine
+        SQLITE_IMMEDIATE_WRITES=True,
+        # Engine pool for an SQLite file. Connections are kept open, rather than closed when the pool overflows, so
+        # each keeps its page cache. Set pool_size to the number of threads in each worker process.
+        SQLITE_POOL={"pool_size": 10, "max_overflow": 0, "pool_timeout": 30},
+        # The largest page that can be requested with ?limit= on the list routes
+        MAX_PAGE_LIMIT=1000,
+        # Response cache for the GET routes, set RESPONSE_CACHE to "paralympics.cache.NullCache" to turn it off
+        RESPONSE_CACHE="paralympics.cache.LRUCache",
+        RESPONSE_CACHE_MAX_ENTRIES=512,
+        RESPONSE_CACHE_TTL=300,
+        # Maximum number of verified JWTs kept by the token_required decorator, and the most seconds one is kept for. A
+        # change to a user in another worker process is only seen once the user's tokens leave this worker's cache.
+        TOKEN_CACHE_MAX_ENTRIES=1024,
+        TOKEN_CACHE_TTL=30,
+        # Werkzeug hash method and cost for passwords, existing hashes are updated when the user next logs in
+        PASSWORD_HASH_METHOD="scrypt:32768:8:1",
+        # Passwords are hashed on a pool of this many threads, with up to PASSWORD_HASH_QUEUE waiting. Once the queue
+        # is full, /register and /login return 503.
+        PASSWORD_HASH_WORKERS=2,
+        PASSWORD_HASH_QUEUE=8,
+        # /events/search ranks every matching event by default. Set this to only rank that many of the newest matches,
+        # so common words are quick to search in a large table, at the cost of older, better matches being left out.
+        # The response then has the header X-Search-Truncated: true when some matches were not ranked.
+        SEARCH_RANK_CANDIDATES=0,
+        # Record the latency, status and SQL statements of each request, and return them from /metrics
+        METRICS_ENABLED=True,
+        # Compress JSON, CSV and text responses of at least COMPRESSION_MIN_SIZE bytes with gzip or deflate, when the
+        # client accepts them. COMPRESSION_LEVEL is the zlib level from 1 (fastest) to 9 (smallest).
+        COMPRESSION_ENABLED=True,
+        COMPRESSION_MIN_SIZE=1024,
+        COMPRESSION_LEVEL=6,
+        # Log file of JSON lines, defaults to paralympics.log, or paralympics_tests.log when testing. Records wait in a
+        # queue of up to LOG_QUEUE_SIZE to be written, and are dropped if it is full. LOG_SAMPLING is the fraction of
+        # the records to keep for each level name, e.g. {"DEBUG": 0.01, "INFO": 0.1}, all are kept by default. Set
+        # LOG_CONSOLE to also write the app's records to the console from the queue.
+        LOG_FILE=None,
+        LOG_CONSOLE=False,
+        LOG_QUEUE_SIZE=10000,
+        LOG_SAMPLING={},
+        # Key of a bind in SQLALCHEMY_BINDS, an SQLite file, that the GET requests read from, see paralympics.replica.
+        # A client's reads go to the primary after it makes a change, until the replica has been synced since, and
+        # all reads do if the replica has not been synced for READ_REPLICA_MAX_LAG seconds.
+        SQLALCHEMY_BINDS={},
+        READ_REPLICA_BIND=None,
+        READ_REPLICA_MAX_LAG=60,
+        # Serve the GET responses from a snapshot file built with 'flask --app paralympics build-snapshot', see
+        # paralympics.snapshot. SNAPSHOT_WRITES is "reject" to return 405 for writes, or "staging" to write them to the
+        # database until the snapshot is built again. The snapshot has the pages of the lists for each size in
+        # SNAPSHOT_PAGE_SIZES, e.g. /events?limit=50.
+        SNAPSHOT_FILE=None,
+        SNAPSHOT_WRITES="reject",
+        SNAPSHOT_PAGE_SIZES=[10, 50, 100],
+        # Background imports and exports, see paralympics.jobs. The jobs are stored in JOBS_DATABASE_URI, by default
+        # an SQLite file next to the main database, and their uploads and results in JOBS_DIR, by default 'jobs' in
+        # the instance folder. Each web worker runs up to JOB_WORKERS jobs at the same time in worker processes, and
+        # a job records its progress, and checks if it has been cancelled, after each JOB_CHUNK_SIZE rows.
+        JOBS_DATABASE_URI=None,
+        JOBS_DIR=None,
+        JOB_WORKERS=1,
+        JOB_CHUNK_SIZE=5000,
+        # Create the tables and add the data at start up if the database is not current. Turn this off in production
+        # and run 'flask --app paralympics init-db' once before starting the workers.
+        AUTO_INIT_DB=True,
     )
 
     if test_config is None:
@@ -64,23 +152,60 @@ def create_app(test_config=None):
     # Register the custom 404 error handler that is defined in this python file
     app.register_error_handler(401, handle_404_error)
 
-    # Initialise Flask with the SQLAlchemy database extension
+    # Initialise Flask with the SQLAlchemy database extension, using the SQLite pool and pragmas from the config
+    from paralympics.engine import apply_pool_options, configure_engine
+    from paralympics.jobs import add_jobs_bind, init_jobs
+    add_jobs_bind(app)
+    apply_pool_options(app)
     db.init_app(app)
+    configure_engine(app)
+
+    # Read the GET requests from the replica, if READ_REPLICA_BIND is set
+    from paralympics.replica import init_replica, sync_replica_command
+    init_replica(app)
+    app.cli.add_command(sync_replica_command)
 
     # Initialise Flask with the Marshmallow extension
     ma.init_app(app)
 
+    # Create the response cache for the GET routes
+    from paralympics.cache import init_cache
+    init_cache(app)
+
+    # Create the pool that hashes passwords
+    from paralympics.passwords import init_password_hasher
+    init_password_hasher(app)
+
+    # Create the runner for the background imports and exports, its worker processes start with the first job
+    init_jobs(app)
+
+    # Record the metrics for each request
+    from paralympics.metrics import init_metrics
+    init_metrics(app)
+
+    # Compress the responses
+    from paralympics.compression import init_compression
+    init_compression(app)
+
+    # Serve the GET requests from the snapshot, if SNAPSHOT_FILE is set
+    from paralympics.snapshot import init_snapshot, build_snapshot_command
+    init_snapshot(app)
+    app.cli.add_command(build_snapshot_command)
+
     # Models are defined in the models module, so you must import them before calling create_all, otherwise SQLAlchemy
     # will not know about them.
     from paralympics.models import User, Region, Event
-    # Create the tables in the database
+    # Registers the listeners that keep the analytics summary tables up to date when events change
+    from paralympics import analytics
+    # Create the tables and add the data with 'flask --app paralympics init-db'
+    from paralympics.utils import init_db, init_db_command, seed_is_current
+    app.cli.add_command(init_db_command)
+    # The seed marker is checked without using the database, so starting an app with current data does no DB work.
     # create_all does not update tables if they are already in the database.
-    with app.app_context():
-        db.create_all()
-
-        from paralympics.utils import add_data
-        add_data(db)
+    if app.config["AUTO_INIT_DB"] and not seed_is_current(app):
+        init_db(app)
 
+    with app.app_context():
         # Register the routes and custom error handlers with the app in the context
         from paralympics import routes, error_handlers
 
@@ -0,0 +1,116 @@
+"""
+Summary tables for the analytics routes.
+
+The event_summary and host_summary tables hold the totals for each type and year and the number of events hosted by
+each NOC. Mapper events on Event update the totals in the same flush as the change to the event, so they are
+committed or rolled back with it. Rows added without the ORM, e.g. by add_data(), are not seen by the mapper events,
+so rebuild_summaries() must be called after loading them.
+"""
+from sqlalchemy import case, delete, event, func, insert, inspect, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from paralympics.models import Event, EventSummary, HostSummary
+
+# The columns of Event used by the summary tables
+SUMMARY_COLUMNS = ("type", "year", "NOC", "participants", "participants_m", "participants_f")
+
+
+def rebuild_summaries(db):
+    """Replaces the contents of the summary tables with totals calculated from the event table.
+
+    The changes are not committed.
+
+    :param db: SQLAlchemy database for the app
+    """
+    # participants_m and participants_f are only counted for events that have both
+    both = Event.participants_m.is_not(None) & Event.participants_f.is_not(None)
+    db.session.execute(delete(EventSummary))
+    db.session.execute(insert(EventSummary).from_select(
+        ["type", "year", "games", "participants", "participants_m", "participants_f"],
+        select(Event.type, Event.year, func.count(),
+               func.coalesce(func.sum(Event.participants), 0),
+               func.coalesce(func.sum(case((both, Event.participants_m), else_=0)), 0),
+               func.coalesce(func.sum(case((both, Event.participants_f), else_=0)), 0))
+        .group_by(Event.type, Event.year)))
+    db.session.execute(delete(HostSummary))
+    db.session.execute(insert(HostSummary).from_select(
+        ["NOC", "hosted"],
+        select(Event.NOC, func.count()).where(Event.NOC.is_not(None)).group_by(Event.NOC)))
+
+
+def _add_to_summaries(connection, values, sign):
+    """Adds (sign=1) or removes (sign=-1) one event's values from the summary tables.
+
+    Args:
+        connection: The connection of the flush, so the change is in the same transaction as the event
+        values (dict): The event's values for SUMMARY_COLUMNS
+        sign (int): 1 to add the event, -1 to remove it
+    """
+    both = values["participants_m"] is not None and values["participants_f"] is not None
+    totals = {
+        "games": sign,
+        "participants": sign * (values["participants"] or 0),
+        "participants_m": sign * values["participants_m"] if both else 0,
+        "participants_f": sign * values["participants_f"] if both else 0,
+    }
+    stmt = sqlite_insert(EventSummary).values(type=values["type"], year=values["year"], **totals)
+    connection.execute(stmt.on_conflict_do_update(
+        index_elements=["type", "year"],
+        set_={name: getattr(EventSummary, name) + getattr(stmt.excluded, name) for name in totals}))
+    # Remove the row once its last event has gone, so the routes do not return years with no events
+    connection.execute(delete(EventSummary).where(EventSummary.type == values["type"],
+                                                  EventSummary.year == values["year"],
+                                                  EventSummary.games <= 0))
+
+    if values["NOC"] is not None:
+        stmt = sqlite_insert(HostSummary).values(NOC=values["NOC"], hosted=sign)
+        connection.execute(stmt.on_conflict_do_update(index_elements=["NOC"],
+                                                      set_={"hosted": HostSummary.hosted + stmt.excluded.hosted}))
+        connection.execute(delete(HostSummary).where(HostSummary.NOC == values["NOC"], HostSummary.hosted <= 0))
+
+
+def _current_values(target):
+    """Returns the event's values for SUMMARY_COLUMNS."""
+    return {name: getattr(target, name) for name in SUMMARY_COLUMNS}
+
+
+def _previous_values(target):
+    """Returns the event's values for SUMMARY_COLUMNS from before the changes that are being flushed.
+
+    The columns are loaded before they are changed, see _load_previous_value(), so the previous value is in the
+    history of a changed column even if it was expired or not loaded when it was set.
+    """
+    state = inspect(target)
+    values = {}
+    for name in SUMMARY_COLUMNS:
+        history = state.attrs[name].history
+        values[name] = history.deleted[0] if history.deleted else getattr(target, name)
+    return values
+
+
+def _load_previous_value(target, value, oldvalue, initiator):
+    """Does nothing, it is registered with active_history=True so the value is loaded before it is replaced."""
+    return value
+
+
+for _name in SUMMARY_COLUMNS:
+    event.listen(getattr(Event, _name), "set", _load_previous_value, active_history=True, retval=True)
+
+
+@event.listens_for(Event, "after_insert")
+def add_event_to_summaries(mapper, connection, target):
+    _add_to_summaries(connection, _current_values(target), 1)
+
+
+@event.listens_for(Event, "after_update")
+def update_event_in_summaries(mapper, connection, target):
+    previous, current = _previous_values(target), _current_values(target)
+    if previous != current:
+        _add_to_summaries(connection, previous, -1)
+        _add_to_summaries(connection, current, 1)
+
+
+# Before the delete, so the values of an expired event can still be loaded from its row
+@event.listens_for(Event, "before_delete")
+def remove_event_from_summaries(mapper, connection, target):
+    _add_to_summaries(connection, _previous_values(target), -1)
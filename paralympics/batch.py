@@ -0,0 +1,126 @@
+"""
+Adding a batch of items from a JSON list, for POST /regions/batch and POST /events/batch.
+"""
+from flask import request, make_response, abort, current_app as app
+from sqlalchemy import exc, inspect, tuple_
+
+from paralympics import db
+from paralympics.versions import bump_version
+
+
+def existing_key_errors(schema, items):
+    """Returns the errors for the items whose primary key is already in the database or earlier in the list.
+
+    The schemas load with load_instance=True, so an item with the key of a row in the session or the database would be
+    loaded as that row and overwrite it. Items without all of the primary key are new, e.g. events without an id.
+
+    Args:
+        schema: Marshmallow SQLAlchemy schema of the items
+        items (list): The items from the request
+    Returns:
+        dict of the errors for each item by its index in the list
+    """
+    mapper = inspect(schema.opts.model)
+    attributes = [mapper.get_property_by_column(column).class_attribute for column in mapper.primary_key]
+    names = [attribute.key for attribute in attributes]
+    keys = {}
+    for index, item in enumerate(items):
+        if isinstance(item, dict) and all(item.get(name) is not None for name in names):
+            keys[index] = tuple(item[name] for name in names)
+    if not keys:
+        return {}
+    existing = {tuple(row) for row in db.session.execute(
+        db.select(*attributes).where(tuple_(*attributes).in_(list(set(keys.values()))))
+    )}
+    errors = {}
+    seen = set()
+    for index, key in keys.items():
+        if key in existing or key in seen:
+            errors[index] = {names[0]: [f"{', '.join(map(str, key))} already exists."]}
+        seen.add(key)
+    return errors
+
+
+def add_each(schema, items, indexes, name, errors, stop_on_error=False):
+    """Loads and adds each of the items at the indexes in a savepoint of its own, for add_batch().
+
+    Loading the item inside its savepoint means that an item the database rejects is not left attached to the related
+    objects in the session, e.g. the events of a region. The error for each item that fails is added to errors.
+
+    Returns:
+        The number of items added
+    """
+    added = 0
+    for index in indexes:
+        try:
+            with db.session.begin_nested():
+                db.session.add(schema.load([items[index]])[0])
+            added += 1
+        except exc.SQLAlchemyError as e:
+            app.logger.error(f"A SQLAlchemy database error occurred adding item {index} of {name}: {str(e)}")
+            errors[index] = {"_schema": ["Could not be saved to the database."]}
+            if stop_on_error:
+                break
+    return added
+
+
+def add_batch(schema, tables, name):
+    """Validates the JSON list in the request body and adds the items to the database in one transaction.
+
+    The 'mode' query parameter chooses what happens when some of the items are not valid:
+        atomic (default): nothing is added if any item fails
+        best_effort: the valid items are added and the others are reported
+
+    An item whose primary key already exists, in the database or earlier in the list, fails rather than changing the
+    existing row. If the database rejects an item, it is reported by its index: in best_effort mode each item is
+    flushed in a savepoint, so it is rolled back on its own, and an atomic batch is added again one item at a time to
+    find it.
+
+    Args:
+        schema: Marshmallow schema with many=True, e.g. EventSchema(many=True)
+        tables (tuple): Names of the tables to bump the version of, see bump_version()
+        name (str): Plural name of the items for the message, e.g. "events"
+    Returns:
+        JSON with the number of items added and the errors for each failed item by its index in the list. The status
+        code is 400 if an atomic batch fails validation, 500 if it fails to save, otherwise 200.
+    """
+    mode = request.args.get("mode", "atomic")
+    if mode not in ("atomic", "best_effort"):
+        abort(400, description="mode must be atomic or best_effort")
+    items = request.get_json()
+    if not isinstance(items, list):
+        abort(400, description="The request body must be a JSON list")
+
+    # validate() checks every item without creating any objects, the errors are keyed by the index of the item
+    errors = schema.validate(items)
+    for index, error in existing_key_errors(schema, items).items():
+        errors.setdefault(index, {}).update(error)
+    if mode == "atomic" and errors:
+        msg = {"message": f"No {name} added, {len(errors)} failed validation.", "added": 0, "errors": errors}
+        return make_response(msg, 400)
+
+    if mode == "atomic":
+        try:
+            # The whole batch is added with one flush, which is quickest when every item can be saved
+            with db.session.begin_nested():
+                db.session.add_all(schema.load(items))
+        except exc.SQLAlchemyError as e:
+            app.logger.error(f"A SQLAlchemy database error occurred adding a batch of {name}: {str(e)}")
+            # Add the items again one at a time to find the one the database rejects
+            add_each(schema, items, range(len(items)), name, errors, stop_on_error=True)
+            db.session.rollback()
+            msg = {"message": f"No {name} added, the batch could not be saved.", "added": 0, "errors": errors}
+            return make_response(msg, 500)
+        added = len(items)
+    else:
+        added = add_each(schema, items, [index for index in range(len(items)) if index not in errors], name, errors)
+    try:
+        if added:
+            bump_version(*tables)
+        db.session.commit()
+    except exc.SQLAlchemyError as e:
+        db.session.rollback()
+        app.logger.error(f"A SQLAlchemy database error occurred adding a batch of {name}: {str(e)}")
+        msg = {"message": f"No {name} added, the batch could not be saved.", "added": 0, "errors": errors}
+        return make_response(msg, 500)
+    return {"message": f"{added} {name} added, {len(errors)} failed.", "added": added, "errors": errors}
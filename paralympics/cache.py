@@ -0,0 +1,261 @@
+"""
+In-process caches used by the paralympics app.
+
+The response cache stores the responses of the GET routes. Each entry is tagged with the tables it was generated
+from, and when a transaction that changed a table commits, the entries for that table are removed.
+
+The token cache stores the user id for verified JWTs. Each entry is tagged with the user, and expires with the token.
+A mapper event on User records the users changed by a transaction, so their entries are removed when it commits.
+
+The cached_response() decorator serves the GET routes from the response cache.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from functools import wraps
+
+from flask import current_app, g, has_app_context, make_response, request
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from werkzeug.utils import import_string
+
+from paralympics import db
+from paralympics.models import User
+from paralympics.versions import request_tables
+
+
+class ResponseCache:
+    """Interface for the response cache.
+
+    Set the RESPONSE_CACHE config value to a subclass, or its import path, to use a different cache. The class is
+    created with the RESPONSE_CACHE_MAX_ENTRIES and RESPONSE_CACHE_TTL config values as max_entries and ttl.
+    """
+
+    def get(self, key):
+        """Returns the value for key, or None if it is not in the cache."""
+        raise NotImplementedError
+
+    def set(self, key, value, tags=(), ttl=None):
+        """Stores value for key.
+
+        Args:
+            key: Any hashable key
+            value: The value to store
+            tags: Tags used to remove the entry with invalidate(), e.g. the names of the tables it depends on
+            ttl (float): Seconds the entry is valid for, if None the default for the cache is used
+        """
+        raise NotImplementedError
+
+    def invalidate(self, *tags):
+        """Removes every entry that has any of the tags."""
+        raise NotImplementedError
+
+    def clear(self):
+        """Removes every entry."""
+        raise NotImplementedError
+
+    def stats(self):
+        """Returns a dict of the cache counters."""
+        raise NotImplementedError
+
+
+class NullCache(ResponseCache):
+    """Cache that never stores anything, used to turn the cache off."""
+
+    def __init__(self, max_entries=0, ttl=0):
+        self.misses = 0
+
+    def get(self, key):
+        self.misses += 1
+        return None
+
+    def set(self, key, value, tags=(), ttl=None):
+        pass
+
+    def invalidate(self, *tags):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {"hits": 0, "misses": self.misses, "evictions": 0, "expirations": 0, "invalidations": 0,
+                "entries": 0}
+
+
+class LRUCache(ResponseCache):
+    """Thread-safe in-memory cache with a maximum number of entries and a time to live.
+
+    When the cache is full the least recently used entry is evicted. Expired entries are removed when they are next
+    read.
+
+    Args:
+        max_entries (int): Maximum number of entries
+        ttl (float): Default number of seconds an entry is valid for
+        clock: Function that returns the current time in seconds, can be replaced in tests
+    """
+
+    def __init__(self, max_entries=512, ttl=300, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        # key -> (expires, tags, value), ordered from least to most recently used
+        self._entries = OrderedDict()
+        # tag -> set of keys
+        self._tags = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] <= self.clock():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, value, tags=(), ttl=None):
+        expires = self.clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires, tags, value)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, *tags):
+        with self._lock:
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    if key in self._entries:
+                        self._remove(key)
+                        self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "expirations": self.expirations, "invalidations": self.invalidations,
+                    "entries": len(self._entries)}
+
+    def _remove(self, key):
+        """Removes an entry and its tags. The lock must be held."""
+        _, tags, _ = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+def init_cache(app):
+    """Creates the response and token caches for the app from its config and registers the invalidation on commit.
+
+    The caches are stored in app.extensions["response_cache"] and app.extensions["token_cache"].
+    """
+    cache_class = app.config["RESPONSE_CACHE"]
+    if isinstance(cache_class, str):
+        cache_class = import_string(cache_class)
+    app.extensions["response_cache"] = cache_class(max_entries=app.config["RESPONSE_CACHE_MAX_ENTRIES"],
+                                                   ttl=app.config["RESPONSE_CACHE_TTL"])
+    # Each entry is given the time left until its token expires, so the default ttl is never used
+    app.extensions["token_cache"] = LRUCache(max_entries=app.config["TOKEN_CACHE_MAX_ENTRIES"])
+    # The listeners are registered on the scoped session, which is shared by every app, so only add them once
+    if not event.contains(db.session, "after_commit", invalidate_after_commit):
+        event.listen(db.session, "after_commit", invalidate_after_commit)
+        event.listen(db.session, "after_rollback", discard_changed_tables)
+
+
+def get_cache():
+    """Returns the response cache of the current app."""
+    return current_app.extensions["response_cache"]
+
+
+def invalidate_after_commit(session):
+    """Removes the cache entries for the tables and users changed by the transaction that has just been committed.
+
+    The tables are recorded by bump_version() and the users by a mapper event on User. Invalidating after the commit,
+    rather than when the change is made, means a request that runs before the commit cannot put the old data back in
+    the cache.
+    """
+    tables = session.info.pop("changed_tables", None)
+    users = session.info.pop("changed_users", None)
+    if not has_app_context():
+        return
+    if tables:
+        get_cache().invalidate(*tables)
+    if users:
+        current_app.extensions["token_cache"].invalidate(*(f"user:{user_id}" for user_id in users))
+
+
+def discard_changed_tables(session):
+    """Forgets the tables and users changed by a transaction that has been rolled back."""
+    session.info.pop("changed_tables", None)
+    session.info.pop("changed_users", None)
+
+
+def cached_response(*tables, embeds=None):
+    """Stores the responses of a GET route in the response cache and serves repeat requests from it.
+
+    The cache key is the path, the query parameters in sorted order and the ETag from conditional_get, so this
+    decorator must be used below @conditional_get. As the ETag changes whenever the data changes, an entry is never
+    served after a change committed by another worker. Changes made by this worker also remove the entries tagged
+    with the changed tables as soon as they are committed.
+
+    Args:
+        tables (str): Names of the tables the route reads from, e.g. "event"
+        embeds (dict): As for conditional_get()
+    """
+
+    def wrapper(f):
+        @wraps(f)
+        def decorator(*args, **kwargs):
+            cache = get_cache()
+            key = (request.path, tuple(sorted(request.args.items(multi=True))), g.get("etag"))
+            cached = cache.get(key)
+            if cached is not None:
+                body, status, headers, _ = cached
+                # The entry also holds the compressed bodies, see paralympics.compression
+                g.cache_entry = cached
+                response = current_app.response_class(body, status=status, headers=headers)
+                response.headers["X-Cache"] = "HIT"
+                return response
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                headers = [(name, value) for name, value in response.headers if name != "Content-Length"]
+                # (body, status, headers, compressed bodies by encoding)
+                g.cache_entry = (response.get_data(), response.status_code, headers, {})
+                cache.set(key, g.cache_entry, tags=request_tables(tables, embeds))
+            response.headers["X-Cache"] = "MISS"
+            return response
+
+        return decorator
+
+    return wrapper
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def record_changed_user(mapper, connection, target):
+    """Records a changed or deleted user so that their cached tokens are removed when the transaction commits."""
+    object_session(target).info.setdefault("changed_users", set()).add(target.id)
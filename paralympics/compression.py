@@ -0,0 +1,94 @@
+"""
+gzip and deflate compression of the responses, negotiated with the Accept-Encoding request header.
+
+init_compression() adds an after_request hook that compresses JSON, CSV and text responses of at least
+COMPRESSION_MIN_SIZE bytes. Streamed responses, such as /events/export, are compressed chunk by chunk as they are
+sent. Responses served from the response cache keep their compressed bodies in the cache entry, so a cached response
+is only compressed once for each encoding.
+
+A compressed response is a different representation of the resource, so it has its own ETag, the ETag of the
+uncompressed response with the encoding added, e.g. "1a2b3c-gzip". conditional_get() accepts these ETags in
+If-None-Match.
+"""
+import zlib
+
+from flask import g, request
+
+# The encodings in order of preference, and the zlib wbits for each. 31 is the gzip format, 15 is the zlib format
+# that HTTP calls deflate.
+ENCODINGS = {"gzip": 31, "deflate": 15}
+
+# The types of response that are compressed
+COMPRESSIBLE_TYPES = {"application/json", "application/x-ndjson", "text/csv", "text/plain", "text/html"}
+
+
+def etag_variants(etag):
+    """Returns the ETag of each compressed representation of a response with the given ETag."""
+    return [f"{etag}-{encoding}" for encoding in ENCODINGS]
+
+
+def compress(data, encoding, level):
+    """Returns data compressed with the encoding."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, ENCODINGS[encoding])
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks, encoding, level):
+    """Compresses an iterable of str or bytes chunks, yielding the compressed data as it is produced.
+
+    zlib keeps back output until it has enough input, so small chunks may not yield anything until later chunks or
+    the end of the stream.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, ENCODINGS[encoding])
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        # Close the wrapped generator, so stream_with_context ends the request context if the client disconnects
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def init_compression(app):
+    """Adds the hook that compresses the responses if COMPRESSION_ENABLED is set."""
+    if not app.config["COMPRESSION_ENABLED"]:
+        return
+    min_size = app.config["COMPRESSION_MIN_SIZE"]
+    level = app.config["COMPRESSION_LEVEL"]
+
+    @app.after_request
+    def compress_response(response):
+        if (response.status_code != 200 or response.mimetype not in COMPRESSIBLE_TYPES
+                or "Content-Encoding" in response.headers or response.direct_passthrough):
+            return response
+        # Caches must store each encoding separately, including when this response is not compressed
+        response.vary.add("Accept-Encoding")
+        encoding = request.accept_encodings.best_match(ENCODINGS)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoding, level)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < min_size:
+                return response
+            # The compressed bodies of a cached response are kept in its entry, see cached_response()
+            entry = g.get("cache_entry")
+            encoded = entry[3] if entry is not None and entry[0] == data else {}
+            body = encoded.get(encoding)
+            if body is None:
+                body = encoded[encoding] = compress(data, encoding, level)
+            response.set_data(body)
+
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag is not None:
+            response.set_etag(f"{etag}-{encoding}", weak)
+        return response
@@ -0,0 +1,74 @@
+"""
+SQLite settings for serving the app from several threads and worker processes.
+
+With the default rollback journal a writer blocks every reader, and with no busy timeout a connection that finds the
+database locked fails straight away with "database is locked". configure_engine() sets the pragmas in the
+SQLITE_PRAGMAS config value on every new connection, by default WAL so that readers do not wait for writers, and a
+busy timeout so that writers wait for each other.
+
+In WAL mode a transaction that reads and then writes cannot wait for another writer: if the database has changed
+since its read, SQLite returns "database is locked" at once. The write routes all read before they write, so with
+SQLITE_IMMEDIATE_WRITES the transactions of POST, PATCH, PUT and DELETE requests start with BEGIN IMMEDIATE. They
+then take the write lock at the start, waiting up to the busy timeout for it, and never have to upgrade. A route that
+does slow work, as /login and /register do when they hash a password, ends its transaction first with
+helpers.end_transaction() so that other writers do not wait for the lock.
+"""
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from paralympics import db
+
+# The requests whose transactions start with BEGIN IMMEDIATE
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+def is_sqlite_file(app):
+    """Returns True if the app's database is an SQLite file, rather than in memory or another database."""
+    url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+    return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:")
+
+
+def apply_pool_options(app):
+    """Adds the SQLITE_POOL options to SQLALCHEMY_ENGINE_OPTIONS, call this before db.init_app().
+
+    Options already in SQLALCHEMY_ENGINE_OPTIONS are kept. In-memory databases use a StaticPool, which has no pool
+    size, so the options are only used for SQLite files.
+    """
+    if is_sqlite_file(app):
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {**app.config["SQLITE_POOL"],
+                                                   **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})}
+
+
+def configure_engine(app):
+    """Registers the listeners that set the pragmas and begin the transactions on the app's SQLite engines.
+
+    Call this after db.init_app(). The engines of SQLALCHEMY_BINDS, such as a read replica, get the same listeners as
+    the primary. Other databases are not changed.
+    """
+    with app.app_context():
+        engines = list(db.engines.values())
+    pragmas = dict(app.config["SQLITE_PRAGMAS"])
+    immediate_writes = app.config["SQLITE_IMMEDIATE_WRITES"]
+    for engine in engines:
+        if engine.dialect.name == "sqlite":
+            _add_listeners(engine, pragmas, immediate_writes)
+
+
+def _add_listeners(engine, pragmas, immediate_writes):
+    """Adds the connect and begin listeners of configure_engine() to an SQLite engine."""
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        # Stop pysqlite starting transactions itself, so that the begin listener below decides how they start
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def begin(connection):
+        immediate = immediate_writes and has_request_context() and request.method in WRITE_METHODS
+        # Run on the DBAPI connection, so BEGIN is not counted as a query by the cursor execute events
+        connection.connection.driver_connection.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
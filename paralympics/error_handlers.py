@@ -2,6 +2,8 @@ from flask import json, current_app as app, jsonify, make_response
 from marshmallow.exceptions import ValidationError
 from werkzeug.exceptions import HTTPException
 
+from paralympics.passwords import HashingBusy
+
 
 # ERROR HANDLERS
 
@@ -56,3 +58,18 @@ def register_validation_error(error):
     """
     response = error.messages
     return response, 400
+
+
+@app.errorhandler(HashingBusy)
+def handle_hashing_busy(error):
+    """ Error handler for when the password hashing pool is full.
+
+    Args:
+        error (HashingBusy): The exception raised by the password hasher
+
+    Returns:
+        HTTP response with a message, the 503 status code and a Retry-After header
+    """
+    response = make_response({"message": "The server is busy. Please try again."}, 503)
+    response.headers["Retry-After"] = "1"
+    return response
@@ -0,0 +1,49 @@
+"""
+Writing the events as NDJSON or CSV, for /events/export and the export jobs.
+"""
+import csv
+import io
+import json
+
+from flask import current_app as app
+
+from paralympics import db
+
+# The formats for export_chunks() and the mimetype of each
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def export_chunks(serializer, stmt, export_format, yield_per=1000):
+    """Generates the rows selected by a statement as NDJSON or CSV text.
+
+    The rows are fetched yield_per at a time with SQLAlchemy's yield_per, and one chunk of text is generated for each
+    batch, so the memory used stays the same however many rows there are.
+
+    Args:
+        serializer (RowSerializer): Serializer for the rows, stmt must be built from its select()
+        stmt: The select statement
+        export_format (str): "ndjson" for one JSON object per line, or "csv" for CSV with a header row
+        yield_per (int): Number of rows to fetch and write at a time
+    Yields:
+        str chunks of the file
+    """
+    result = db.session.execute(stmt.execution_options(yield_per=yield_per))
+    names = serializer.names
+    if export_format == "ndjson":
+        # One encoder for the whole export, with the same settings as the app's JSON responses but compact
+        encode = json.JSONEncoder(default=app.json.default, ensure_ascii=app.json.ensure_ascii,
+                                  sort_keys=app.json.sort_keys, separators=(",", ":")).encode
+        for partition in result.partitions():
+            yield "".join(encode(item) + "\n" for item in serializer.dump(partition))
+    else:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(names)
+        for partition in result.partitions():
+            writer.writerows([item[name] for name in names] for item in serializer.dump(partition))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # Only the header is left in the buffer if there were no rows
+        if buffer.tell():
+            yield buffer.getvalue()
@@ -1,15 +1,21 @@
 import datetime
+import time
 from functools import wraps
 import jwt
-from flask import request, make_response, current_app as app
+from flask import request, make_response, abort, url_for, current_app as app
 from paralympics import db
 from paralympics.models import User
+from paralympics.schemas import DATE_FORMAT
 
 
 def token_required(f):
     """Require valid jwt for a route
 
     Decorator to protect routes using jwt
+
+    Verified tokens are kept in the token cache until they expire, or for TOKEN_CACHE_TTL seconds, so repeat requests
+    with the same token skip both the signature check and the query for the user. The entries for a user are removed
+    when the user is changed or deleted through the ORM in this process.
     """
 
     @wraps(f)
@@ -23,18 +29,43 @@ def token_required(f):
         if not token:
             response = {"message": "Authentication Token missing"}
             return make_response(response, 401)
-        # Check the token is valid
-        token_payload = decode_auth_token(token)
-        user_id = token_payload["sub"]
-        # Find the user in the database using their email address which is in the data of the decoded token
-        current_user = db.session.execute(db.select(User).filter_by(id=user_id)).scalar_one_or_none()
-        if not current_user:
-            response = {"message": "Invalid or missing token."}
-            return make_response(response, 401)
+        token_cache = app.extensions["token_cache"]
+        if token_cache.get(token) is None:
+            # Check the token is valid, if not decode_auth_token returns the 401 response
+            token_payload = decode_auth_token(token)
+            if not isinstance(token_payload, dict):
+                return token_payload
+            user_id = int(token_payload["sub"])
+            # Find the user in the database using the user id which is in the data of the decoded token
+            current_user = db.session.execute(db.select(User).filter_by(id=user_id)).scalar_one_or_none()
+            if not current_user:
+                response = {"message": "Invalid or missing token."}
+                return make_response(response, 401)
+            # Cache the verified user until the token expires, or for at most TOKEN_CACHE_TTL seconds. The entry is
+            # only removed by changes to the user made in this process, so a change made by another worker, or by
+            # the init-db command or a job, is seen once the entry expires.
+            ttl = min(token_payload["exp"] - time.time(), app.config["TOKEN_CACHE_TTL"])
+            token_cache.set(token, user_id, tags=(f"user:{user_id}",), ttl=ttl)
         return f(*args, **kwargs)
     return decorator
 
 
+def end_transaction(*objects):
+    """Ends the session's transaction so that a slow step, such as hashing a password, runs outside it.
+
+    With SQLITE_IMMEDIATE_WRITES the transaction of a POST request takes the write lock when it begins, so every other
+    writer waits while it is open. The objects are detached from the session first, so their loaded values can still be
+    read without a query. Add an object to the session again to save changes to it in a new, short transaction.
+
+    Args:
+        objects: Objects loaded in the transaction, None is ignored
+    """
+    for obj in objects:
+        if obj is not None:
+            db.session.expunge(obj)
+    db.session.rollback()
+
+
 def encode_auth_token(user_id):
     """Generates the Auth Token
 
@@ -48,7 +79,8 @@ def encode_auth_token(user_id):
             payload={
                 "exp": datetime.datetime.now(datetime.UTC) + datetime.timedelta(minutes=5),
                 "iat": datetime.datetime.now(datetime.UTC),
-                "sub": user_id,
+                # PyJWT requires the subject to be a string
+                "sub": str(user_id),
             },
             # Flask app secret key, matches the key used in the decode() in the decorator
             key=app.config['SECRET_KEY'],
@@ -75,3 +107,161 @@ def decode_auth_token(auth_token):
         return make_response({'message': "Token expired. Please log in again."}, 401)
     except jwt.InvalidTokenError:
         return make_response({'message': "Invalid token. Please log in again."}, 401)
+
+
+def get_filters(allowed):
+    """Reads equality filters from the request query string.
+
+    Only the parameters named in allowed are used, any other query parameters are ignored.
+
+    Args:
+        allowed (dict): Maps a query parameter name to the function used to convert its value, e.g. {"year": int}
+    Returns:
+        dict of filters that can be passed to filter_by(), returns 400 if a value cannot be converted
+    """
+    filters = {}
+    for name, convert in allowed.items():
+        value = request.args.get(name)
+        if value is not None:
+            try:
+                filters[name] = convert(value)
+            except ValueError:
+                abort(400, description=f"{name} is not valid")
+    return filters
+
+
+def get_date_filters(allowed):
+    """Reads date range filters from the request query string, e.g. ?start_after=01/08/2012
+
+    The dates can be given in the format used in the JSON, dd/mm/yyyy, or as yyyy-mm-dd. Only the parameters named
+    in allowed are used.
+
+    Args:
+        allowed (dict): Maps a query parameter name to a function that returns the where clause for a date, e.g.
+            {"start_after": lambda date: Event.start > date}
+    Returns:
+        list of where clauses that can be passed to where(), returns 400 if a date is not valid
+    """
+    clauses = []
+    for name, make_clause in allowed.items():
+        value = request.args.get(name)
+        if value is not None:
+            try:
+                date = datetime.datetime.strptime(value, DATE_FORMAT).date()
+            except ValueError:
+                try:
+                    date = datetime.date.fromisoformat(value)
+                except ValueError:
+                    abort(400, description=f"{name} must be a date in the format dd/mm/yyyy or yyyy-mm-dd")
+            clauses.append(make_clause(date))
+    return clauses
+
+
+def get_fields(allowed):
+    """Reads the names of the fields to return from the 'fields' query parameter, e.g. ?fields=year,host
+
+    Args:
+        allowed: Names of the fields that can be requested
+    Returns:
+        list of the names, or None if the parameter is not given. Returns 400 if a name is not in allowed.
+    """
+    value = request.args.get("fields")
+    if value is None:
+        return None
+    names = [name for name in value.split(",") if name]
+    unknown = [name for name in names if name not in allowed]
+    if not names or unknown:
+        abort(400, description=f"fields must be a comma separated list of: {', '.join(allowed)}")
+    return names
+
+
+def get_page_args(key_type):
+    """Reads the keyset pagination parameters from the request query string.
+
+    'limit' is the maximum number of rows to return and 'after' is the key of the last row of the previous page.
+    Both are optional; if limit is not given then all the matching rows are returned.
+
+    Args:
+        key_type: Function used to convert 'after' to the type of the key column, e.g. int for the event id
+    Returns:
+        tuple (limit, after), either may be None. Returns 400 if either value is not valid.
+    """
+    limit = request.args.get("limit")
+    if limit is not None:
+        if not limit.isdigit() or int(limit) < 1:
+            abort(400, description="limit must be a positive integer")
+        limit = min(int(limit), app.config["MAX_PAGE_LIMIT"])
+    after = request.args.get("after")
+    if after is not None:
+        try:
+            after = key_type(after)
+        except ValueError:
+            abort(400, description="after is not a valid cursor")
+    return limit, after
+
+
+def paginate(stmt, key_column, scalars=False):
+    """Applies keyset pagination to a select statement and runs it.
+
+    The rows are ordered by key_column and the page starts with WHERE key_column > after, so the database seeks
+    straight to the start of the page using the primary key or an index. Unlike LIMIT/OFFSET, the cost of a page
+    does not grow with how far into the table it is.
+
+    Args:
+        stmt: The select statement, including any filters. The key column must be one of the selected columns.
+        key_column: Unique column used to order the rows and as the cursor, e.g. Event.id
+        scalars (bool): True for a select of a model, e.g. select(Event), to return the objects rather than rows
+    Returns:
+        tuple (rows, next_after) where next_after is the cursor for the next page, or None if this is the last page
+    """
+    limit, after = get_page_args(key_column.type.python_type)
+    if after is not None:
+        stmt = stmt.where(key_column > after)
+    stmt = stmt.order_by(key_column)
+    if limit is not None:
+        # Fetch one extra row to find out if there is another page without running a COUNT query
+        stmt = stmt.limit(limit + 1)
+    result = db.session.execute(stmt)
+    rows = result.scalars().all() if scalars else result.all()
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, getattr(rows[-1], key_column.key)
+
+
+def add_next_link(response, next_after):
+    """Adds a Link header with the URL of the next page to a paginated response.
+
+    The link keeps the query parameters of the current request and replaces 'after' with the new cursor.
+
+    Args:
+        response: The Flask response
+        next_after: Cursor for the next page, if None no header is added
+    Returns:
+        The response
+    """
+    if next_after is not None:
+        args = request.args.to_dict()
+        args["after"] = next_after
+        next_url = url_for(request.endpoint, **request.view_args, **args)
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+    return response
+
+
+def get_embeds(allowed):
+    """Reads the names of the related objects to include in the response from the 'embed' query parameter.
+
+    Several names can be given separated by commas, e.g. ?embed=events.
+
+    Args:
+        allowed (dict): Maps each name that can be embedded to the names of the tables it is read from
+    Returns:
+        set of the names, returns 400 if a name is not in allowed
+    """
+    value = request.args.get("embed")
+    if not value:
+        return set()
+    names = set(value.split(","))
+    if not names <= allowed.keys():
+        abort(400, description=f"embed must be one of: {', '.join(sorted(allowed))}")
+    return names
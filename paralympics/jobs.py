@@ -0,0 +1,396 @@
+"""
+Background jobs for long imports and exports.
+
+Loading a large CSV file, or writing an export of every event, can take minutes, which would hold a request worker
+for the whole time. POST /jobs instead records a Job, submits it to a pool of worker processes and returns straight
+away with the URL of the job, where the client checks its status and progress. The file an export writes is then
+downloaded from /jobs/<id>/result. DELETE /jobs/<id> cancels a job.
+
+The pool of each web worker is started when it submits its first job. Its processes are spawned rather than forked,
+so that they do not share the connections and threads of the web worker, and each creates its own app from the web
+worker's config. JOB_WORKERS is the number of jobs each web worker runs at the same time.
+
+The jobs are stored in their own SQLite database, the "jobs" bind, which is a file next to the main database unless
+JOBS_DATABASE_URI is set, so that a job can record its progress, and read whether it has been cancelled, each time
+JOB_CHUNK_SIZE rows have been inserted or exported whatever the main database is doing. The worker processes need to
+open the same database files as the web workers, so jobs cannot be used with an in-memory database.
+
+An import of a CSV file does not hold the write lock of the main database while it reads the file. It inserts the rows
+into a staging table, committing each chunk, so that the requests can write between the chunks. The rows are then
+copied into the real table in one short transaction, so a failed or cancelled import adds nothing, and the staging
+table is dropped whether the import succeeded or not.
+"""
+import contextlib
+import csv
+import datetime
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import abort, current_app
+from sqlalchemy import Column, MetaData, Table
+from werkzeug.utils import secure_filename
+
+from paralympics import db
+from paralympics.analytics import rebuild_summaries
+from paralympics.export import export_chunks, EXPORT_FORMATS
+from paralympics.versions import bump_version
+from paralympics.models import Job, Region, Event, Medal
+from paralympics.utils import bulk_load_csv, region_values, event_values, read_medals_xlsx, sqlite_database_path
+
+# The jobs that have not finished
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class JobCancelled(Exception):
+    """Raised in a running job that has been cancelled, so that its transaction is rolled back."""
+
+
+def add_jobs_bind(app):
+    """Adds the "jobs" bind to SQLALCHEMY_BINDS, call this before db.init_app().
+
+    JOBS_DATABASE_URI defaults to a file next to the main SQLite database, e.g. paralympics_jobs.sqlite, or another
+    in-memory database if the main database is in memory.
+    """
+    uri = app.config["JOBS_DATABASE_URI"]
+    if uri is None:
+        database = sqlite_database_path(app)
+        if database is None:
+            uri = "sqlite://"
+        else:
+            root, extension = os.path.splitext(database)
+            uri = "sqlite:///" + root + "_jobs" + (extension or ".sqlite")
+    # Copy the binds, so a dict passed in the config is not changed
+    app.config["SQLALCHEMY_BINDS"] = {"jobs": uri, **app.config["SQLALCHEMY_BINDS"]}
+
+
+def jobs_dir(app):
+    """Returns the folder for the uploads and results of the jobs, JOBS_DIR or 'jobs' in the instance folder."""
+    directory = app.config["JOBS_DIR"] or os.path.join(app.instance_path, "jobs")
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def worker_config(app):
+    """Returns the config for the apps of the worker processes, a copy of the app's config.
+
+    The workers do not initialise the database, the web worker has done that already.
+    """
+    return {**app.config, "AUTO_INIT_DB": False}
+
+
+# The app of a worker process, created by _init_worker() when the process starts
+_worker_app = None
+
+
+def _init_worker(config):
+    """Creates the app of a worker process."""
+    global _worker_app
+    from paralympics import create_app
+    _worker_app = create_app(test_config=config)
+
+
+def _run_in_worker(job_id):
+    """Runs a job in a worker process."""
+    return execute_job(_worker_app, job_id)
+
+
+class JobRunner:
+    """Runs jobs on a pool of worker processes, which is started when the first job is submitted.
+
+    Args:
+        app: The Flask app, its config is copied to the worker processes
+        workers (int): Number of jobs that run at the same time
+    """
+
+    def __init__(self, app, workers=1):
+        self.app = app
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(self, job_id):
+        """Queues a job to run in a worker process and returns its Future."""
+        with self._lock:
+            if self._executor is None:
+                # Spawn rather than fork, so the workers do not share the connections and threads of this process
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context("spawn"),
+                                                     initializer=_init_worker, initargs=(worker_config(self.app),))
+            future = self._executor.submit(_run_in_worker, job_id)
+        future.add_done_callback(lambda f: self._check_result(job_id, f))
+        return future
+
+    def _check_result(self, job_id, future):
+        """Marks the job as failed if its worker process did not finish it, e.g. because the process was killed."""
+        if future.cancelled() or future.exception() is None:
+            return
+        self.app.logger.error(f"The worker for job {job_id} failed: {future.exception()!r}")
+        with self.app.app_context():
+            _finish_job(job_id, "failed", "The job's worker process stopped.", statuses=ACTIVE_STATUSES)
+        # A pool that has lost a process cannot run any more jobs, so the next job starts a new pool
+        if isinstance(future.exception(), BrokenProcessPool):
+            with self._lock:
+                self._executor = None
+
+    def shutdown(self, wait=True):
+        """Stops the worker processes once the jobs they are running have finished."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+def init_jobs(app):
+    """Creates the job runner for the app from its config, it is stored in app.extensions["job_runner"]"""
+    app.extensions["job_runner"] = JobRunner(app, workers=app.config["JOB_WORKERS"])
+
+
+def get_job_runner():
+    """Returns the job runner of the current app."""
+    return current_app.extensions["job_runner"]
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
+
+
+# Running the jobs. The functions for each type of job take the job's row and its progress function, and return
+# the message and the path of the result file, if any.
+
+def staging_table(model, job_id):
+    """Returns a table for the rows of an import into the model's table before they are copied into it.
+
+    It has the same columns, except the autoincrement primary key, which is given when the rows are copied. It has no
+    constraints or indexes, so their names do not clash with those of the real table, and the copy checks the rows.
+    """
+    table = model.__table__
+    return Table(f"staging_{table.name}_{job_id}", MetaData(),
+                 *(Column(column.name, column.type) for column in table.columns
+                   if column is not table.autoincrement_column))
+
+
+@contextlib.contextmanager
+def staged_import(job, model, row_values, progress):
+    """Loads the job's CSV file into a staging table, then copies the rows into the model's table.
+
+    Each chunk of rows is committed before the job's progress is recorded, so the write lock is only held for one
+    chunk at a time. The copy starts a new transaction and the body of the with block runs in it, to make the other
+    changes of the import, which are committed with the copy when the block ends.
+
+    Args:
+        job: The job's row
+        model: The model class for the table, e.g. Event
+        row_values: Function that converts a CSV row to a dict of column values
+        progress: The job's progress(rows) function
+    Yields:
+        The number of rows imported
+    """
+    staging = staging_table(model, job.id)
+
+    def chunk_loaded(rows):
+        db.session.commit()
+        progress(rows)
+
+    staging.create(db.session.connection())
+    db.session.commit()
+    try:
+        rows = bulk_load_csv(db, model, job.input_file, row_values, current_app.config["JOB_CHUNK_SIZE"],
+                             chunk_loaded, table=staging)
+        columns = [column.name for column in staging.columns]
+        db.session.execute(db.insert(model.__table__).from_select(columns, db.select(*staging.columns)))
+        yield rows
+        db.session.commit()
+    finally:
+        db.session.rollback()
+        staging.drop(db.session.connection())
+        db.session.commit()
+
+
+def import_regions(job, progress):
+    """Adds the regions in a CSV file with the same columns as data/noc_regions.csv."""
+    with staged_import(job, Region, region_values, progress) as rows:
+        # An event's region is in its JSON, so the events change too
+        bump_version("region", "event")
+    return f"{rows} regions added.", None
+
+
+def import_events(job, progress):
+    """Adds the events in a CSV file with the same columns as data/paralympic_events.csv."""
+    with staged_import(job, Event, event_values, progress) as rows:
+        # The copied rows are not seen by the listeners that maintain the summary tables
+        rebuild_summaries(db)
+        bump_version("event")
+    return f"{rows} events added.", None
+
+
+def import_medals(job, progress):
+    """Replaces the medals with those in a workbook with the same sheets and columns as data/medals.xlsx."""
+    medals = read_medals_xlsx(job.input_file)
+    db.session.execute(db.delete(Medal))
+    db.session.execute(db.insert(Medal.__table__), medals.to_dict("records"))
+    # The last chance to cancel before the medals are replaced
+    progress(len(medals))
+    bump_version("medal")
+    db.session.commit()
+    return f"Medals replaced with {len(medals)} rows.", None
+
+
+def export_events(job, progress):
+    """Writes all the events to a CSV or NDJSON file in the jobs folder."""
+    from paralympics.routes import events_serializer
+    export_format = job.params["format"]
+    chunk_size = current_app.config["JOB_CHUNK_SIZE"]
+    total = db.session.scalar(db.select(db.func.count(Event.id)))
+    _update_job(job.id, total=total)
+    stmt = events_serializer.select().order_by(Event.id)
+    path = os.path.join(jobs_dir(current_app), f"events-{job.id}.{export_format}")
+    # Write to a temporary file and rename it, so the result is never a partly written file
+    temp_file = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_file, "w", newline="", encoding="utf-8") as file:
+            rows = 0
+            # export_chunks() makes one chunk of text for each chunk_size rows
+            for chunk in export_chunks(events_serializer, stmt, export_format, yield_per=chunk_size):
+                file.write(chunk)
+                rows = min(total, rows + chunk_size)
+                progress(rows)
+        os.replace(temp_file, path)
+    finally:
+        if os.path.exists(temp_file):
+            os.unlink(temp_file)
+    return f"{total} events exported.", path
+
+
+def count_csv_rows(csv_file):
+    """Returns the number of rows after the header of a CSV file, used as the total of an import."""
+    with open(csv_file, "r", newline="", encoding="utf-8-sig") as file:
+        return max(sum(1 for _ in csv.reader(file)) - 1, 0)
+
+
+# The types of job, the function that runs each and, for the imports, the extension of the file to upload
+JOB_TYPES = {
+    "import-regions": (import_regions, ".csv"),
+    "import-events": (import_events, ".csv"),
+    "import-medals": (import_medals, ".xlsx"),
+    "export-events": (export_events, None),
+}
+
+
+def _update_job(job_id, **values):
+    """Updates a job in a transaction of its own, so the change is seen at once whatever the session is doing."""
+    with db.engines["jobs"].begin() as connection:
+        connection.execute(db.update(Job.__table__).where(Job.id == job_id).values(**values))
+
+
+def _finish_job(job_id, status, message, result_file=None, statuses=("running",)):
+    """Records the outcome of a job that is in one of statuses."""
+    with db.engines["jobs"].begin() as connection:
+        connection.execute(db.update(Job.__table__).where(Job.id == job_id, Job.status.in_(statuses))
+                           .values(status=status, message=message, result_file=result_file, finished=_utcnow()))
+
+
+def _progress(job_id):
+    """Returns the progress(rows) function of a job, which records the rows done and raises JobCancelled if the job
+    has been cancelled."""
+
+    def progress(rows):
+        with db.engines["jobs"].begin() as connection:
+            connection.execute(db.update(Job.__table__).where(Job.id == job_id).values(progress=rows))
+            cancelled = connection.execute(db.select(Job.cancel_requested).where(Job.id == job_id)).scalar_one()
+        if cancelled:
+            raise JobCancelled()
+
+    return progress
+
+
+def execute_job(app, job_id):
+    """Runs a queued job and records its outcome. This is called in a worker process.
+
+    A job that was cancelled while it was queued is not run. If the job fails or is cancelled, its changes are rolled
+    back, or for an import, its staging table is dropped. The uploaded file of an import is removed afterwards.
+
+    Args:
+        app: The Flask app of the worker process
+        job_id (int): The id of the job
+    """
+    with app.app_context():
+        with db.engines["jobs"].begin() as connection:
+            started = connection.execute(db.update(Job.__table__).where(Job.id == job_id, Job.status == "queued")
+                                         .values(status="running", started=_utcnow())).rowcount
+            job = connection.execute(db.select(Job.__table__).where(Job.id == job_id)).one()
+        if not started:
+            return
+        run, _ = JOB_TYPES[job.type]
+        try:
+            if job.input_file is not None and job.input_file.endswith(".csv"):
+                _update_job(job_id, total=count_csv_rows(job.input_file))
+            message, result_file = run(job, _progress(job_id))
+        except JobCancelled:
+            db.session.rollback()
+            _finish_job(job_id, "cancelled", "Cancelled, no changes were made.")
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception(f"Job {job_id} ({job.type}) failed")
+            _finish_job(job_id, "failed", str(e))
+        else:
+            _finish_job(job_id, "succeeded", message, result_file=result_file)
+        finally:
+            db.session.remove()
+            if job.input_file is not None and os.path.exists(job.input_file):
+                os.unlink(job.input_file)
+
+
+def create_job(job_type, params, upload=None):
+    """Records a new job, with its uploaded file, and submits it to the app's job runner.
+
+    Args:
+        job_type (str): One of JOB_TYPES
+        params (dict): The form or JSON of the request, an export reads its 'format' from it
+        upload (FileStorage): The file to import
+    Returns:
+        The Job, returns 400 if the type, format or file is not valid
+    """
+    if job_type not in JOB_TYPES:
+        abort(400, description=f"type must be one of: {', '.join(JOB_TYPES)}")
+    _, extension = JOB_TYPES[job_type]
+    input_file = None
+    if extension is None:
+        export_format = params.get("format", "csv")
+        if export_format not in EXPORT_FORMATS:
+            abort(400, description="format must be ndjson or csv")
+        params = {"format": export_format}
+    else:
+        if upload is None or not upload.filename or not upload.filename.lower().endswith(extension):
+            abort(400, description=f"{job_type} needs a {extension} file in the 'file' field")
+        # Save the upload before the job is added, so the jobs database is not locked while a large file is saved
+        fd, input_file = tempfile.mkstemp(suffix=extension, prefix="upload-", dir=jobs_dir(current_app))
+        with os.fdopen(fd, "wb") as file:
+            upload.save(file)
+        params = {"filename": secure_filename(upload.filename)}
+    job = Job(type=job_type, status="queued", params=params, input_file=input_file, created=_utcnow())
+    db.session.add(job)
+    db.session.commit()
+    get_job_runner().submit(job.id)
+    return job
+
+
+def cancel_job(job):
+    """Cancels a queued job straight away, or asks a running job to stop the next time it records its progress.
+
+    Args:
+        job (Job): A job with a status in ACTIVE_STATUSES
+    """
+    # The worker only starts a job that is still queued, and a running job checks cancel_requested, so this cannot
+    # miss a job that starts at the same time
+    db.session.execute(db.update(Job).where(Job.id == job.id, Job.status.in_(ACTIVE_STATUSES))
+                       .values(cancel_requested=True))
+    db.session.execute(db.update(Job).where(Job.id == job.id, Job.status == "queued")
+                       .values(status="cancelled", message="Cancelled before it started.", finished=_utcnow()))
+    db.session.commit()
+    db.session.refresh(job)
+    if job.status == "cancelled" and job.input_file is not None and os.path.exists(job.input_file):
+        os.unlink(job.input_file)
@@ -0,0 +1,178 @@
+"""
+Logging through a queue, so that the request threads do not wait for the log file to be written.
+
+configure_logging() in paralympics.utils puts a LogQueueHandler on the app's logger. On the request thread, the
+handler samples the record, adds the method and path of the request and puts the record on a bounded queue, which
+takes a few microseconds. A QueueListener thread takes the records off the queue and writes them to the log file as JSON
+lines, and to the console if LOG_CONSOLE is set. The records are also passed on to the handlers of the root logger, as
+they were before the queue was added. flush() waits until the listener has written the records in the queue, and when
+the process exits, logging.shutdown() closes the handler, which stops the listener once it has written them.
+
+Records are never blocked on: if the queue is full, e.g. as the disk is slow, the record is dropped and counted. The
+counts of dropped and sampled out records are added to /metrics.
+"""
+import datetime
+import json
+import logging
+import queue
+import random
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import has_request_context, request
+
+# Formats the tracebacks of the records on the request thread, before exc_info is removed
+_traceback_formatter = logging.Formatter()
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats a record as one line of JSON with the time, level, logger, message and, if set, request and exception.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.UTC).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "method", None) is not None:
+            entry["method"] = record.method
+            entry["path"] = record.path
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _FlushMarker:
+    """Put on the queue by LogQueueHandler.flush(), the listener sets done when it reaches it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class LogQueueListener(QueueListener):
+    """QueueListener that tells flush() when it has written the records that were in the queue before a flush."""
+
+    def handle(self, record):
+        if isinstance(record, _FlushMarker):
+            record.done.set()
+        else:
+            super().handle(record)
+
+
+class LogQueueHandler(QueueHandler):
+    """Puts the records on a bounded queue for a QueueListener, without blocking when the queue is full.
+
+    The queue is a queue.SimpleQueue, which is much quicker to put to than a queue.Queue, so its size is checked
+    before each put rather than bounded by the queue. The check and the put are not atomic, so with several threads
+    logging the queue can go slightly over max_size.
+
+    Args:
+        log_queue: queue.SimpleQueue the listener reads from
+        max_size (int): Number of records in the queue above which new records are dropped
+        sampling (dict): Fraction of the records to keep for each level name, e.g. {"DEBUG": 0.01}. Levels that are
+            not in the dict are all kept.
+    """
+
+    def __init__(self, log_queue, max_size=10000, sampling=None):
+        super().__init__(log_queue)
+        self.max_size = max_size
+        self.sampling = {logging.getLevelName(level): rate for level, rate in (sampling or {}).items()}
+        self.listener = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+        self.sampled_out = 0
+
+    def handle(self, record):
+        rate = self.sampling.get(record.levelno)
+        if rate is not None and random.random() >= rate:
+            with self._lock:
+                self.sampled_out += 1
+            return False
+        return super().handle(record)
+
+    def prepare(self, record):
+        """Returns the record ready to be sent to the listener thread.
+
+        The message is formatted now, as the arguments may change after the call. Unlike QueueHandler.prepare(), the
+        traceback is kept out of the message, so that the listener can write it in its own field, and the record is
+        changed rather than copied. The changes do not alter how other handlers, e.g. those of the root logger, format
+        the record, as the traceback is kept in exc_text.
+        """
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = _traceback_formatter.formatException(record.exc_info)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        record.exc_text = exc_text
+        if has_request_context():
+            record.method = request.method
+            record.path = request.path
+        return record
+
+    def emit(self, record):
+        if self.queue.qsize() >= self.max_size:
+            with self._lock:
+                self.dropped += 1
+            return
+        try:
+            self.enqueue(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        """Waits until the listener has written the records in the queue.
+
+        A marker is put on the queue, even if it is full, and the listener thread keeps running, so records logged
+        during the flush, or by other threads flushing at the same time, are written as usual.
+        """
+        # With the lock held, close() cannot stop the listener between the check and the put, so the marker is always
+        # ahead of the listener's sentinel
+        with self._lock:
+            if self.listener is None:
+                return
+            marker = _FlushMarker()
+            self.queue.put_nowait(marker)
+        marker.done.wait()
+
+    def close(self):
+        """Stops the listener, once it has written the records in the queue, and closes the listener's handlers.
+
+        logging.shutdown() closes the handlers when the process exits, so the records are written on shutdown.
+        """
+        with self._lock:
+            listener, self.listener = self.listener, None
+        if listener is not None:
+            listener.stop()
+            for target in listener.handlers:
+                target.close()
+        super().close()
+
+
+def start_queue_logging(handlers, queue_size=10000, sampling=None):
+    """Starts a listener thread that passes the records from a new queue to the handlers.
+
+    Args:
+        handlers: logging.Handler objects that write the records, e.g. to a file
+        queue_size (int): Maximum number of records waiting to be written
+        sampling (dict): Fraction of the records to keep for each level name, see LogQueueHandler
+    Returns:
+        LogQueueHandler to add to the logger, close it to stop the listener
+    """
+    log_queue = queue.SimpleQueue()
+    handler = LogQueueHandler(log_queue, queue_size, sampling)
+    handler.listener = LogQueueListener(log_queue, *handlers, respect_handler_level=True)
+    handler.listener.start()
+    return handler
+
+
+def get_queue_handler(logger):
+    """Returns the LogQueueHandler of the logger, or None if it does not have one."""
+    for handler in logger.handlers:
+        if isinstance(handler, LogQueueHandler):
+            return handler
+    return None
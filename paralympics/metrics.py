@@ -0,0 +1,214 @@
+"""
+Request and SQL metrics in the Prometheus text format.
+
+init_metrics() adds request hooks that record the latency and status of each request, labelled with the route
+rather than the URL so that the number of series stays small, and engine events that count the SQL statements each
+request runs and the time spent in them. GET /metrics returns the metrics, along with the counters of the caches, the
+password hasher and the log queue.
+
+The work done for each request is a few perf_counter() calls and one locked update of the histograms, see
+benchmarks/bench_metrics.py for the measured cost.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+from paralympics import db
+from paralympics.logs import get_queue_handler
+
+# Upper bounds of the histogram buckets, the +Inf bucket is added when the metrics are written
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SQL_QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Content type of the Prometheus text format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """Counts of observed values in buckets with fixed upper bounds, plus their sum.
+
+    Not thread-safe, Metrics holds its lock while updating the histograms.
+
+    Args:
+        buckets: Upper bounds of the buckets in increasing order
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One count for each bucket plus one for values above the last bound, they are made cumulative when written
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        """Yields (le, cumulative count) for each bucket, ending with "+Inf"."""
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield _format_value(bound), total
+        yield "+Inf", self.count
+
+
+class Metrics:
+    """The request metrics of an app, stored in app.extensions["metrics"]."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (method, route) -> Histogram
+        self.latency = {}
+        self.sql_queries = {}
+        self.sql_seconds = {}
+        # (method, route, status) -> count
+        self.responses = {}
+
+    def observe_request(self, method, route, status, seconds, queries, sql_seconds):
+        """Records one request."""
+        key = (method, route)
+        with self._lock:
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = Histogram(LATENCY_BUCKETS)
+                self.sql_queries[key] = Histogram(SQL_QUERY_BUCKETS)
+                self.sql_seconds[key] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+            self.sql_queries[key].observe(queries)
+            self.sql_seconds[key].observe(sql_seconds)
+            status_key = (method, route, status)
+            self.responses[status_key] = self.responses.get(status_key, 0) + 1
+
+    def render(self, extra=()):
+        """Returns the metrics in the Prometheus text format.
+
+        Args:
+            extra: Lines of other metrics to add, e.g. from cache_metrics()
+        """
+        lines = []
+        with self._lock:
+            _add_histograms(lines, "paralympics_request_duration_seconds", "Time taken to handle the request",
+                            self.latency)
+            _add_histograms(lines, "paralympics_request_sql_queries", "Number of SQL statements run by the request",
+                            self.sql_queries)
+            _add_histograms(lines, "paralympics_request_sql_seconds", "Time spent running SQL for the request",
+                            self.sql_seconds)
+            lines.append("# HELP paralympics_responses_total Number of responses by status code")
+            lines.append("# TYPE paralympics_responses_total counter")
+            for (method, route, status), count in sorted(self.responses.items()):
+                lines.append(f"paralympics_responses_total{_labels(method=method, route=route, status=status)} "
+                             f"{count}")
+        lines.extend(extra)
+        return "\n".join(lines) + "\n"
+
+
+def _add_histograms(lines, name, help_text, histograms):
+    """Adds the lines for a histogram metric with a series for each (method, route)."""
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for (method, route), histogram in sorted(histograms.items()):
+        for le, count in histogram.samples():
+            lines.append(f"{name}_bucket{_labels(method=method, route=route, le=le)} {count}")
+        labels = _labels(method=method, route=route)
+        lines.append(f"{name}_sum{labels} {_format_value(histogram.sum)}")
+        lines.append(f"{name}_count{labels} {histogram.count}")
+
+
+def _labels(**labels):
+    """Returns the labels as {name="value",...} with the values escaped."""
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value):
+    """Formats a number without a trailing .0 for whole numbers, e.g. 1 rather than 1.0"""
+    return repr(value) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def cache_metrics(app):
+    """Returns the lines for the counters of the response and token caches, the password hasher and the log queue."""
+    counters = ("hits", "misses", "evictions", "expirations", "invalidations")
+    caches = {"response": app.extensions["response_cache"].stats(),
+              "token": app.extensions["token_cache"].stats()}
+    lines = []
+    for counter in counters:
+        lines.append(f"# HELP paralympics_cache_{counter}_total Number of cache {counter}")
+        lines.append(f"# TYPE paralympics_cache_{counter}_total counter")
+        for cache, stats in caches.items():
+            lines.append(f"paralympics_cache_{counter}_total{_labels(cache=cache)} {stats[counter]}")
+    lines.append("# HELP paralympics_cache_entries Number of entries in the cache")
+    lines.append("# TYPE paralympics_cache_entries gauge")
+    for cache, stats in caches.items():
+        lines.append(f"paralympics_cache_entries{_labels(cache=cache)} {stats['entries']}")
+    lines.append("# HELP paralympics_password_hash_rejected_total Password hashes rejected because the pool was full")
+    lines.append("# TYPE paralympics_password_hash_rejected_total counter")
+    lines.append(f"paralympics_password_hash_rejected_total {app.extensions['password_hasher'].rejected}")
+    log_handler = get_queue_handler(app.logger)
+    if log_handler is not None:
+        lines.append("# HELP paralympics_log_records_dropped_total Log records not written as they were sampled out "
+                     "or the queue was full")
+        lines.append("# TYPE paralympics_log_records_dropped_total counter")
+        lines.append(f"paralympics_log_records_dropped_total{_labels(reason='sampled')} {log_handler.sampled_out}")
+        lines.append(f"paralympics_log_records_dropped_total{_labels(reason='queue_full')} {log_handler.dropped}")
+    return lines
+
+
+def init_metrics(app):
+    """Adds the request hooks, SQL events and /metrics route for the app if METRICS_ENABLED is set.
+
+    Call this after db.init_app() and init_cache().
+    """
+    if not app.config["METRICS_ENABLED"]:
+        return
+    metrics = app.extensions["metrics"] = Metrics()
+
+    @app.before_request
+    def start_request_timer():
+        # [number of statements, seconds], updated by the engine events below
+        g.sql_totals = [0, 0.0]
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop("request_start", None)
+        if start is not None:
+            queries, sql_seconds = g.pop("sql_totals")
+            # The rule, e.g. /events/<event_id>, rather than the path so each event is not a separate series
+            route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+            metrics.observe_request(request.method, route, response.status_code, time.perf_counter() - start,
+                                    queries, sql_seconds)
+        return response
+
+    def start_sql_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info["sql_start"] = time.perf_counter()
+
+    def record_sql(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["sql_start"]
+        # Statements run outside a request, e.g. by init-db, are not recorded
+        if has_request_context():
+            totals = g.get("sql_totals")
+            if totals is not None:
+                totals[0] += 1
+                totals[1] += elapsed
+
+    # The statements run on the engines of SQLALCHEMY_BINDS, such as a read replica, are counted too
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", start_sql_timer)
+        event.listen(engine, "after_cursor_execute", record_sql)
+
+    def get_metrics():
+        """Returns the request, SQL, cache and password hashing metrics in the Prometheus text format."""
+        body = metrics.render(cache_metrics(current_app))
+        return current_app.response_class(body, mimetype=None, content_type=CONTENT_TYPE)
+
+    app.add_url_rule("/metrics", "get_metrics", get_metrics, methods=["GET"])
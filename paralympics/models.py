@@ -1,10 +1,11 @@
+import datetime
+
 from sqlalchemy import ForeignKey
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from typing import List
 
-from werkzeug.security import generate_password_hash, check_password_hash
-
 from paralympics import db
+from paralympics.passwords import get_hasher
 
 
 class Region(db.Model):
@@ -13,22 +14,26 @@ class Region(db.Model):
     region: Mapped[str] = mapped_column(db.Text, nullable=False)
     notes: Mapped[str] = mapped_column(db.Text, nullable=True)
     events: Mapped[List["Event"]] = relationship(back_populates="region")
+    medals: Mapped[List["Medal"]] = relationship(back_populates="region")
 
 
 class Event(db.Model):
     __tablename__ = "event"
     id: Mapped[int] = mapped_column(db.Integer, primary_key=True)
-    type: Mapped[str] = mapped_column(db.Text, nullable=False)
-    year: Mapped[int] = mapped_column(db.Integer, nullable=False)
-    country: Mapped[str] = mapped_column(db.Text, nullable=False)
+    # The columns that can be used to filter /events are indexed. SQLite stores the rowid (id) in every index entry,
+    # so a filter plus 'id > after' for pagination is a single range scan of the index.
+    type: Mapped[str] = mapped_column(db.Text, nullable=False, index=True)
+    year: Mapped[int] = mapped_column(db.Integer, nullable=False, index=True)
+    country: Mapped[str] = mapped_column(db.Text, nullable=False, index=True)
     host: Mapped[str] = mapped_column(db.Text, nullable=False)
-    NOC: Mapped[str] = mapped_column(ForeignKey("region.NOC"))
+    NOC: Mapped[str] = mapped_column(ForeignKey("region.NOC"), index=True)
     region: Mapped["Region"] = relationship(back_populates="events")
-    start: Mapped[str] = mapped_column(db.Text, nullable=True)
-    end: Mapped[str] = mapped_column(db.Text, nullable=True)
+    # The dates are indexed for the start_after and end_before filters of /events
+    start: Mapped[datetime.date] = mapped_column(db.Date, nullable=True, index=True)
+    end: Mapped[datetime.date] = mapped_column(db.Date, nullable=True, index=True)
     duration: Mapped[int] = mapped_column(db.Integer, nullable=True)
     disabilities_included: Mapped[str] = mapped_column(db.Text, nullable=True)
-    countries: Mapped[str] = mapped_column(db.Text, nullable=True)
+    countries: Mapped[int] = mapped_column(db.Integer, nullable=True)
     events: Mapped[int] = mapped_column(db.Integer, nullable=True)
     sports: Mapped[int] = mapped_column(db.Integer, nullable=True)
     participants_m: Mapped[int] = mapped_column(db.Integer, nullable=True)
@@ -45,8 +50,102 @@ class User(db.Model):
     def __repr__(self):
         return '<User {}>'.format(self.email)
 
+    # The hashing runs on the app's password hashing pool, so these raise HashingBusy if the pool's queue is full
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = get_hasher().hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return get_hasher().verify(self.password_hash, password)
+
+    def needs_rehash(self):
+        """Returns True if the password hash does not use the app's current hash method and cost parameters."""
+        return get_hasher().needs_rehash(self.password_hash)
+
+
+class DataVersion(db.Model):
+    """Version number and last modified time of the data in a table.
+
+    The write routes increment the version of the tables they change, and the read routes use it to generate the
+    ETag and Last-Modified headers without having to query the rows.
+    """
+    __tablename__ = "data_version"
+    table_name: Mapped[str] = mapped_column(db.Text, primary_key=True)
+    version: Mapped[int] = mapped_column(db.Integer, nullable=False)
+    modified: Mapped[datetime.datetime] = mapped_column(db.DateTime, nullable=False)
+
+
+# Summary tables for the analytics routes. They are kept up to date by the listeners in paralympics.analytics.
+
+class EventSummary(db.Model):
+    """Totals of the events for each type and year.
+
+    participants_m and participants_f only include events that have both values, so they can be used for the ratio of
+    female participants.
+    """
+    __tablename__ = "event_summary"
+    # type is first in the primary key so that filtering by type is a range of the primary key index
+    type: Mapped[str] = mapped_column(db.Text, primary_key=True)
+    year: Mapped[int] = mapped_column(db.Integer, primary_key=True)
+    games: Mapped[int] = mapped_column(db.Integer, nullable=False, default=0)
+    participants: Mapped[int] = mapped_column(db.Integer, nullable=False, default=0)
+    participants_m: Mapped[int] = mapped_column(db.Integer, nullable=False, default=0)
+    participants_f: Mapped[int] = mapped_column(db.Integer, nullable=False, default=0)
+
+
+class HostSummary(db.Model):
+    """Number of events hosted by each NOC."""
+    __tablename__ = "host_summary"
+    NOC: Mapped[str] = mapped_column(db.Text, primary_key=True)
+    hosted: Mapped[int] = mapped_column(db.Integer, nullable=False, default=0)
+
+
+class Medal(db.Model):
+    """Medals won by a NOC at all the summer or winter events, from data/medals.xlsx.
+
+    The workbook only has the totals for each NOC and type of event, so a medal row is linked to the events by its
+    type rather than to a single event.
+    """
+    __tablename__ = "medal"
+    id: Mapped[int] = mapped_column(db.Integer, primary_key=True)
+    type: Mapped[str] = mapped_column(db.Text, nullable=False)
+    # The workbook has medals for some teams that are not regions, e.g. IPP for Independent Paralympic Participants
+    NOC: Mapped[str] = mapped_column(ForeignKey("region.NOC"), nullable=False, index=True)
+    region: Mapped["Region"] = relationship(back_populates="medals")
+    team: Mapped[str] = mapped_column(db.Text, nullable=False)
+    games: Mapped[int] = mapped_column(db.Integer, nullable=False)
+    gold: Mapped[int] = mapped_column(db.Integer, nullable=False)
+    silver: Mapped[int] = mapped_column(db.Integer, nullable=False)
+    bronze: Mapped[int] = mapped_column(db.Integer, nullable=False)
+    total: Mapped[int] = mapped_column(db.Integer, nullable=False)
+
+    # The medal table for a type is ordered by gold, then silver, then bronze
+    __table_args__ = (db.Index("ix_medal_type_rank", "type", db.desc("gold"), db.desc("silver"), db.desc("bronze")),)
+
+
+class Job(db.Model):
+    """A background import or export, see paralympics.jobs.
+
+    The jobs are in their own database, the "jobs" bind, so that a job can record its progress while its import holds
+    the write lock of the main database.
+    """
+    __tablename__ = "job"
+    __bind_key__ = "jobs"
+    id: Mapped[int] = mapped_column(db.Integer, primary_key=True)
+    type: Mapped[str] = mapped_column(db.Text, nullable=False)
+    # queued, running, succeeded, failed or cancelled
+    status: Mapped[str] = mapped_column(db.Text, nullable=False, default="queued")
+    # The options of the job, e.g. {"format": "csv"} for an export
+    params: Mapped[dict] = mapped_column(db.JSON, nullable=False, default=dict)
+    # Rows imported or exported so far, and the total number of rows once it is known
+    progress: Mapped[int] = mapped_column(db.Integer, nullable=False, default=0)
+    total: Mapped[int] = mapped_column(db.Integer, nullable=True)
+    # The outcome of the job, or why it failed
+    message: Mapped[str] = mapped_column(db.Text, nullable=True)
+    # Set when a running job is asked to stop, the job checks it each time it records its progress
+    cancel_requested: Mapped[bool] = mapped_column(db.Boolean, nullable=False, default=False)
+    # The uploaded file of an import, and the file written by an export
+    input_file: Mapped[str] = mapped_column(db.Text, nullable=True)
+    result_file: Mapped[str] = mapped_column(db.Text, nullable=True)
+    created: Mapped[datetime.datetime] = mapped_column(db.DateTime, nullable=False)
+    started: Mapped[datetime.datetime] = mapped_column(db.DateTime, nullable=True)
+    finished: Mapped[datetime.datetime] = mapped_column(db.DateTime, nullable=True)
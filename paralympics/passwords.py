@@ -0,0 +1,99 @@
+"""
+Password hashing on a bounded pool of worker threads.
+
+Werkzeug's password hashes are deliberately slow. Running them on the request thread lets a burst of logins use every
+CPU and stall the other routes, so they run on a small pool instead. A request that finds the pool and its queue full
+is rejected straight away with HashingBusy rather than waiting behind the others.
+
+hashlib releases the GIL while it hashes, so a thread pool is enough for the hashes to run in parallel with the
+request threads.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+
+class HashingBusy(Exception):
+    """Raised when the password hashing pool and its queue are full."""
+
+
+def method_prefix(method):
+    """Returns the method that Werkzeug writes at the start of a hash made with method, e.g. "scrypt:32768:8:1".
+
+    Werkzeug adds its default cost parameters to a method without them, such as "scrypt", so they are added here in the
+    same way, without making a hash.
+
+    Raises:
+        ValueError: If the method is not scrypt or pbkdf2
+    """
+    name, *args = method.split(":")
+    if name == "scrypt":
+        n, r, p = map(int, args) if args else (2 ** 15, 8, 1)
+        return f"scrypt:{n}:{r}:{p}"
+    if name == "pbkdf2":
+        hash_name = args[0] if args else "sha256"
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{hash_name}:{iterations}"
+    raise ValueError(f"Invalid hash method '{method}'.")
+
+
+class PasswordHasher:
+    """Hashes and verifies passwords on a bounded thread pool.
+
+    Args:
+        method (str): Werkzeug hash method with its cost parameters, e.g. "scrypt:32768:8:1" or
+            "pbkdf2:sha256:600000"
+        workers (int): Number of threads that hash at the same time
+        max_queue (int): Number of hashes that can wait for a thread, once full HashingBusy is raised
+    """
+
+    def __init__(self, method="scrypt:32768:8:1", workers=2, max_queue=8):
+        self.method = method
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        # One slot for each running or waiting hash
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._method_prefix = method_prefix(method)
+        self.rejected = 0
+
+    def submit(self, fn, *args):
+        """Runs fn(*args) on the pool and returns the result.
+
+        Raises:
+            HashingBusy: If all the workers are busy and the queue is full
+        """
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HashingBusy("Too many password hashing requests")
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        return future.result()
+
+    def hash(self, password):
+        """Returns the hash of password using the configured method."""
+        return self.submit(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        """Returns True if password matches pwhash, which can use any method."""
+        return self.submit(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Returns True if pwhash was not made with the configured method and cost parameters."""
+        return pwhash.split("$", 1)[0] != self._method_prefix
+
+
+def init_password_hasher(app):
+    """Creates the password hasher for the app from its config, it is stored in app.extensions["password_hasher"]"""
+    app.extensions["password_hasher"] = PasswordHasher(method=app.config["PASSWORD_HASH_METHOD"],
+                                                       workers=app.config["PASSWORD_HASH_WORKERS"],
+                                                       max_queue=app.config["PASSWORD_HASH_QUEUE"])
+
+
+def get_hasher():
+    """Returns the password hasher of the current app."""
+    return current_app.extensions["password_hasher"]
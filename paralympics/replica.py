@@ -0,0 +1,198 @@
+"""
+Read replica for the GET routes.
+
+The exports and analytics read many rows, and with one database file they share its connections, page cache and
+checkpoints with the writes. To read them from a copy instead, add the copy as a bind and set READ_REPLICA_BIND to
+its key in the instance config, e.g.
+
+    SQLALCHEMY_BINDS = {"replica": "sqlite:////srv/paralympics/replica.sqlite"}
+    READ_REPLICA_BIND = "replica"
+
+The statements of GET and HEAD requests then run on the replica, see RoutingSession in paralympics, while the other
+requests, and everything outside a request, use SQLALCHEMY_DATABASE_URI. Apart from the jobs, which have a database
+of their own, the models have no bind key, so the tables are only created in the primary, and sync_replica() copies
+the whole primary to the replica with SQLite's backup API. Run 'flask --app paralympics sync-replica --every 10' next
+to the workers to keep it up to date. The replica's connections are query only, so a write sent to it by mistake
+fails rather than being lost at the next sync.
+
+The replica can be one sync behind the primary. So that a client sees its own changes, a request that commits sets a
+cookie with the time of the commit, and the client's GET requests read the primary until a sync that started after
+that time. The start time of the last sync is kept in a file next to the replica, e.g. replica.sqlite.sync.json, so
+that every worker process can check it. Until the replica has been synced, or if it has not been synced for
+READ_REPLICA_MAX_LAG seconds, all requests read the primary.
+"""
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+import click
+from flask import current_app, g, has_request_context, request
+from flask.cli import with_appcontext
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from paralympics import db
+from paralympics.utils import sqlite_database_path
+
+# The requests that can read from the replica
+READ_METHODS = {"GET", "HEAD"}
+
+# Cookie with the time of the client's last commit
+WRITE_COOKIE = "paralympics_written"
+
+
+class ReplicaSyncState:
+    """Reads the start time of the replica's last sync from its marker file, again only when the file has changed.
+
+    Args:
+        marker (str): Path of the file written by sync_replica()
+    """
+
+    def __init__(self, marker):
+        self.marker = marker
+        self._mtime = None
+        self._started = None
+
+    def synced_at(self):
+        """Returns the time.time() at which the last sync started, or None if the replica has not been synced."""
+        try:
+            mtime = os.stat(self.marker).st_mtime_ns
+        except OSError:
+            return None
+        if mtime != self._mtime:
+            try:
+                with open(self.marker) as file:
+                    self._started = json.load(file)["started"]
+            except (OSError, ValueError, KeyError):
+                # Read it again on the next request
+                return self._started
+            self._mtime = mtime
+        return self._started
+
+
+def replica_path(app):
+    """Returns the path of the app's replica file, or None if READ_REPLICA_BIND is not set.
+
+    Raises ValueError if the bind is not in SQLALCHEMY_BINDS or is not an SQLite file.
+    """
+    bind = app.config["READ_REPLICA_BIND"]
+    if bind is None:
+        return None
+    url = app.config["SQLALCHEMY_BINDS"].get(bind)
+    if url is None:
+        raise ValueError(f"READ_REPLICA_BIND {bind!r} is not in SQLALCHEMY_BINDS")
+    url = make_url(url["url"] if isinstance(url, dict) else url)
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        raise ValueError(f"The read replica {bind!r} must be an SQLite file")
+    return url.database
+
+
+def sync_marker_path(path):
+    """Returns the path of the file that records the last sync of the replica at path."""
+    return path + ".sync.json"
+
+
+def sync_replica(app):
+    """Copies the app's primary database to its replica with SQLite's backup API.
+
+    The backup reads the primary in one transaction, which does not block its writers in WAL mode, and writes the
+    replica in one transaction, so requests reading the replica see either the old or the new copy. The time the sync
+    started is then written to the marker file; every change committed before that time is in the replica.
+
+    Args:
+        app: The Flask app, READ_REPLICA_BIND must be set
+    Returns:
+        float seconds taken to copy the database
+    """
+    path = replica_path(app)
+    if path is None:
+        raise ValueError("READ_REPLICA_BIND is not set")
+    busy_timeout = app.config["SQLITE_PRAGMAS"].get("busy_timeout", 5000) / 1000
+    started = time.time()
+    source = sqlite3.connect(sqlite_database_path(app), timeout=busy_timeout)
+    target = sqlite3.connect(path, timeout=busy_timeout)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    elapsed = time.time() - started
+    # Write to a temporary file and rename it, so the workers never read a partly written marker
+    marker = sync_marker_path(path)
+    temp_file = f"{marker}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_file, "w") as file:
+        json.dump({"started": started, "seconds": elapsed}, file)
+    os.replace(temp_file, marker)
+    return elapsed
+
+
+def init_replica(app):
+    """Routes the reads of GET requests to the read replica, if READ_REPLICA_BIND is set.
+
+    Call this after configure_engine(), so the replica's connections have the SQLITE_PRAGMAS before they are made
+    query only. Adds the request hooks that choose the engine and set the cookie after a commit.
+    """
+    path = replica_path(app)
+    if path is None:
+        return
+    with app.app_context():
+        replica = db.engines[app.config["READ_REPLICA_BIND"]]
+    state = app.extensions["read_replica"] = ReplicaSyncState(sync_marker_path(path))
+    max_lag = app.config["READ_REPLICA_MAX_LAG"]
+
+    @event.listens_for(replica, "connect")
+    def set_query_only(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA query_only = ON")
+
+    @app.before_request
+    def choose_read_engine():
+        if request.method not in READ_METHODS:
+            return
+        synced = state.synced_at()
+        if synced is None or time.time() - synced > max_lag:
+            return
+        written = request.cookies.get(WRITE_COOKIE)
+        if written is not None:
+            try:
+                if float(written) >= synced:
+                    # The replica may not have the client's last change yet
+                    return
+            except ValueError:
+                pass
+        g.read_engine = replica
+
+    @app.after_request
+    def set_write_cookie(response):
+        committed = g.pop("committed_at", None)
+        if committed is not None:
+            # After max_lag either a sync has copied the change or the reads go to the primary anyway
+            response.set_cookie(WRITE_COOKIE, f"{committed:.6f}", max_age=math.ceil(max_lag), httponly=True,
+                                samesite="Lax")
+        return response
+
+    # The listener is registered on the scoped session, which is shared by every app, so only add it once
+    if not event.contains(db.session, "after_commit", record_commit):
+        event.listen(db.session, "after_commit", record_commit)
+
+
+def record_commit(session):
+    """Records the time a request committed, so that set_write_cookie() can send it to the client."""
+    if has_request_context():
+        g.committed_at = time.time()
+
+
+@click.command("sync-replica")
+@click.option("--every", type=float, default=None, help="Keep running and sync every this many seconds.")
+@with_appcontext
+def sync_replica_command(every):
+    """Copy the database to the read replica."""
+    app = current_app._get_current_object()
+    while True:
+        elapsed = sync_replica(app)
+        click.echo(f"Synced the read replica in {elapsed:.2f}s.")
+        if every is None:
+            return
+        time.sleep(max(every - elapsed, 0))
@@ -1,38 +1,111 @@
 import datetime
 
-from flask import current_app as app, request, abort, jsonify, make_response
+from flask import current_app as app, request, abort, jsonify, make_response, stream_with_context, url_for, send_file
 from sqlalchemy import exc
+from sqlalchemy.orm import joinedload, selectinload
 from marshmallow.exceptions import ValidationError
 
 from paralympics import db
-from paralympics.models import Region, Event, User
-from paralympics.schemas import RegionSchema, EventSchema, UserSchema
-from paralympics.helpers import token_required, encode_auth_token
+from paralympics.models import Region, Event, User, EventSummary, HostSummary, Medal, Job
+from paralympics.schemas import (RegionSchema, EventSchema, RegionEventsSchema, EventRegionSchema, MedalSchema,
+                                 UserSchema, EventSummarySchema, FemaleRatioSchema, HostSummarySchema, JobSchema,
+                                 RowSerializer)
+from paralympics.passwords import HashingBusy
+from paralympics.helpers import (token_required, encode_auth_token, get_filters, get_date_filters, get_page_args,
+                                 get_embeds, get_fields, paginate, add_next_link, end_transaction)
+from paralympics.versions import bump_version, conditional_get, row_exists
+from paralympics.cache import cached_response
+from paralympics.batch import add_batch
+from paralympics.export import export_chunks, EXPORT_FORMATS
+from paralympics.search import match_expression, search_select, search_truncated
+from paralympics.jobs import ACTIVE_STATUSES, create_job, cancel_job
 
 # Flask-Marshmallow Schemas
 regions_schema = RegionSchema(many=True)
 region_schema = RegionSchema()
 events_schema = EventSchema(many=True)
 event_schema = EventSchema()
+region_events_schema = RegionEventsSchema()
+regions_events_schema = RegionEventsSchema(many=True)
+event_region_schema = EventRegionSchema()
+events_region_schema = EventRegionSchema(many=True)
+medal_schema = MedalSchema()
+medals_schema = MedalSchema(many=True)
 user_schema = UserSchema()
+event_summaries_schema = EventSummarySchema(many=True)
+female_ratios_schema = FemaleRatioSchema(many=True)
+host_summaries_schema = HostSummarySchema(many=True)
+job_schema = JobSchema()
+
+# Fast-path serializers for the list routes, generated from the schemas above
+regions_serializer = RowSerializer(region_schema)
+events_serializer = RowSerializer(event_schema)
+medals_serializer = RowSerializer(medal_schema)
+
+# Query parameters that can be used to filter /events, and the function to convert each value
+event_filters = {"year": int, "type": str, "NOC": str, "country": str}
+# Date range query parameters for /events, and the where clause for each. The start and end columns are indexed.
+event_date_filters = {"start_after": lambda date: Event.start > date, "end_before": lambda date: Event.end < date}
+
+# Number of results returned by /events/search when no limit is given
+SEARCH_DEFAULT_LIMIT = 20
+
+
+# The related objects that can be included with ?embed=, and the tables they are read from
+region_embeds = {"events": ("event",)}
+event_embeds = {"region": ("region",)}
+
+# Changes to regions also change the events, as an event's 'region' is empty when there is no region for its NOC.
+# So the region write routes bump the versions of both tables.
+REGION_TABLES = ("region", "event")
+
+
+def hint_date_range(date_filters):
+    """Marks a date range with both bounds as selective, so that SQLite reads the events with the index of a date.
+
+    ANALYZE gives SQLite statistics for equality filters but not for ranges, so for a date filter it reads the pages of
+    events in id order and checks the date of each. With one bound that soon finds a page, as about half the events
+    match. With start_after and end_before the range is usually a few Games, so each filter is wrapped in likelihood(),
+    which tells the planner that it is selective. The comparison can still use the index.
+
+    Args:
+        date_filters: Where clauses from get_date_filters(event_date_filters)
+    Returns:
+        list of where clauses
+    """
+    if len(date_filters) < len(event_date_filters):
+        return date_filters
+    return [db.func.likelihood(clause, db.literal_column("0.001")) for clause in date_filters]
 
 
 # REGION ROUTES
 @app.get("/regions")
+@conditional_get("region", embeds=region_embeds)
+@cached_response("region", embeds=region_embeds)
 def get_regions():
     """Returns a list of NOC region codes and their details in JSON.
 
+    The list can be paged with the optional query parameters 'limit' and 'after', e.g. /regions?limit=50&after=GBR.
+    If there are more regions, the URL of the next page is returned in the Link header.
+    Use ?embed=events to include the list of events for each region.
+
     Returns:
-        JSON for all the regions, or 500 error if not found
+        JSON for the regions, or 500 error if not found
     """
+    embeds = get_embeds(region_embeds)
     try:
-        # Select all the regions using Flask-SQLAlchemy
-        all_regions = db.session.execute(db.select(Region)).scalars()
-        # Dump the data using the Marshmallow regions schema; '.dump()' returns JSON.
+        if "events" in embeds:
+            # Load the events of the whole page with one more query, rather than one query for each region
+            regions, next_after = paginate(db.select(Region).options(selectinload(Region.events)), Region.NOC,
+                                           scalars=True)
+            return add_next_link(make_response(regions_events_schema.dump(regions)), next_after)
+        # Select a page of regions, ordered by NOC code, using Flask-SQLAlchemy
+        rows, next_after = paginate(regions_serializer.select(), Region.NOC)
+        # Dump the rows using the serializer generated from the regions schema; the output matches regions_schema.dump()
         try:
-            result = regions_schema.dump(all_regions)
+            result = regions_serializer.dump(rows)
             # If all OK then return the data in the HTTP response
-            return result
+            return add_next_link(make_response(result), next_after)
         except ValidationError as e:
             app.logger.error(f"A Marshmallow ValidationError occurred dumping all regions: {str(e)}")
             msg = {'message': "An Internal Server Error occurred."}
@@ -44,10 +117,12 @@ def get_regions():
 
 
 @app.get('/regions/<code>')
+@conditional_get("region", embeds=region_embeds, exists=row_exists(Region.NOC))
+@cached_response("region", embeds=region_embeds)
 def get_region(code):
     """ Returns one region in JSON.
 
-    Returns 404 if the region code is not found in the database.
+    Returns 404 if the region code is not found in the database. Use ?embed=events to include the region's events.
 
     Args:
         code (str): The 3 digit NOC code of the region to be searched for
@@ -57,7 +132,13 @@ def get_region(code):
     """
     # Query structure shown at https://flask-sqlalchemy.palletsprojects.com/en/3.1.x/queries/#select
     # Try to find the region, if it is ot found, catch the error and return 404
+    embeds = get_embeds(region_embeds)
     try:
+        if "events" in embeds:
+            region = db.session.execute(
+                db.select(Region).filter_by(NOC=code).options(selectinload(Region.events))
+            ).scalar_one()
+            return region_events_schema.dump(region)
         region = db.session.execute(db.select(Region).filter_by(NOC=code)).scalar_one()
         # Dump the data using the Marshmallow region schema; '.dump()' returns JSON.
         result = region_schema.dump(region)
@@ -86,6 +167,7 @@ def add_region():
 
         try:
             db.session.add(region)
+            bump_version(*REGION_TABLES)
             db.session.commit()
             return {"message": f"Region added with NOC= {region.NOC}"}
         except exc.SQLAlchemyError as e:
@@ -99,6 +181,19 @@ def add_region():
         return make_response(msg, 400)
 
 
+@app.post('/regions/batch')
+def add_regions():
+    """ Adds a list of regions in one transaction.
+
+    Gets the JSON list from the request body and validates it with the Marshmallow regions_schema. Use the query
+    parameter mode=best_effort to add the valid regions when some fail, by default nothing is added if any fail.
+
+    Returns:
+        JSON with the number of regions added and the errors for each failed region by its index in the list
+    """
+    return add_batch(regions_schema, REGION_TABLES, "regions")
+
+
 @app.delete('/regions/<noc_code>')
 def delete_region(noc_code):
     """ Deletes the region with the given code.
@@ -111,6 +206,7 @@ def delete_region(noc_code):
     try:
         region = db.session.execute(db.select(Region).filter_by(NOC=noc_code)).scalar_one()
         db.session.delete(region)
+        bump_version(*REGION_TABLES)
         db.session.commit()
         return {"message": f"Region {noc_code} deleted."}
     except exc.SQLAlchemyError as e:
@@ -161,6 +257,7 @@ def update_region(noc_code):
     # Commit the changes to the database
     try:
         db.session.add(region_update)
+        bump_version(*REGION_TABLES)
         db.session.commit()
         # Return json message
         response = {"message": f"Region {noc_code} updated."}
@@ -173,29 +270,120 @@ def update_region(noc_code):
 
 # EVENT ROUTES
 @app.get("/events")
+@conditional_get("event", embeds=event_embeds)
+@cached_response("event", embeds=event_embeds)
 def get_events():
     """Returns a list of events and their details in JSON.
 
+    The events can be filtered with the optional query parameters 'year', 'type', 'NOC' and 'country', and by date
+    with 'start_after' and 'end_before' (dd/mm/yyyy or yyyy-mm-dd), and paged with 'limit' and 'after', e.g.
+    /events?type=winter&limit=10&after=25 or /events?start_after=01/01/2000&end_before=31/12/2009.
+    If there are more events, the URL of the next page is returned in the Link header.
+    Use ?embed=region to include the details of each event's region rather than its NOC code, and ?fields= to
+    return only some of the fields, e.g. /events?fields=year,host
+
     Returns:
-        JSON for all events
+        JSON for the events
     """
-    all_events = db.session.execute(db.select(Event)).scalars()
-    result = events_schema.dump(all_events)
-    return result
+    filters = get_filters(event_filters)
+    date_filters = hint_date_range(get_date_filters(event_date_filters))
+    fields = get_fields(events_serializer.names)
+    if "region" in get_embeds(event_embeds):
+        # Join the regions in the same query, rather than one query for each event
+        stmt = db.select(Event).filter_by(**filters).where(*date_filters).options(joinedload(Event.region))
+        events, next_after = paginate(stmt, Event.id, scalars=True)
+        schema = events_region_schema if fields is None else EventRegionSchema(many=True, only=fields)
+        return add_next_link(make_response(schema.dump(events)), next_after)
+    # Only select the columns of the requested fields, plus the id that is used for the pages
+    serializer = events_serializer if fields is None else events_serializer.prune(fields, key="id")
+    rows, next_after = paginate(serializer.select().filter_by(**filters).where(*date_filters), Event.id)
+    result = serializer.dump(rows)
+    return add_next_link(make_response(result), next_after)
+
+
+@app.get("/events/export")
+@conditional_get("event")
+def export_events():
+    """Streams the events as a file of newline-delimited JSON or CSV.
+
+    Use the query parameter 'format' to choose ndjson (the default) or csv. The events can be filtered, and the
+    fields chosen, with the same query parameters as /events. The rows are read from the database and written to the
+    response in batches, so memory use does not grow with the number of events.
+
+    Returns:
+        NDJSON or CSV file of the events
+    """
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in EXPORT_FORMATS:
+        abort(400, description="format must be ndjson or csv")
+    filters = get_filters(event_filters)
+    date_filters = hint_date_range(get_date_filters(event_date_filters))
+    fields = get_fields(events_serializer.names)
+    # The id is always selected, so the rows can be ordered by it and the select is always from the event table
+    serializer = events_serializer if fields is None else events_serializer.prune(fields, key="id")
+    stmt = serializer.select().filter_by(**filters).where(*date_filters).order_by(Event.id)
+    # stream_with_context keeps the request context, and so the database session, until the last chunk is sent
+    chunks = stream_with_context(export_chunks(serializer, stmt, export_format))
+    response = app.response_class(chunks, mimetype=EXPORT_FORMATS[export_format])
+    response.headers["Content-Disposition"] = f"attachment; filename=events.{export_format}"
+    return response
+
+
+@app.get("/events/search")
+@conditional_get("event")
+@cached_response("event")
+def search_events():
+    """Returns the events that match a full-text search of their highlights, host and country.
+
+    Use the query parameter 'q' for the words to search for, an event must contain all of them, and the optional
+    'limit' for the number of results, e.g. /events/search?q=wheelchair+tennis&limit=5.
+
+    Every match is ranked unless SEARCH_RANK_CANDIDATES is set, then only the newest matches are ranked and the
+    header X-Search-Truncated: true is added if some were left out.
+
+    Returns:
+        JSON for the events ordered from the best match, each with a 'snippet' of the matching text
+    """
+    query = match_expression(request.args.get("q", ""))
+    if query is None:
+        abort(400, description="q must contain at least one word")
+    limit, _ = get_page_args(int)
+    candidates = app.config["SEARCH_RANK_CANDIDATES"]
+    stmt = search_select(events_serializer.select(), query, candidates)
+    stmt = stmt.limit(limit or SEARCH_DEFAULT_LIMIT)
+    rows = db.session.execute(stmt).all()
+    results = events_serializer.dump(rows)
+    for result, row in zip(results, rows):
+        result["snippet"] = row.snippet
+    response = make_response(results)
+    if search_truncated(query, candidates):
+        response.headers["X-Search-Truncated"] = "true"
+    return response
 
 
 @app.get('/events/<event_id>')
+@conditional_get("event", embeds=event_embeds, exists=row_exists(Event.id))
+@cached_response("event", embeds=event_embeds)
 def get_event(event_id):
     """ Returns the event with the given id JSON.
 
+    Use ?embed=region to include the details of the event's region rather than its NOC code.
+
     Args:
         event_id (int): The id of the event to return
     Returns:
-        JSON
+        JSON, or 404 if the event is not found
     """
-    event = db.session.execute(db.select(Event).filter_by(id=event_id)).scalar_one()
-    result = event_schema.dump(event)
-    return result
+    stmt = db.select(Event).filter_by(id=event_id)
+    if "region" in get_embeds(event_embeds):
+        event = db.session.execute(stmt.options(joinedload(Event.region))).scalar_one_or_none()
+        schema = event_region_schema
+    else:
+        event = db.session.execute(stmt).scalar_one_or_none()
+        schema = event_schema
+    if event is None:
+        abort(404, description="Event not found")
+    return schema.dump(event)
 
 
 @app.post('/events')
@@ -211,10 +399,24 @@ def add_event():
     ev_json = request.get_json()
     event = event_schema.load(ev_json)
     db.session.add(event)
+    bump_version("event")
     db.session.commit()
     return {"message": f"Event added with id= {event.id}"}
 
 
+@app.post('/events/batch')
+def add_events():
+    """ Adds a list of events in one transaction.
+
+    Gets the JSON list from the request body and validates it with the Marshmallow events_schema. Use the query
+    parameter mode=best_effort to add the valid events when some fail, by default nothing is added if any fail.
+
+    Returns:
+        JSON with the number of events added and the errors for each failed event by its index in the list
+    """
+    return add_batch(events_schema, ("event",), "events")
+
+
 @app.delete('/events/<int:event_id>')
 def delete_event(event_id):
     """ Deletes the event with the given id.
@@ -226,6 +428,7 @@ def delete_event(event_id):
     """
     event = db.session.execute(db.select(Event).filter_by(id=event_id)).scalar_one()
     db.session.delete(event)
+    bump_version("event")
     db.session.commit()
     return {"message": f"Event {event_id} deleted."}
 
@@ -239,7 +442,7 @@ def event_update(event_id):
     """
     # Find the event in the database
     existing_event = db.session.execute(
-        db.select(Event).filter_by(event_id=event_id)
+        db.select(Event).filter_by(id=event_id)
     ).scalar_one_or_none()
     # Get the updated details from the json sent in the HTTP patch request
     event_json = request.get_json()
@@ -247,12 +450,195 @@ def event_update(event_id):
     event_updated = event_schema.load(event_json, instance=existing_event, partial=True)
     # Commit the changes to the database
     db.session.add(event_updated)
+    bump_version("event")
     db.session.commit()
     # Return json success message
     response = {"message": f"Event with id={event_id} updated."}
     return response
 
 
+# MEDAL ROUTES
+# Medal tables are ordered by gold, then silver, then bronze, which is the order of the ix_medal_type_rank index
+MEDAL_TABLE_ORDER = (Medal.type, Medal.gold.desc(), Medal.silver.desc(), Medal.bronze.desc(), Medal.NOC)
+
+
+@app.get("/medals")
+@conditional_get("medal")
+@cached_response("medal")
+def get_medals():
+    """Returns the medal tables for the summer and winter events.
+
+    Use the optional query parameters 'type' and 'NOC' to filter the medals, e.g. /medals?type=winter
+
+    Returns:
+        JSON for the medals ordered by type, then by gold, silver and bronze medals
+    """
+    filters = get_filters({"type": str, "NOC": str})
+    rows = db.session.execute(medals_serializer.select().filter_by(**filters).order_by(*MEDAL_TABLE_ORDER)).all()
+    return medals_serializer.dump(rows)
+
+
+@app.get("/medals/<code>")
+@conditional_get("medal", exists=row_exists(Medal.NOC))
+@cached_response("medal")
+def get_region_medals(code):
+    """Returns the medals won by a NOC at the summer and winter events.
+
+    Args:
+        code (str): The 3 digit NOC code
+
+    Returns:
+        JSON for the NOC's medals for each type, otherwise 404 if the NOC has no medals
+    """
+    medals = db.session.execute(db.select(Medal).filter_by(NOC=code).order_by(Medal.type)).scalars().all()
+    if not medals:
+        abort(404, description="No medals found for the NOC")
+    return medals_schema.dump(medals)
+
+
+# ANALYTICS ROUTES
+# These read the summary tables that are kept up to date by paralympics.analytics, which change with the events
+@app.get("/analytics/participants")
+@conditional_get("event")
+@cached_response("event")
+def get_participant_totals():
+    """Returns the number of events and the total participants for each type and year.
+
+    Use the optional query parameter 'type' to return the totals for one type, e.g. /analytics/participants?type=winter
+
+    Returns:
+        JSON for the totals ordered by type and year
+    """
+    filters = get_filters({"type": str})
+    summaries = db.session.execute(
+        db.select(EventSummary).filter_by(**filters).order_by(EventSummary.type, EventSummary.year)
+    ).scalars()
+    return event_summaries_schema.dump(summaries)
+
+
+@app.get("/analytics/female-ratio")
+@conditional_get("event")
+@cached_response("event")
+def get_female_ratios():
+    """Returns the ratio of female participants for each type and year.
+
+    Use the optional query parameter 'type' to return the ratios for one type, e.g. /analytics/female-ratio?type=summer
+
+    Returns:
+        JSON for the ratios ordered by type and year
+    """
+    filters = get_filters({"type": str})
+    summaries = db.session.execute(
+        db.select(EventSummary).filter_by(**filters).order_by(EventSummary.type, EventSummary.year)
+    ).scalars()
+    return female_ratios_schema.dump(summaries)
+
+
+@app.get("/analytics/hosts")
+@conditional_get("event")
+@cached_response("event")
+def get_host_counts():
+    """Returns the number of events hosted by each NOC.
+
+    Returns:
+        JSON for the NOCs ordered by the number of events hosted, most first
+    """
+    hosts = db.session.execute(
+        db.select(HostSummary).order_by(HostSummary.hosted.desc(), HostSummary.NOC)
+    ).scalars()
+    return host_summaries_schema.dump(hosts)
+
+
+# JOB ROUTES
+
+def job_response(job, status=200):
+    """Returns the JSON of a job with the URL of its result, which is None until an export has finished."""
+    job_json = job_schema.dump(job)
+    job_json["result"] = url_for("get_job_result", job_id=job.id) if job.result_file else None
+    return make_response(job_json, status)
+
+
+@app.post("/jobs")
+@token_required
+def add_job():
+    """Starts a background import or export.
+
+    The form field 'type' is import-regions, import-events or import-medals, with the file to import in the field
+    'file', or export-events. The files to import have the same columns as noc_regions.csv and
+    paralympic_events.csv, or the same sheets as medals.xlsx, in the data folder. Imports add the rows, apart from
+    the medals which are replaced. An export writes every event as csv (the default) or ndjson, chosen with the field
+    'format'. The fields can also be sent as JSON for an export.
+
+    Returns:
+        JSON of the job with 202 Accepted and the URL of the job in the Location header
+        If the type, format or file is not valid, return 400
+    """
+    fields = request.get_json(silent=True) or request.form
+    job = create_job(fields.get("type"), fields, request.files.get("file"))
+    response = job_response(job, 202)
+    response.headers["Location"] = url_for("get_job", job_id=job.id)
+    return response
+
+
+@app.get("/jobs/<int:job_id>")
+@token_required
+def get_job(job_id):
+    """Returns the status of a job.
+
+    The status is queued, running, succeeded, failed or cancelled. 'progress' is the number of rows done so far and
+    'total' the number of rows, once it is known. 'result' is the URL to download the file written by an export.
+    As with the other job routes, the request must have the token of a logged in user.
+
+    Args:
+        job_id (int): The id of the job
+
+    Returns:
+        JSON of the job, or 404 if there is no job with the id
+    """
+    job = db.get_or_404(Job, job_id, description=f"Job {job_id} not found.")
+    return job_response(job)
+
+
+@app.get("/jobs/<int:job_id>/result")
+@token_required
+def get_job_result(job_id):
+    """Downloads the file written by an export job. The request must have the token of a logged in user.
+
+    Args:
+        job_id (int): The id of the job
+
+    Returns:
+        The CSV or NDJSON file, or 404 if the job does not exist or has no result yet
+    """
+    job = db.get_or_404(Job, job_id, description=f"Job {job_id} not found.")
+    if not job.result_file:
+        abort(404, description=f"Job {job_id} has no result.")
+    export_format = job.params["format"]
+    return send_file(job.result_file, mimetype=EXPORT_FORMATS[export_format], as_attachment=True,
+                     download_name=f"events.{export_format}")
+
+
+@app.delete("/jobs/<int:job_id>")
+@token_required
+def delete_job(job_id):
+    """Cancels a job.
+
+    A queued job is cancelled straight away. A running job stops, and its changes are rolled back, the next time it
+    records its progress, so its status is 'cancelled' once it has stopped.
+
+    Args:
+        job_id (int): The id of the job
+
+    Returns:
+        JSON of the job with 202 Accepted, 404 if the job does not exist, or 409 if it has already finished
+    """
+    job = db.get_or_404(Job, job_id, description=f"Job {job_id} not found.")
+    if job.status not in ACTIVE_STATUSES:
+        return make_response({"message": f"Job {job_id} has already finished, its status is {job.status}."}, 409)
+    cancel_job(job)
+    return job_response(job, 202)
+
+
 # AUTHENTICATION ROUTES
 @app.post("/register")
 def register():
@@ -269,6 +655,8 @@ def register():
         db.select(User).filter_by(email=user_json.get("email"))
     ).scalar_one_or_none()
     if not user:
+        # Hash the password outside a transaction, so other writes do not wait for it
+        end_transaction()
         try:
             # Create new User object
             user = User(email=user_json.get("email"))
@@ -284,6 +672,13 @@ def register():
             # Log the registered user
             app.logger.info(f"{user.email} registered at {datetime.datetime.now(datetime.UTC)}")
             return make_response(jsonify(response)), 201
+        except exc.IntegrityError:
+            # The same email was registered by another request while the password was hashed
+            db.session.rollback()
+            response = {
+                "message": "User already exists. Please Log in.",
+            }
+            return make_response(jsonify(response)), 409
         except exc.SQLAlchemyError as e:
             app.logger.error(f"A SQLAlchemy database error occurred: {str(e)}")
             response = {
@@ -316,12 +711,25 @@ def login():
     user = db.session.execute(
         db.select(User).filter_by(email=auth.get("email"))
     ).scalar_one_or_none()
+    # Check the password outside a transaction, so other writes do not wait for the hash
+    end_transaction(user)
 
     # If the user is not found, or the password is incorrect, return 401 error
     if not user or not user.check_password(auth.get('password')):
         msg = {'message': 'Incorrect email or password.'}
         return make_response(msg, 401)
 
+    # If the hash method or its cost has changed in the config since the password was set, update the hash now that
+    # we have the password. If the hashing pool is busy, leave it until the next login.
+    try:
+        if user.needs_rehash():
+            user.set_password(auth.get('password'))
+            # Save the new hash in a short transaction of its own
+            db.session.add(user)
+            db.session.commit()
+    except HashingBusy:
+        app.logger.info(f"Password rehash for user {user.id} skipped as the hashing pool is busy")
+
     # If all OK then create the token
     token = encode_auth_token(user.id)
 
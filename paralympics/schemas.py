@@ -1,10 +1,22 @@
 """
 Schemas for each of the models in the paralympics app.
 """
-from paralympics.models import Event, Region, User
+import copy
+import threading
+from collections import OrderedDict
+
+from marshmallow import fields
+from marshmallow_sqlalchemy.fields import Related
+from sqlalchemy import inspect
+
+from paralympics.models import Event, Region, User, EventSummary, HostSummary, Medal, Job
 from paralympics import db, ma
 
 
+# The format of dates in the JSON, e.g. 18/09/1960
+DATE_FORMAT = "%d/%m/%Y"
+
+
 # Flask-Marshmallow Schemas
 
 class RegionSchema(ma.SQLAlchemySchema):
@@ -32,6 +44,38 @@ class EventSchema(ma.SQLAlchemyAutoSchema):
         sqla_session = db.session
         include_relationships = True
 
+    # The dates and number of countries are stored as Date and Integer columns, but the JSON keeps the format of the
+    # CSV data, a dd/mm/yyyy string and a string
+    start = fields.Date(format=DATE_FORMAT, allow_none=True)
+    end = fields.Date(format=DATE_FORMAT, allow_none=True)
+    countries = fields.Integer(as_string=True, allow_none=True)
+
+
+class RegionEventsSchema(RegionSchema):
+    """Marshmallow schema for a region with its events nested in it, used for ?embed=events.
+
+    Load the events with selectinload(Region.events), otherwise each region's events are loaded with a query when
+    they are dumped.
+    """
+    events = ma.Nested(EventSchema, many=True)
+
+
+class EventRegionSchema(EventSchema):
+    """Marshmallow schema for an event with its region nested in it, used for ?embed=region.
+
+    Load the region with joinedload(Event.region), otherwise each event's region is loaded with a query when it is
+    dumped.
+    """
+    region = ma.Nested(RegionSchema, allow_none=True)
+
+
+class MedalSchema(ma.SQLAlchemyAutoSchema):
+    """Marshmallow schema for the medals won by a NOC at the summer or winter events."""
+
+    class Meta:
+        model = Medal
+        include_fk = True
+
 
 class UserSchema(ma.SQLAlchemySchema):
     """Marshmallow schema defining the attributes for creating a new user.
@@ -47,3 +91,168 @@ class UserSchema(ma.SQLAlchemySchema):
 
     email = ma.auto_field()
     password_hash = ma.auto_field()
+
+
+class EventSummarySchema(ma.SQLAlchemyAutoSchema):
+    """Marshmallow schema for the totals of the events for a type and year."""
+
+    class Meta:
+        model = EventSummary
+
+
+class FemaleRatioSchema(ma.SQLAlchemySchema):
+    """Marshmallow schema for the ratio of female participants for a type and year.
+
+    female_ratio is None when none of the events for the type and year have the numbers of male and female
+    participants.
+    """
+
+    class Meta:
+        model = EventSummary
+
+    type = ma.auto_field()
+    year = ma.auto_field()
+    female_ratio = fields.Method("get_female_ratio")
+
+    def get_female_ratio(self, summary):
+        total = summary.participants_m + summary.participants_f
+        return round(summary.participants_f / total, 4) if total else None
+
+
+class HostSummarySchema(ma.SQLAlchemyAutoSchema):
+    """Marshmallow schema for the number of events hosted by a NOC."""
+
+    class Meta:
+        model = HostSummary
+
+
+class JobSchema(ma.SQLAlchemyAutoSchema):
+    """Marshmallow schema for the status of a background job. The paths of its files on the server are not included."""
+
+    class Meta:
+        model = Job
+        exclude = ("input_file", "result_file")
+
+
+# Fast-path serializer for the list routes
+
+class RowSerializer:
+    """Serializer for list routes that is generated once from the dump fields of a Marshmallow schema.
+
+    Instead of loading ORM objects and dispatching every field of every object through the schema, select() gives a
+    Core statement that fetches exactly the values the schema would dump, and dump() turns the result rows into
+    dicts using a function compiled when the serializer is created. The output is the same as schema.dump(), so the
+    JSON response is byte-identical.
+
+    Values that the schema would change when dumping (e.g. a Date formatted as a string, or an Integer field with
+    as_string) are still converted with the schema field, other values are passed through from the row unchanged.
+
+    Use prune() to get a serializer for some of the fields, which selects only their columns.
+
+    Args:
+        schema: The Marshmallow SQLAlchemy schema to copy the fields from, e.g. EventSchema()
+    """
+
+    # Fields whose dumped value is the same as the value read from a column of the matching type
+    passthrough_fields = {fields.Integer: db.Integer, fields.String: db.String}
+
+    # Number of pruned serializers kept by prune()
+    max_pruned = 64
+
+    def __init__(self, schema):
+        mapper = inspect(schema.opts.model)
+        # name -> (column, converter or None) for every dump field, in the order of the schema fields
+        self.fields = {}
+        for name, field in schema.dump_fields.items():
+            prop = mapper.attrs[field.attribute or name]
+            converter = None
+            if isinstance(field, Related):
+                column = self._related_key(prop, field).label(name)
+            else:
+                column = prop.class_attribute.label(name)
+                expected_type = self.passthrough_fields.get(type(field))
+                if (expected_type is None or not isinstance(column.type, expected_type)
+                        or getattr(field, "as_string", False)):
+                    converter = self._converter(field, name)
+            self.fields[name] = (column, converter)
+        self._pruned = OrderedDict()
+        self._lock = threading.Lock()
+        self._build(list(self.fields))
+
+    def _build(self, names, extra_columns=()):
+        """Sets the names, columns and dump_row() for dumping the fields in names.
+
+        extra_columns are selected after the columns of the fields but not dumped.
+        """
+        self.names = names
+        self.columns = [self.fields[name][0] for name in names] + list(extra_columns)
+        converters = {i: self.fields[name][1] for i, name in enumerate(names) if self.fields[name][1] is not None}
+        self.dump_row = self._compile(names, converters)
+
+    def prune(self, names, key=None):
+        """Returns a serializer that selects and dumps only the fields in names.
+
+        The serializers are cached, so each set of names is only compiled once.
+
+        Args:
+            names: Names of the fields to dump, in any order, they are dumped in the order of the schema
+            key (str): Name of a field that is always selected, e.g. the key column used by paginate(), it is
+                only dumped if it is in names
+        Returns:
+            RowSerializer
+        """
+        cache_key = (frozenset(names), key)
+        with self._lock:
+            pruned = self._pruned.get(cache_key)
+            if pruned is not None:
+                self._pruned.move_to_end(cache_key)
+                return pruned
+        pruned = copy.copy(self)
+        selected = [name for name in self.fields if name in names]
+        extra = [self.fields[key][0]] if key is not None and key not in names else []
+        pruned._build(selected, extra)
+        with self._lock:
+            self._pruned[cache_key] = pruned
+            if len(self._pruned) > self.max_pruned:
+                self._pruned.popitem(last=False)
+        return pruned
+
+    @staticmethod
+    def _related_key(prop, field):
+        """Returns a scalar subquery that selects the key that a Related field dumps for a many-to-one relationship.
+
+        A correlated subquery is used rather than a join so that the select still filters on the schema's model
+        with filter_by(). Rows without a related object give None, the same as the schema.
+        """
+        related_keys = field.related_keys
+        if prop.uselist or len(related_keys) != 1:
+            raise ValueError(f"RowSerializer does not support the relationship {prop.key}")
+        related_column = related_keys[0].columns[0]
+        return db.select(related_column).where(prop.primaryjoin).scalar_subquery()
+
+    @staticmethod
+    def _converter(field, name):
+        def convert(value):
+            return None if value is None else field._serialize(value, name, None)
+        return convert
+
+    @staticmethod
+    def _compile(names, converters):
+        """Generates a function that builds the dict for one row, e.g. {'NOC': row[0], 'region': row[1], ...}"""
+        items = []
+        for i, name in enumerate(names):
+            value = f"c{i}(row[{i}])" if i in converters else f"row[{i}]"
+            items.append(f"{name!r}: {value}")
+        source = "def dump_row(row):\n    return {" + ", ".join(items) + "}\n"
+        namespace = {f"c{i}": converter for i, converter in converters.items()}
+        exec(source, namespace)
+        return namespace["dump_row"]
+
+    def select(self):
+        """Returns a Core select statement for the values the schema dumps, in the order of the schema fields."""
+        return db.select(*self.columns)
+
+    def dump(self, rows):
+        """Converts result rows from select() to a list of dicts, the same as schema.dump(objs, many=True)."""
+        dump_row = self.dump_row
+        return [dump_row(row) for row in rows]
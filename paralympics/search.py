@@ -0,0 +1,112 @@
+"""
+Full-text search of the events with SQLite FTS5.
+
+event_fts is an FTS5 index of the highlights, host and country of each event. It is an external content table, so
+the text is only stored in the event table, and triggers on the event table keep the index up to date for every
+insert, update and delete, including the bulk inserts of add_data().
+
+The virtual table and triggers are not part of the SQLAlchemy metadata, as create_all() cannot create them, so
+init_db() creates them with create_search_index().
+"""
+from sqlalchemy import column, func, literal_column, select, table, text
+
+from paralympics import db
+from paralympics.models import Event
+
+# The DDL for the index and the triggers that keep it in sync with the event table
+SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS event_fts USING fts5(
+        highlights, host, country, content='event', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS event_fts_insert AFTER INSERT ON event BEGIN
+        INSERT INTO event_fts(rowid, highlights, host, country) VALUES (new.id, new.highlights, new.host, new.country);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS event_fts_delete AFTER DELETE ON event BEGIN
+        INSERT INTO event_fts(event_fts, rowid, highlights, host, country)
+        VALUES ('delete', old.id, old.highlights, old.host, old.country);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS event_fts_update AFTER UPDATE OF highlights, host, country ON event BEGIN
+        INSERT INTO event_fts(event_fts, rowid, highlights, host, country)
+        VALUES ('delete', old.id, old.highlights, old.host, old.country);
+        INSERT INTO event_fts(rowid, highlights, host, country) VALUES (new.id, new.highlights, new.host, new.country);
+    END""",
+]
+
+# Lightweight table for building queries, it is not in the metadata so create_all() does not try to create it
+event_fts = table("event_fts", column("rowid"), column("rank"))
+
+# Number of tokens around the matches in a snippet
+SNIPPET_TOKENS = 12
+
+
+def create_search_index(connection):
+    """Creates the event_fts index and its triggers if they do not exist.
+
+    If the index is new, it is filled from the rows already in the event table.
+
+    :param connection: SQLAlchemy connection to the app's SQLite database, the caller commits
+    """
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'event_fts'")
+    ).first()
+    for statement in SEARCH_DDL:
+        connection.execute(text(statement))
+    if not exists:
+        connection.execute(text("INSERT INTO event_fts(event_fts) VALUES ('rebuild')"))
+
+
+def match_expression(query):
+    """Converts the text a user searched for to an FTS5 query.
+
+    Each word is quoted, so characters such as '-', '*' and ':' are searched for as text rather than used as FTS5
+    operators, and an event must contain all the words to match.
+
+    :param query: The search text
+    :return: The FTS5 query, or None if the text has no words
+    """
+    words = query.split()
+    if not words:
+        return None
+    return " ".join('"' + word.replace('"', '""') + '"' for word in words)
+
+
+def search_select(stmt, query, candidates=0):
+    """Adds the full-text search of query to a select of the events.
+
+    Ranking costs a few microseconds for every matching event, so a word that is in most events is slow to rank in a
+    large table. If candidates is given, only that many of the newest matching events (those with the highest ids)
+    are ranked, so an older event that matches better is left out, see search_truncated(). The limit is a range of
+    rowids, which FTS5 uses to skip the older matches without reading them.
+
+    :param stmt: Select statement of the event columns to return
+    :param query: FTS5 query from match_expression()
+    :param candidates: Maximum number of matching events to rank, 0 ranks every match
+    :return: The select with a 'snippet' column, ordered from the best match
+    """
+    fts = literal_column("event_fts")
+    match = fts.op("MATCH")(query)
+    snippet = func.snippet(fts, -1, "<b>", "</b>", "…", SNIPPET_TOKENS).label("snippet")
+    stmt = (stmt.add_columns(snippet)
+            .join_from(Event, event_fts, event_fts.c.rowid == Event.id)
+            .where(match))
+    if candidates:
+        # The rowid of the oldest candidate, or NULL if there are fewer matches than candidates
+        lowest_rowid = (select(event_fts.c.rowid).where(match).order_by(event_fts.c.rowid.desc())
+                        .offset(candidates - 1).limit(1).correlate(None).scalar_subquery())
+        stmt = stmt.where(event_fts.c.rowid >= func.coalesce(lowest_rowid, 0))
+    return stmt.order_by(event_fts.c.rank)
+
+
+def search_truncated(query, candidates):
+    """Returns True if search_select() with candidates leaves out some of the events that match query.
+
+    :param query: FTS5 query from match_expression()
+    :param candidates: Maximum number of matching events to rank, as for search_select()
+    :return: True if more than candidates events match
+    """
+    if not candidates:
+        return False
+    fts = literal_column("event_fts")
+    # Like the limit in search_select(), this is a scan of the rowids of the newest matches
+    older = select(event_fts.c.rowid).where(fts.op("MATCH")(query)).order_by(event_fts.c.rowid.desc())
+    return db.session.execute(older.offset(candidates).limit(1)).first() is not None
@@ -0,0 +1,327 @@
+"""
+Read-only snapshot of the GET responses, served from a memory-mapped file.
+
+'flask --app paralympics build-snapshot' renders the responses of the GET routes with their schemas and writes them
+to one file: the list of regions and each region, the list of events and each event, each page of both lists for
+the limits in SNAPSHOT_PAGE_SIZES, the medal tables and the analytics. With SNAPSHOT_FILE set to the file, a GET
+request for one of these URLs, without any other query parameters, is answered from the file before the route is
+called. The body, and a gzip copy of it for responses of at least COMPRESSION_MIN_SIZE bytes, are copied straight
+from the mmap with the headers the route would set, so no SQL is run and nothing is serialized. Other GET requests,
+e.g. with filters or ?embed=, fall through to the routes and the database.
+
+SNAPSHOT_WRITES chooses what happens to POST, PUT, PATCH and DELETE requests. With "reject", the default, they return
+405. With "staging" they change the database as usual, which then acts as a staging copy: the snapshot keeps serving
+the data it was built from until it is built again, while the requests that fall through read the staged changes.
+The workers check the file on each request and open it again when the build replaces it.
+
+The file starts with a header, followed by the keys, bodies and headers of the responses, then a sorted array of the
+64-bit hashes of the keys and a record for each hash with the offsets of its data. A lookup is a binary search of the
+hashes in the mmap, so opening the file does not read it, and the workers share its pages in the OS cache.
+"""
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from urllib.parse import urlencode
+
+import click
+from flask import abort, current_app, request
+from flask.cli import with_appcontext
+from werkzeug.http import http_date, parse_date
+
+from paralympics import db
+from paralympics.compression import ENCODINGS, compress, etag_variants
+from paralympics.engine import WRITE_METHODS
+from paralympics.versions import get_validators
+from paralympics.models import Event, EventSummary, HostSummary, Region
+
+MAGIC = b"PARASNAP"
+VERSION = 1
+# magic, version, byte order of the hashes (0 little, 1 big), number of entries, offset of the hashes, offset of the
+# records, time the snapshot was built
+HEADER = struct.Struct("<8sIIQQQd")
+# Offset and length of the key, the body, the gzip body (length 0 if there is none) and the JSON of the headers
+RECORD = struct.Struct("<QIQIQIQI")
+
+# The requests that are served from the snapshot
+READ_METHODS = {"GET", "HEAD"}
+
+
+def snapshot_key(path, args):
+    """Returns the key of a response in the snapshot: the path and the query parameters in sorted order."""
+    args = sorted(args)
+    return f"{path}?{urlencode(args)}" if args else path
+
+
+def key_hash(key):
+    """Returns the 64-bit hash of a key that the snapshot is sorted by."""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), sys.byteorder)
+
+
+class Snapshot:
+    """A snapshot file opened with mmap.
+
+    Args:
+        path (str): Path of a file written by SnapshotWriter
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self.stat = os.fstat(file.fileno())
+            self.mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, big_endian, self.count, hashes_offset, self.records_offset, self.built = \
+            HEADER.unpack_from(self.mm)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} snapshot")
+        if big_endian != (sys.byteorder == "big"):
+            raise ValueError(f"{path} was built on a machine with a different byte order")
+        self.hashes = memoryview(self.mm)[hashes_offset:hashes_offset + 8 * self.count].cast("Q")
+
+    def get(self, key, gzip=False):
+        """Returns (body, headers, encoding) for the key, or None if it is not in the snapshot.
+
+        Args:
+            key (str): Key from snapshot_key()
+            gzip (bool): True to return the gzip body if there is one, encoding is then "gzip" rather than None
+        """
+        hashed = key_hash(key)
+        i = bisect.bisect_left(self.hashes, hashed)
+        encoded_key = key.encode()
+        while i < self.count and self.hashes[i] == hashed:
+            key_offset, key_length, body_offset, body_length, gzip_offset, gzip_length, headers_offset, \
+                headers_length = RECORD.unpack_from(self.mm, self.records_offset + i * RECORD.size)
+            if self.mm[key_offset:key_offset + key_length] == encoded_key:
+                headers = json.loads(self.mm[headers_offset:headers_offset + headers_length])
+                if gzip and gzip_length:
+                    return self.mm[gzip_offset:gzip_offset + gzip_length], headers, "gzip"
+                return self.mm[body_offset:body_offset + body_length], headers, None
+            i += 1
+        return None
+
+
+class SnapshotWriter:
+    """Writes a snapshot file, call add() for each response and then close().
+
+    The file is written to a temporary file and renamed when it is closed, so the workers never open a partly
+    written snapshot.
+
+    Args:
+        path (str): Path of the snapshot file
+        gzip_min_size (int): Bodies of at least this many bytes are also stored compressed with gzip, None for none
+        level (int): zlib compression level
+    """
+
+    def __init__(self, path, gzip_min_size=None, level=6):
+        self.path = path
+        self.temp_path = f"{path}.{os.getpid()}.tmp"
+        self.gzip_min_size = gzip_min_size
+        self.level = level
+        self.file = open(self.temp_path, "wb")
+        self.file.write(bytes(HEADER.size))
+        self.offset = HEADER.size
+        # (hash, record) for each entry
+        self.entries = []
+
+    def _write(self, data):
+        """Writes data and returns its offset and length."""
+        offset = self.offset
+        self.file.write(data)
+        self.offset += len(data)
+        return offset, len(data)
+
+    def add(self, key, body, headers):
+        """Adds a response.
+
+        Args:
+            key (str): Key from snapshot_key()
+            body (bytes): The uncompressed body
+            headers (dict): The response headers, other than Content-Length and Content-Encoding
+        """
+        record = self._write(key.encode()) + self._write(body)
+        if self.gzip_min_size is not None and len(body) >= self.gzip_min_size:
+            record += self._write(compress(body, "gzip", self.level))
+        else:
+            record += (0, 0)
+        record += self._write(json.dumps(headers).encode())
+        self.entries.append((key_hash(key), RECORD.pack(*record)))
+
+    def close(self):
+        """Writes the hashes and records and replaces the snapshot file."""
+        self.entries.sort(key=lambda entry: entry[0])
+        # The hashes are 8-byte aligned so they can be read with memoryview.cast()
+        self._write(bytes(-self.offset % 8))
+        hashes_offset, _ = self._write(struct.pack(f"={len(self.entries)}Q", *(h for h, _ in self.entries)))
+        records_offset, _ = self._write(b"".join(record for _, record in self.entries))
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, sys.byteorder == "big", len(self.entries), hashes_offset,
+                                    records_offset, time.time()))
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+
+class SnapshotReader:
+    """Opens the snapshot file, and opens it again when it has been replaced by a new build.
+
+    Args:
+        path (str): Path of the snapshot file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.snapshot = None
+
+    def current(self):
+        """Returns the current Snapshot, or None if the file does not exist."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        snapshot = self.snapshot
+        if snapshot is None or (stat.st_ino, stat.st_mtime_ns) != (snapshot.stat.st_ino, snapshot.stat.st_mtime_ns):
+            # The old mmap is closed when the requests still using it have finished with it
+            snapshot = self.snapshot = Snapshot(self.path)
+        return snapshot
+
+
+def build_snapshot(app, path):
+    """Renders the GET responses of the regions, events, medals and analytics routes into a snapshot file.
+
+    The bodies are dumped with the same schemas and serializers as the routes and encoded by app.json, and the
+    ETag and Last-Modified headers come from the data versions, so each response is the same as the route's.
+
+    Args:
+        app: The Flask app
+        path (str): Path of the snapshot file, it is replaced if it exists
+    Returns:
+        int number of responses in the snapshot
+    """
+    # The routes are imported when the app is created, this gets the module with the schemas they use
+    from paralympics import routes
+
+    gzip_min_size = app.config["COMPRESSION_MIN_SIZE"] if app.config["COMPRESSION_ENABLED"] else None
+    writer = SnapshotWriter(path, gzip_min_size, app.config["COMPRESSION_LEVEL"])
+    with app.app_context():
+        validators = {}
+        for tables in (("region",), ("event",), ("medal",)):
+            etag, last_modified = get_validators(tables)
+            headers = {"Content-Type": "application/json", "ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+            if last_modified is not None:
+                headers["Last-Modified"] = http_date(last_modified)
+            validators[tables[0]] = headers
+
+        def add(key, data, table, link=None):
+            headers = validators[table]
+            if link is not None:
+                headers = {**headers, "Link": f'<{link}>; rel="next"'}
+            writer.add(key, app.json.response(data).get_data(), headers)
+
+        def add_list(path, serializer, key_column, table):
+            """Adds the list, each page of it and each item."""
+            rows = db.session.execute(serializer.select().order_by(key_column)).all()
+            items = serializer.dump(rows)
+            add(path, items, table)
+            for item in items:
+                add(f"{path}/{item[key_column.key]}", item, table)
+            for size in app.config["SNAPSHOT_PAGE_SIZES"]:
+                # The pages from ?limit= and each ?limit=&after= linked from them, limit is capped as in get_page_args
+                limit = min(size, app.config["MAX_PAGE_LIMIT"])
+                after = None
+                for start in range(0, max(len(items), 1), limit):
+                    page = items[start:start + limit]
+                    next_after = page[-1][key_column.key] if start + limit < len(items) else None
+                    # The same URL as add_next_link() gives the request for this page
+                    link = None if next_after is None else f"{path}?{urlencode({'limit': size, 'after': next_after})}"
+                    args = [("limit", str(size))] + ([] if after is None else [("after", str(after))])
+                    add(snapshot_key(path, args), page, table, link)
+                    after = next_after
+
+        add_list("/regions", routes.regions_serializer, Region.NOC, "region")
+        add_list("/events", routes.events_serializer, Event.id, "event")
+
+        serializer = routes.medals_serializer
+        medals = serializer.dump(db.session.execute(serializer.select().order_by(*routes.MEDAL_TABLE_ORDER)).all())
+        add("/medals", medals, "medal")
+        # /medals/<code> is ordered by type
+        for code in sorted({medal["NOC"] for medal in medals}):
+            add(f"/medals/{code}", sorted((m for m in medals if m["NOC"] == code), key=lambda m: m["type"]), "medal")
+
+        summaries = db.session.execute(
+            db.select(EventSummary).order_by(EventSummary.type, EventSummary.year)
+        ).scalars().all()
+        add("/analytics/participants", routes.event_summaries_schema.dump(summaries), "event")
+        add("/analytics/female-ratio", routes.female_ratios_schema.dump(summaries), "event")
+        hosts = db.session.execute(
+            db.select(HostSummary).order_by(HostSummary.hosted.desc(), HostSummary.NOC)
+        ).scalars().all()
+        add("/analytics/hosts", routes.host_summaries_schema.dump(hosts), "event")
+    count = len(writer.entries)
+    writer.close()
+    return count
+
+
+def init_snapshot(app):
+    """Serves the GET requests in the snapshot and handles the writes as set by SNAPSHOT_WRITES, if SNAPSHOT_FILE is
+    set.
+
+    Call this after init_metrics() and init_compression(), so the snapshot responses are counted and can be
+    compressed with deflate for clients that do not accept gzip.
+    """
+    path = app.config["SNAPSHOT_FILE"]
+    if path is None:
+        return
+    if app.config["SNAPSHOT_WRITES"] not in ("reject", "staging"):
+        raise ValueError("SNAPSHOT_WRITES must be 'reject' or 'staging'")
+    reader = app.extensions["snapshot"] = SnapshotReader(path)
+    reject_writes = app.config["SNAPSHOT_WRITES"] == "reject"
+
+    @app.before_request
+    def serve_snapshot():
+        if request.method in WRITE_METHODS:
+            if reject_writes:
+                abort(405, valid_methods=sorted(READ_METHODS), description="This server is a read-only snapshot")
+            return None
+        if request.method not in READ_METHODS:
+            return None
+        snapshot = reader.current()
+        if snapshot is None:
+            return None
+        gzip = request.accept_encodings.best_match(ENCODINGS) == "gzip"
+        found = snapshot.get(snapshot_key(request.path, request.args.items(multi=True)), gzip)
+        if found is None:
+            return None
+        body, headers, encoding = found
+        etag = headers["ETag"].strip('"')
+        # Answer conditional requests as conditional_get() does
+        if request.if_none_match:
+            matched = [tag for tag in [etag, *etag_variants(etag)] if request.if_none_match.contains(tag)]
+        else:
+            since = request.if_modified_since
+            last_modified = parse_date(headers.get("Last-Modified"))
+            matched = [etag] if since is not None and last_modified is not None and last_modified <= since else []
+        if matched:
+            response = current_app.response_class(status=304, headers=headers)
+            response.set_etag(matched[0])
+        else:
+            response = current_app.response_class(body, headers=headers)
+            if encoding is not None:
+                response.headers["Content-Encoding"] = encoding
+                response.set_etag(f"{etag}-{encoding}")
+        response.vary.add("Accept-Encoding")
+        response.headers["X-Snapshot"] = "HIT"
+        return response
+
+
+@click.command("build-snapshot")
+@click.option("--output", default=None, help="Path of the snapshot file, defaults to SNAPSHOT_FILE.")
+@with_appcontext
+def build_snapshot_command(output):
+    """Render the GET responses into a read-only snapshot file."""
+    app = current_app._get_current_object()
+    path = output or app.config["SNAPSHOT_FILE"] or os.path.join(app.instance_path, "paralympics.snapshot")
+    start = time.perf_counter()
+    count = build_snapshot(app, path)
+    click.echo(f"Wrote {count} responses to {path} in {time.perf_counter() - start:.1f}s.")
@@ -1,72 +1,388 @@
 # Helper classes
 import csv
+import datetime
+import hashlib
+import itertools
+import json
+import os
 from pathlib import Path
 import logging
 
-from paralympics.models import Region, Event
+import click
+import sqlalchemy
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy.engine import make_url
 
+from paralympics.models import Region, Event, Medal
+from paralympics.versions import bump_version
+from paralympics.analytics import rebuild_summaries
+from paralympics.search import SEARCH_DDL, create_search_index
+from paralympics.logs import JSONFormatter, get_queue_handler, start_queue_logging
 
-def add_data(db):
+DATA_DIR = Path(__file__).parent.parent.joinpath("data")
+# The files that add_data() loads, a change to any of them changes the seed checksum
+SEED_FILES = ["noc_regions.csv", "paralympic_events.csv", "medals.xlsx"]
+# The sheets of medals.xlsx that are loaded and the event type of each, the 'Total' sheet is the sum of these
+MEDAL_SHEETS = {"Summer": "summer", "Winter": "winter"}
+# The workbook's codes that are not NOC codes
+MEDAL_CODE_FIXES = {")[a": "CHN"}
+# Format of the log records written to the console
+LOG_FORMAT = '[%(asctime)s] %(levelname)s %(name)s: %(message)s'
+
+
+def add_data(db, chunk_size=5000, progress=None):
     """Adds data to the database if it does not already exist.
 
-    This method uses db which is the FlaskSQLALchemy instance for the app
+    This method uses db which is the FlaskSQLALchemy instance for the app. The regions and events are inserted with
+    bulk_load_csv() and committed in one transaction, along with the rebuilt summary tables and, for SQLite, the
+    statistics from ANALYZE.
 
     :param db: SQLAlchemy database for the app
+    :param chunk_size: Number of CSV rows inserted with each executemany
+    :param progress: Optional function called as progress(table_name, rows_inserted) after each chunk
     """
+    changed = []
 
     # If there are no regions in the database, then add them
     first_region = db.session.execute(db.select(Region)).first()
     if not first_region:
         print("Start adding region data to the database")
-        region_file = Path(__file__).parent.parent.joinpath("data", "noc_regions.csv")
-        with open(region_file, 'r') as file:
-            csv_reader = csv.reader(file)
-            next(csv_reader)  # Skip header row
-            for row in csv_reader:
-                # row[0] is the first column, row[1] is the second column
-                r = Region(NOC=row[0], region=row[1], notes=row[2])
-                db.session.add(r)
-            db.session.commit()
+        bulk_load_csv(db, Region, DATA_DIR.joinpath("noc_regions.csv"), region_values, chunk_size,
+                      _table_progress("region", progress))
+        changed += ["region", "event"]
 
     # If there are no Events, then add them
     first_event = db.session.execute(db.select(Event)).first()
     if not first_event:
-        event_file = Path(__file__).parent.parent.joinpath("data", "paralympic_events.csv")
-        with open(event_file, 'r') as file:
-            csv_reader = csv.reader(file)
-            next(csv_reader)  # Skip header row
-            for row in csv_reader:
-                # row[0] is the first column, row[1] is the second column etc
-                e = Event(type=row[0],
-                          year=row[1],
-                          country=row[2],
-                          host=row[3],
-                          NOC=row[4],
-                          start=row[5],
-                          end=row[6],
-                          duration=row[7] or None,
-                          disabilities_included=row[8],
-                          countries=row[9] or None,
-                          events=row[10] or None,
-                          sports=row[11] or None,
-                          participants_m=row[12] or None,
-                          participants_f=row[13] or None,
-                          participants=row[14] or None,
-                          highlights=row[15])
-                db.session.add(e)
-            db.session.commit()
+        bulk_load_csv(db, Event, DATA_DIR.joinpath("paralympic_events.csv"), event_values, chunk_size,
+                      _table_progress("event", progress))
+        changed.append("event")
+
+    # The bulk inserts are not seen by the listeners that maintain the summary tables, and the summary tables may
+    # have just been created in an existing database, so they are always rebuilt
+    rebuild_summaries(db)
+    # If there are no medals, then add them from the Parquet cache of the workbook
+    first_medal = db.session.execute(db.select(Medal)).first()
+    if not first_medal:
+        medals = load_medal_frame(DATA_DIR.joinpath("medals.xlsx"),
+                                  os.path.join(current_app.instance_path, "medals.parquet"))
+        db.session.execute(db.insert(Medal.__table__), medals.to_dict("records"))
+        changed.append("medal")
+
+    if changed:
+        bump_version(*set(changed))
+        if db.engine.dialect.name == "sqlite":
+            # Record statistics of the tables and indexes, which SQLite's query planner uses to choose an index
+            db.session.execute(db.text("ANALYZE"))
+    db.session.commit()
+
+
+def _table_progress(table_name, progress):
+    """Wraps a progress(table_name, rows) callback as the progress(rows) callback of bulk_load_csv()"""
+    if progress is None:
+        return None
+    return lambda rows: progress(table_name, rows)
+
+
+def bulk_load_csv(db, model, csv_file, row_values, chunk_size=5000, progress=None, table=None):
+    """Inserts the rows of a CSV file into the table for a model.
+
+    The file is read in chunks of chunk_size rows and each chunk is inserted with a single executemany of a Core
+    insert(), so no ORM objects are created and the memory used does not grow with the size of the file. The rows
+    are not committed, so the caller can load several files in one transaction and commit or roll back once.
+
+    :param db: SQLAlchemy database for the app
+    :param model: The model class for the table, e.g. Event
+    :param csv_file: Path of the CSV file, the first row must be the header
+    :param row_values: Function that converts a CSV row (a list of strings) to a dict of column values
+    :param chunk_size: Number of rows to insert with each executemany
+    :param progress: Optional function called with the total number of rows inserted so far after each chunk
+    :param table: Optional Table with the same columns to insert into instead of the model's, e.g. a staging table
+    :return: The number of rows inserted
+    """
+    total = 0
+    # Insert into the Table rather than the model, so SQLAlchemy skips the ORM bulk insert bookkeeping
+    insert_stmt = db.insert(model.__table__ if table is None else table)
+    with open(csv_file, 'r', newline='', encoding='utf-8-sig') as file:
+        csv_reader = csv.reader(file)
+        next(csv_reader)  # Skip header row
+        while True:
+            chunk = [row_values(row) for row in itertools.islice(csv_reader, chunk_size)]
+            if not chunk:
+                break
+            db.session.execute(insert_stmt, chunk)
+            total += len(chunk)
+            if progress is not None:
+                progress(total)
+    return total
+
+
+def region_values(row):
+    """Converts a row of noc_regions.csv to the column values for a Region."""
+    # row[0] is the first column, row[1] is the second column
+    return {"NOC": row[0], "region": row[1], "notes": row[2]}
+
+
+def event_values(row):
+    """Converts a row of paralympic_events.csv to the column values for an Event."""
+    # row[0] is the first column, row[1] is the second column etc
+    return {"type": row[0],
+            "year": int(row[1]),
+            "country": row[2],
+            "host": row[3],
+            "NOC": row[4],
+            "start": _date_or_none(row[5]),
+            "end": _date_or_none(row[6]),
+            "duration": _int_or_none(row[7]),
+            "disabilities_included": row[8],
+            "countries": _int_or_none(row[9]),
+            "events": _int_or_none(row[10]),
+            "sports": _int_or_none(row[11]),
+            "participants_m": _int_or_none(row[12]),
+            "participants_f": _int_or_none(row[13]),
+            "participants": _int_or_none(row[14]),
+            "highlights": row[15]}
+
+
+def _int_or_none(value):
+    """Converts a CSV value to an int, or None if it is empty."""
+    return int(value) if value else None
+
+
+def _date_or_none(value):
+    """Converts a dd/mm/yyyy CSV value to a date, or None if it is empty."""
+    if not value:
+        return None
+    # Quicker than strptime(), which matters for the bulk loads
+    day, month, year = value.split("/")
+    return datetime.date(int(year), int(month), int(day))
+
+
+def migrate_event_columns(connection):
+    """Converts an event table that stores start and end as dd/mm/yyyy Text, and countries as Text, to the Date and
+    Integer columns of the Event model.
+
+    SQLite cannot change the type of a column, so the table is renamed, created again with the current columns and
+    indexes, and the rows are copied across with the values converted in SQL. The ids do not change, so the search
+    index is still valid; its triggers are dropped with the old table and created again by create_search_index().
+    Does nothing if the table is new or already has Date columns.
+
+    :param connection: SQLAlchemy connection to the app's SQLite database, the caller commits
+    :return: True if the table was converted
+    """
+    inspector = sqlalchemy.inspect(connection)
+    if not inspector.has_table("event"):
+        return False
+    columns = {column["name"]: column["type"] for column in inspector.get_columns("event")}
+    if isinstance(columns["start"], sqlalchemy.Date):
+        return False
+    for index in inspector.get_indexes("event"):
+        connection.execute(sqlalchemy.text(f'DROP INDEX "{index["name"]}"'))
+    connection.execute(sqlalchemy.text("ALTER TABLE event RENAME TO event_text_columns"))
+    for trigger in connection.execute(sqlalchemy.text(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'event_text_columns'")).scalars():
+        connection.execute(sqlalchemy.text(f'DROP TRIGGER "{trigger}"'))
+    Event.__table__.create(connection)
+    # The columns of both tables, with the SQL that converts the old values
+    values = {name: f'"{name}"' for name in columns if name in Event.__table__.columns}
+    for name in ("start", "end"):
+        # dd/mm/yyyy to the yyyy-mm-dd strings that SQLAlchemy stores for a Date, anything else becomes NULL
+        day, month, year = f'substr("{name}", 1, 2)', f'substr("{name}", 4, 2)', f'substr("{name}", 7, 4)'
+        values[name] = f"""CASE WHEN "{name}" LIKE '__/__/____' THEN {year} || '-' || {month} || '-' || {day} END"""
+    values["countries"] = "CAST(NULLIF(countries, '') AS INTEGER)"
+    names = ", ".join(f'"{name}"' for name in values)
+    connection.execute(sqlalchemy.text(
+        f"INSERT INTO event ({names}) SELECT {', '.join(values.values())} FROM event_text_columns"
+    ))
+    connection.execute(sqlalchemy.text("DROP TABLE event_text_columns"))
+    return True
+
+
+def load_medal_frame(xlsx_file, parquet_file):
+    """Returns a DataFrame of the medals in the workbook, using a Parquet copy of the data when it is up to date.
+
+    Reading the workbook with openpyxl is slow, so the cleaned data is written to parquet_file the first time and
+    later calls read that instead. The SHA-256 of the workbook is stored in the Parquet metadata, so a changed
+    workbook is read again.
+
+    :param xlsx_file: Path of medals.xlsx
+    :param parquet_file: Path of the Parquet cache, it is created if it does not exist
+    :return: DataFrame with a column for each Medal column apart from id
+    """
+    # pandas and pyarrow are slow to import, so they are only imported when the medals are loaded
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    source_checksum = hashlib.sha256(Path(xlsx_file).read_bytes()).hexdigest()
+    if os.path.exists(parquet_file):
+        try:
+            table = pq.read_table(parquet_file)
+            if (table.schema.metadata or {}).get(b"source_sha256") == source_checksum.encode():
+                return table.to_pandas()
+        except (OSError, pa.ArrowException):
+            # A damaged cache is replaced below
+            pass
+    medals = read_medals_xlsx(xlsx_file)
+    table = pa.Table.from_pandas(medals, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"source_sha256": source_checksum})
+    # Write to a temporary file and rename it, so another process never reads a partly written cache
+    os.makedirs(os.path.dirname(os.path.abspath(parquet_file)), exist_ok=True)
+    temp_file = f"{parquet_file}.{os.getpid()}.tmp"
+    pq.write_table(table, temp_file)
+    os.replace(temp_file, parquet_file)
+    return medals
+
+
+def read_medals_xlsx(xlsx_file):
+    """Reads and cleans the summer and winter sheets of medals.xlsx.
+
+    The row of totals at the end of each sheet is removed, the codes in MEDAL_CODE_FIXES are corrected and the
+    spaces around the team names are removed.
+
+    :param xlsx_file: Path of medals.xlsx
+    :return: DataFrame with a column for each Medal column apart from id
+    """
+    import pandas as pd
+
+    sheets = pd.read_excel(xlsx_file, sheet_name=list(MEDAL_SHEETS))
+    frames = []
+    for sheet_name, event_type in MEDAL_SHEETS.items():
+        sheet = sheets[sheet_name].dropna(subset=["Code"])
+        frames.append(pd.DataFrame({
+            "type": event_type,
+            "NOC": sheet["Code"].replace(MEDAL_CODE_FIXES),
+            "team": sheet["Team"].str.strip(),
+            "games": sheet["Number"],
+            "gold": sheet["Gold"],
+            "silver": sheet["Silver"],
+            "bronze": sheet["Bronze"],
+            "total": sheet["Total"],
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def init_db(app):
+    """Creates the tables, adds the data and records the seed checksum for the app's database.
+
+    create_all() only creates tables that are not already in the database, and add_data() only adds data to empty
+    tables, so this is safe to run on a database that has already been initialised.
+
+    :param app: The Flask app
+    """
+    from paralympics import db
+    with app.app_context():
+        # The models are in the primary database apart from the jobs, a read replica is a copy of the primary, see
+        # paralympics.replica
+        db.create_all(bind_key=[None, "jobs"])
+        if db.engine.dialect.name == "sqlite":
+            # Convert the columns of an event table created before start, end and countries had their current types
+            migrate_event_columns(db.session.connection())
+            # Create the full-text search index before the data is added, so the triggers index the new events
+            create_search_index(db.session.connection())
+        add_data(db)
+    marker = seed_marker_path(app)
+    if marker is not None:
+        with open(marker, "w") as file:
+            json.dump({"checksum": seed_checksum(app)}, file)
+
+
+def seed_checksum(app):
+    """Returns a checksum of the seed data files and the table definitions.
+
+    This does not use the database. The table definitions, and the DDL of the search index, are included so that
+    adding a table or column to the models makes the stored marker out of date and the tables are created.
+
+    :param app: The Flask app
+    :return: Hex SHA-256 digest
+    """
+    from paralympics import db
+    checksum = hashlib.sha256()
+    for file_name in SEED_FILES:
+        checksum.update(DATA_DIR.joinpath(file_name).read_bytes())
+    for statement in SEARCH_DDL:
+        checksum.update(statement.encode())
+    # The tables of every bind, e.g. the jobs, in the order of the bind keys
+    tables = [table for key in sorted(db.metadatas, key=str) for table in db.metadatas[key].sorted_tables]
+    for table in tables:
+        checksum.update(table.name.encode())
+        for column in table.columns:
+            checksum.update(f"{column.name}:{column.type!r}".encode())
+        for index in sorted(table.indexes, key=lambda i: i.name):
+            checksum.update(index.name.encode())
+    return checksum.hexdigest()
+
+
+def sqlite_database_path(app):
+    """Returns the file path of the app's SQLite database, or None for in-memory and non-SQLite databases.
+
+    :param app: The Flask app
+    """
+    url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        return None
+    return url.database
+
+
+def seed_marker_path(app):
+    """Returns the path of the file that stores the seed checksum for the app's SQLite database.
+
+    The marker is kept next to the database file, e.g. paralympics.sqlite.seed.json. Returns None for in-memory and
+    non-SQLite databases, which are always initialised.
+
+    :param app: The Flask app
+    """
+    database = sqlite_database_path(app)
+    return None if database is None else database + ".seed.json"
+
+
+def seed_is_current(app):
+    """Checks, without connecting to the database, if init_db() has already run with the current data and models.
+
+    :param app: The Flask app
+    :return: True if the database file and its seed marker exist and the marker has the current checksum
+    """
+    marker = seed_marker_path(app)
+    if marker is None or not os.path.exists(marker) or not os.path.exists(sqlite_database_path(app)):
+        return False
+    try:
+        with open(marker) as file:
+            return json.load(file).get("checksum") == seed_checksum(app)
+    except (OSError, ValueError):
+        return False
+
+
+@click.command("init-db")
+@with_appcontext
+def init_db_command():
+    """Create the tables and add the paralympics data."""
+    init_db(current_app._get_current_object())
+    click.echo("Initialised the database.")
 
 
 def configure_logging(app):
-    """ Configures Flask logging to a file.
+    """ Configures Flask logging to a file of JSON lines, through a queue so that requests do not wait for the disk.
 
-    Logging level is set to DEBUG when testing which generates more detail.
+    Logging level is set to DEBUG when testing which generates more detail. The app's records are put on a queue by
+    a LogQueueHandler and written to the LOG_FILE, default paralympics.log or paralympics_tests.log when testing, by a
+    listener thread, see paralympics.logs. The listener also writes them to the console if LOG_CONSOLE is True.
+    LOG_SAMPLING sets the fraction of the records kept for each level, e.g. {"DEBUG": 0.01}. The records are passed on
+    to the root logger's handlers as before.
     """
-    logging.basicConfig(format='[%(asctime)s] %(levelname)s %(name)s: %(message)s')
-    if app.config['TESTING']:
-        logging.getLogger().setLevel(logging.DEBUG)
-        handler = logging.FileHandler('paralympics_tests.log')  # Log to a file
-    else:
-        logging.getLogger().setLevel(logging.INFO)
-        handler = logging.FileHandler('paralympics.log')  # Log to a file
+    logging.basicConfig(format=LOG_FORMAT)
+    logging.getLogger().setLevel(logging.DEBUG if app.config['TESTING'] else logging.INFO)
+    log_file = app.config['LOG_FILE'] or ('paralympics_tests.log' if app.config['TESTING'] else 'paralympics.log')
+    file_handler = logging.FileHandler(log_file)  # Log to a file
+    file_handler.setFormatter(JSONFormatter())
+    handlers = [file_handler]
+    if app.config['LOG_CONSOLE']:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handlers.append(console_handler)
+    handler = start_queue_logging(handlers, app.config['LOG_QUEUE_SIZE'], app.config['LOG_SAMPLING'])
+    # Every app named paralympics shares the logger, so replace the handler added for an earlier app
+    old_handler = get_queue_handler(app.logger)
+    if old_handler is not None:
+        app.logger.removeHandler(old_handler)
+        old_handler.close()
     app.logger.addHandler(handler)
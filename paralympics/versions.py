@@ -0,0 +1,136 @@
+"""
+Versions of the tables and conditional GET.
+
+Every change to a table bumps its row in data_version, in the same transaction as the change. The GET routes use the
+versions of the tables they read as their ETag and Last-Modified validators, see conditional_get(), so a client that
+already has the current response gets 304 Not Modified without the rows being read.
+"""
+import datetime
+import hashlib
+from functools import wraps
+
+from flask import request, make_response, g, current_app as app
+from sqlalchemy.dialects.sqlite import insert
+
+from paralympics import db
+from paralympics.compression import etag_variants
+from paralympics.helpers import get_embeds
+from paralympics.models import DataVersion
+
+
+def bump_version(*tables):
+    """Increments the version and sets the modified time of the given tables.
+
+    Call this in the same transaction as the change, i.e. before db.session.commit(), so that the version can never
+    be committed without the data or the other way round. The tables are also recorded in the session so that their
+    cached responses are removed when the transaction commits.
+
+    Args:
+        tables (str): Names of the tables that have changed, e.g. "event"
+    """
+    now = datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
+    for table in tables:
+        # Insert the row the first time a table changes, otherwise increment the existing version
+        stmt = insert(DataVersion).values(table_name=table, version=1, modified=now)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[DataVersion.table_name],
+            set_={"version": DataVersion.version + 1, "modified": now}
+        )
+        db.session.execute(stmt)
+    db.session.info.setdefault("changed_tables", set()).update(tables)
+
+
+def get_validators(tables):
+    """Returns the ETag and Last-Modified values for data read from the given tables.
+
+    Args:
+        tables (tuple): Names of the tables the response is generated from
+    Returns:
+        tuple (etag, last_modified). last_modified is None if none of the tables have a version yet.
+    """
+    versions = db.session.execute(
+        db.select(DataVersion).where(DataVersion.table_name.in_(tables)).order_by(DataVersion.table_name)
+    ).scalars().all()
+    # The modified time is included so that a new database that reuses the same version numbers gets new ETags
+    key = ";".join(f"{v.table_name}={v.version}@{v.modified.isoformat()}" for v in versions)
+    etag = hashlib.sha1(key.encode()).hexdigest()[:20]
+    last_modified = max((v.modified for v in versions), default=None)
+    if last_modified is not None:
+        # HTTP dates are UTC and in whole seconds
+        last_modified = last_modified.replace(tzinfo=datetime.UTC, microsecond=0)
+    return etag, last_modified
+
+
+def request_tables(tables, embeds):
+    """Returns the tables a request reads: the route's tables plus those of the embedded objects in the request."""
+    if not embeds:
+        return tables
+    embedded = [table for name in get_embeds(embeds) for table in embeds[name]]
+    return tuple(sorted(set(tables).union(embedded)))
+
+
+def conditional_get(*tables, embeds=None, exists=None):
+    """Adds ETag and Last-Modified headers to a GET route and answers conditional requests.
+
+    If the request has If-None-Match with the current ETag, or If-Modified-Since that is not older than the last
+    change, then 304 Not Modified is returned without calling the route, so no rows are queried or serialized.
+    If-None-Match takes precedence over If-Modified-Since as in RFC 9110.
+
+    The ETag is that of the tables, so for a route that returns one item it matches whatever the item. Give exists
+    to check the item is there before returning 304, otherwise the route is called and returns its 404.
+
+    Args:
+        tables (str): Names of the tables the route reads from, e.g. "event"
+        embeds (dict): For routes with ?embed=, maps each name that can be embedded to the tables it reads, these
+            are added to tables when the request embeds them
+        exists: Function called with the route's arguments that returns True if the item exists, see row_exists()
+    """
+
+    def wrapper(f):
+        @wraps(f)
+        def decorator(*args, **kwargs):
+            etag, last_modified = get_validators(request_tables(tables, embeds))
+            g.etag = etag
+            # The ETag to return with 304, which is the one the client has if it sent the ETag of a compressed response
+            not_modified_etag = etag
+            if request.if_none_match:
+                # A compressed response has the encoding added to its ETag, see paralympics.compression
+                matched = [tag for tag in [etag, *etag_variants(etag)] if request.if_none_match.contains(tag)]
+                not_modified = bool(matched)
+                if matched:
+                    not_modified_etag = matched[0]
+            else:
+                since = request.if_modified_since
+                not_modified = since is not None and last_modified is not None and last_modified <= since
+            if not_modified and exists is not None:
+                not_modified = exists(*args, **kwargs)
+            if not_modified:
+                response = app.response_class(status=304)
+                response.set_etag(not_modified_etag)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                response.set_etag(etag)
+            response.last_modified = last_modified
+            # Clients may store the response but must check it is still current before using it
+            response.cache_control.no_cache = True
+            return response
+
+        return decorator
+
+    return wrapper
+
+
+def row_exists(column):
+    """Returns a function for conditional_get(exists=...) that checks a row has the route's one argument in column.
+
+    Args:
+        column: The column the route looks the item up by, e.g. Event.id
+    """
+
+    def exists(**view_args):
+        (value,) = view_args.values()
+        return db.session.execute(db.select(column).where(column == value).limit(1)).first() is not None
+
+    return exists
@@ -0,0 +1,116 @@
+from collections import Counter
+
+from paralympics import db
+from paralympics.versions import bump_version
+from paralympics.models import Event
+
+
+def summary_for(client, event_type, year):
+    """Returns the /analytics/participants entry for the type and year, or None if there is not one."""
+    totals = client.get(f"/analytics/participants?type={event_type}").json
+    return next((t for t in totals if t["year"] == year), None)
+
+
+def hosted_by(client, noc):
+    """Returns the number of events hosted by the NOC according to /analytics/hosts."""
+    hosts = client.get("/analytics/hosts").json
+    return next((h["hosted"] for h in hosts if h["NOC"] == noc), 0)
+
+
+def test_participant_totals_match_events(client):
+    """
+    GIVEN a Flask test client
+    AND the database contains data of the events
+    WHEN a GET request is made to /analytics/participants
+    THEN the totals should be the same as adding up the events from /events for each type and year
+    """
+    events = client.get("/events").json
+    games = Counter((e["type"], e["year"]) for e in events)
+    participants = Counter()
+    for e in events:
+        participants[(e["type"], e["year"])] += e["participants"] or 0
+    response = client.get("/analytics/participants")
+    assert response.status_code == 200
+    assert {(t["type"], t["year"]): t["games"] for t in response.json} == games
+    assert {(t["type"], t["year"]): t["participants"] for t in response.json} == participants
+
+
+def test_host_counts_match_events(client):
+    """
+    GIVEN a Flask test client
+    AND the database contains data of the events
+    WHEN a GET request is made to /analytics/hosts
+    THEN the count for each NOC should be the number of events with that NOC
+    """
+    events = client.get("/events").json
+    expected = Counter(e["NOC"] for e in events if e["NOC"] is not None)
+    response = client.get("/analytics/hosts")
+    assert {h["NOC"]: h["hosted"] for h in response.json} == expected
+
+
+def test_female_ratio_filtered_by_type(client):
+    """
+    GIVEN a Flask test client
+    WHEN a GET request is made to /analytics/female-ratio?type=winter
+    THEN every entry should be for winter and the ratios should be between 0 and 1 or None
+    """
+    response = client.get("/analytics/female-ratio?type=winter")
+    assert response.status_code == 200
+    assert response.json
+    assert all(r["type"] == "winter" for r in response.json)
+    assert all(r["female_ratio"] is None or 0 <= r["female_ratio"] <= 1 for r in response.json)
+
+
+def test_summaries_follow_event_changes(client):
+    """
+    GIVEN a Flask test client
+    WHEN an event is added, its year is changed and then it is deleted
+    THEN the analytics routes should show the change after each request
+    """
+    hosted = hosted_by(client, "AUS")
+    event_json = {"type": "summer", "year": 2036, "country": "Australia", "host": "Perth", "NOC": "AUS",
+                  "region": "AUS", "participants_m": 30, "participants_f": 10, "participants": 40}
+    response = client.post("/events", json=event_json)
+    event_id = response.json["message"].split("=")[-1].strip()
+    assert summary_for(client, "summer", 2036) == {"type": "summer", "year": 2036, "games": 1, "participants": 40,
+                                                   "participants_m": 30, "participants_f": 10}
+    ratios = client.get("/analytics/female-ratio?type=summer").json
+    assert {"type": "summer", "year": 2036, "female_ratio": 0.25} in ratios
+    assert hosted_by(client, "AUS") == hosted + 1
+
+    client.patch(f"/events/{event_id}", json={"year": 2040})
+    assert summary_for(client, "summer", 2036) is None
+    assert summary_for(client, "summer", 2040)["participants"] == 40
+
+    client.delete(f"/events/{event_id}")
+    assert summary_for(client, "summer", 2040) is None
+    assert hosted_by(client, "AUS") == hosted
+
+
+def test_summaries_follow_changes_to_expired_event(app, client):
+    """
+    GIVEN an event that has been expired, so its values are not loaded
+    WHEN its year is changed and then it is expired again and deleted
+    THEN the summary row of the old year should be removed and the new year should have the event
+    AND deleting it should remove the new year's row
+    """
+    event_json = {"type": "winter", "year": 2038, "country": "Norway", "host": "Oslo", "NOC": "NOR",
+                  "region": "NOR", "participants_m": 20, "participants_f": 20, "participants": 40}
+    response = client.post("/events", json=event_json)
+    event_id = int(response.json["message"].split("=")[-1].strip())
+    with app.app_context():
+        event = db.session.get(Event, event_id)
+        db.session.expire(event)
+        event.year = 2042
+        bump_version("event")
+        db.session.commit()
+    assert summary_for(client, "winter", 2038) is None
+    assert summary_for(client, "winter", 2042) == {"type": "winter", "year": 2042, "games": 1, "participants": 40,
+                                                   "participants_m": 20, "participants_f": 20}
+    with app.app_context():
+        event = db.session.get(Event, event_id)
+        db.session.expire(event)
+        db.session.delete(event)
+        bump_version("event")
+        db.session.commit()
+    assert summary_for(client, "winter", 2042) is None
@@ -0,0 +1,47 @@
+# Tests for creating the app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from paralympics import create_app, db
+from paralympics.models import Region
+
+
+# The routes are registered with the first app created in the test session, so these tests use the app fixture to make
+# sure that is the app used by the other tests.
+def test_create_app_no_db_work_when_data_current(app, tmp_path):
+    """
+    GIVEN a database that has been initialised with the current data
+    WHEN a second app is created for the same database
+    THEN no SQL statements should be run
+    """
+    test_config = {"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite:///" + str(tmp_path.joinpath("app.sqlite"))}
+    create_app(test_config=test_config)
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(Engine, "before_cursor_execute", listener)
+    try:
+        create_app(test_config=test_config)
+    finally:
+        event.remove(Engine, "before_cursor_execute", listener)
+    assert statements == []
+
+
+def test_init_db_command(app, tmp_path):
+    """
+    GIVEN an app with AUTO_INIT_DB turned off and a new database
+    WHEN the init-db command is run
+    THEN the output should say the database is initialised
+    AND the app's database should have the regions
+    """
+    test_config = {"TESTING": True, "AUTO_INIT_DB": False,
+                   "SQLALCHEMY_DATABASE_URI": "sqlite:///" + str(tmp_path.joinpath("cli.sqlite"))}
+    app = create_app(test_config=test_config)
+    result = app.test_cli_runner().invoke(args=["init-db"])
+    assert "Initialised the database." in result.output
+    assert result.exit_code == 0
+    # This app has no routes, see above, so the regions are read from its database
+    with app.app_context():
+        assert db.session.scalar(db.select(db.func.count(Region.NOC))) > 0
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
@@ -1,5 +1,13 @@
 # Authentication tests
+import threading
+
+import pytest
 from flask import jsonify
+from werkzeug.security import generate_password_hash
+
+from paralympics import db
+from paralympics.models import User
+from paralympics.passwords import PasswordHasher, HashingBusy
 
 
 def test_register_success(client, random_user_json):
@@ -56,3 +64,158 @@ def test_user_logged_in_user_can_edit_region(app, client, new_user, login, new_r
     response = client.patch(f"/regions/{code}", json=new_region_notes, headers=headers)
     assert response.json == {"message": "Region NEW updated."}
     assert response.status_code == 200
+
+
+def test_repeat_request_uses_token_cache(app, client, login, new_region):
+    """
+    GIVEN a registered user that is successfully logged in
+    AND a PATCH request to /regions/<code> has been made with their token
+    WHEN the PATCH request is repeated with the same token
+    THEN the response status code should be 200
+    AND the token should be found in the token cache
+    """
+    headers = {'Authorization': login['token']}
+    code = new_region['NOC']
+    client.patch(f"/regions/{code}", json={'notes': 'First note'}, headers=headers)
+    hits_before = app.extensions["token_cache"].stats()["hits"]
+    response = client.patch(f"/regions/{code}", json={'notes': 'Second note'}, headers=headers)
+    assert response.status_code == 200
+    assert app.extensions["token_cache"].stats()["hits"] == hits_before + 1
+
+
+def test_deleted_user_token_rejected(app, client, login, new_region):
+    """
+    GIVEN a registered user that is successfully logged in and whose token has been used
+    WHEN the user is deleted
+    AND a PATCH request to /regions/<code> is made with their token
+    THEN the HTTP status code should be 401
+    """
+    headers = {'Authorization': login['token']}
+    code = new_region['NOC']
+    client.patch(f"/regions/{code}", json={'notes': 'A note'}, headers=headers)
+    with app.app_context():
+        user = db.session.get(User, login['user_id'])
+        db.session.delete(user)
+        db.session.commit()
+    response = client.patch(f"/regions/{code}", json={'notes': 'Another note'}, headers=headers)
+    assert response.status_code == 401
+
+
+def test_token_cache_expires_user_deleted_elsewhere(app, client, login, new_region, monkeypatch):
+    """
+    GIVEN a registered user that is successfully logged in and whose token has been used
+    AND a TOKEN_CACHE_TTL shorter than the time until the token expires
+    WHEN the user is deleted without the ORM, as another worker process would
+    AND a PATCH request to /regions/<code> is made with their token after TOKEN_CACHE_TTL
+    THEN the HTTP status code should be 401
+    """
+    monkeypatch.setitem(app.config, "TOKEN_CACHE_TTL", 0)
+    headers = {'Authorization': login['token']}
+    code = new_region['NOC']
+    assert client.patch(f"/regions/{code}", json={'notes': 'A note'}, headers=headers).status_code == 200
+    with app.app_context():
+        db.session.execute(db.delete(User.__table__).where(User.id == login['user_id']))
+        db.session.commit()
+    response = client.patch(f"/regions/{code}", json={'notes': 'Another note'}, headers=headers)
+    assert response.status_code == 401
+
+
+def test_login_rehashes_password_with_old_method(app, client, random_user_json):
+    """
+    GIVEN a user whose password hash was made with a different method to the app's PASSWORD_HASH_METHOD
+    WHEN the user logs in
+    THEN the status code should be 201
+    AND the stored password hash should now use the app's method
+    """
+    with app.app_context():
+        user = User(email=random_user_json['email'],
+                    password_hash=generate_password_hash(random_user_json['password'], "pbkdf2:sha256:1000"))
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+    response = client.post('/login', json=random_user_json)
+    assert response.status_code == 201
+    with app.app_context():
+        password_hash = db.session.get(User, user_id).password_hash
+    assert password_hash.startswith(app.config["PASSWORD_HASH_METHOD"] + "$")
+
+
+def test_write_succeeds_while_login_hashes(app, client, new_user, login, new_region, monkeypatch):
+    """
+    GIVEN a user logging in whose password check has not finished
+    WHEN another logged in user makes a PATCH request to /regions/<code>
+    THEN the PATCH should not wait for the login and return 200
+    AND the login should then succeed with 201
+    """
+    hasher = app.extensions["password_hasher"]
+    verify = hasher.verify
+    hashing = threading.Event()
+    release = threading.Event()
+
+    def slow_verify(pwhash, password):
+        hashing.set()
+        release.wait(timeout=10)
+        return verify(pwhash, password)
+
+    monkeypatch.setattr(hasher, "verify", slow_verify)
+    responses = {}
+
+    def log_in():
+        responses["login"] = app.test_client().post('/login', json=new_user)
+
+    login_thread = threading.Thread(target=log_in)
+    login_thread.start()
+    try:
+        assert hashing.wait(timeout=10)
+        response = client.patch(f"/regions/{new_region['NOC']}", json={'notes': 'Edited while hashing'},
+                                headers={'Authorization': login['token']})
+        assert response.status_code == 200
+    finally:
+        release.set()
+        login_thread.join()
+    assert responses["login"].status_code == 201
+
+
+def test_password_hasher_rejects_when_queue_full():
+    """
+    GIVEN a PasswordHasher with 1 worker and no queue
+    AND the worker is busy
+    WHEN a password is hashed
+    THEN HashingBusy should be raised straight away
+    """
+    hasher = PasswordHasher(workers=1, max_queue=0)
+    started = threading.Event()
+    release = threading.Event()
+
+    def busy():
+        started.set()
+        release.wait()
+
+    worker = threading.Thread(target=hasher.submit, args=(busy,))
+    worker.start()
+    started.wait()
+    try:
+        with pytest.raises(HashingBusy):
+            hasher.hash("password")
+    finally:
+        release.set()
+        worker.join()
+    assert hasher.rejected == 1
+
+
+def test_needs_rehash_does_not_use_the_pool():
+    """
+    GIVEN PasswordHashers for scrypt and pbkdf2 methods without their cost parameters
+    AND their pools reject every hash
+    WHEN needs_rehash is called for hashes made with and without the default parameters
+    THEN it should compare the hashes with Werkzeug's full method without hashing or raising HashingBusy
+    """
+    for method, other in (("scrypt", "pbkdf2:sha256:1000"), ("pbkdf2", "scrypt:16384:8:1")):
+        hasher = PasswordHasher(method=method, workers=1, max_queue=0)
+
+        def reject(*args):
+            raise HashingBusy("Too many password hashing requests")
+
+        hasher.submit = reject
+        assert not hasher.needs_rehash(generate_password_hash("password", method))
+        assert hasher.needs_rehash(generate_password_hash("password", other))
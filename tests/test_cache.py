@@ -0,0 +1,75 @@
+# Tests for the response cache
+from paralympics.cache import LRUCache
+
+
+def test_lru_cache_evicts_least_recently_used():
+    """
+    GIVEN an LRUCache with space for 2 entries that contains 'a' and 'b'
+    WHEN 'a' is read and then 'c' is added
+    THEN 'b' should be evicted and counted as an eviction
+    """
+    cache = LRUCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lru_cache_entry_expires():
+    """
+    GIVEN an LRUCache with a ttl of 10 seconds
+    WHEN an entry is read 11 seconds after it was set
+    THEN it should not be returned and should be counted as a miss
+    """
+    now = [0]
+    cache = LRUCache(ttl=10, clock=lambda: now[0])
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    now[0] = 11
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_lru_cache_invalidate_by_tag():
+    """
+    GIVEN an LRUCache with entries tagged 'region' and 'event'
+    WHEN the 'event' tag is invalidated
+    THEN only the entry tagged 'event' should be removed
+    """
+    cache = LRUCache()
+    cache.set("/regions", 1, tags=("region",))
+    cache.set("/events", 2, tags=("event",))
+    cache.invalidate("event")
+    assert cache.get("/events") is None
+    assert cache.get("/regions") == 1
+
+
+def test_get_events_served_from_cache(client):
+    """
+    GIVEN a Flask test client
+    WHEN the same GET request is made to /events twice, with the query parameters in a different order
+    THEN the second response should come from the cache with the same body
+    """
+    first = client.get("/events?type=summer&limit=3")
+    second = client.get("/events?limit=3&type=summer")
+    assert second.headers["X-Cache"] == "HIT"
+    assert second.data == first.data
+
+
+def test_cached_regions_invalidated_on_commit(client):
+    """
+    GIVEN a Flask test client
+    AND the response for /regions is in the cache
+    WHEN a new region is added with a POST request to /regions
+    THEN the next GET request to /regions should not come from the cache and should include the new region
+    """
+    client.get("/regions")
+    client.post("/regions", json={"NOC": "ZCZ", "region": "ZedCeeZed"})
+    response = client.get("/regions")
+    assert response.headers["X-Cache"] == "MISS"
+    assert {"NOC": "ZCZ", "region": "ZedCeeZed", "notes": None} in response.json
+    client.delete("/regions/ZCZ")
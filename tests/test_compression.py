@@ -0,0 +1,90 @@
+import gzip
+import zlib
+
+from paralympics import compression
+
+
+def test_get_events_gzip(client):
+    """
+    GIVEN a Flask test client
+    WHEN a GET request is made to /events with Accept-Encoding: gzip
+    THEN the response should be gzip compressed and decompress to the uncompressed response
+    AND it should have Vary: Accept-Encoding and an ETag for the gzip encoding
+    """
+    plain = client.get("/events")
+    response = client.get("/events", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert gzip.decompress(response.data) == plain.data
+    assert response.headers["ETag"] == plain.headers["ETag"][:-1] + '-gzip"'
+    assert int(response.headers["Content-Length"]) == len(response.data) < len(plain.data)
+
+
+def test_get_events_deflate_by_quality(client):
+    """
+    GIVEN a Flask test client
+    WHEN a GET request is made to /events that does not accept gzip but accepts deflate
+    THEN the response should be compressed with deflate
+    """
+    plain = client.get("/events")
+    response = client.get("/events", headers={"Accept-Encoding": "gzip;q=0, deflate"})
+    assert response.headers["Content-Encoding"] == "deflate"
+    assert zlib.decompress(response.data) == plain.data
+
+
+def test_small_response_not_compressed(client):
+    """
+    GIVEN a Flask test client
+    WHEN a region, which is smaller than COMPRESSION_MIN_SIZE, is requested with Accept-Encoding: gzip
+    THEN the response should not be compressed but should still have Vary: Accept-Encoding
+    """
+    response = client.get("/regions/GBR", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+    assert "Accept-Encoding" in response.headers["Vary"]
+
+
+def test_cached_response_compressed_once(client, monkeypatch):
+    """
+    GIVEN a Flask test client
+    WHEN the same list of events is requested three times with Accept-Encoding: gzip
+    THEN the body should only be compressed for the first request, the others use the cached compressed body
+    """
+    calls = []
+    original = compression.compress
+
+    def counting_compress(data, encoding, level):
+        calls.append(encoding)
+        return original(data, encoding, level)
+
+    monkeypatch.setattr(compression, "compress", counting_compress)
+    bodies = [client.get("/events?type=summer&compression_test=1", headers={"Accept-Encoding": "gzip"}).data
+              for _ in range(3)]
+    assert calls == ["gzip"]
+    assert bodies[0] == bodies[1] == bodies[2]
+
+
+def test_gzip_etag_not_modified(client):
+    """
+    GIVEN the ETag of a gzip compressed /events response
+    WHEN the request is repeated with the ETag in If-None-Match
+    THEN the response should be 304 with the same ETag
+    """
+    headers = {"Accept-Encoding": "gzip"}
+    etag = client.get("/events", headers=headers).headers["ETag"]
+    response = client.get("/events", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+
+def test_export_streamed_gzip(client):
+    """
+    GIVEN a Flask test client
+    WHEN /events/export is requested with Accept-Encoding: gzip
+    THEN the streamed response should be gzip compressed, without a Content-Length
+    AND decompress to the uncompressed export
+    """
+    plain = client.get("/events/export?format=csv")
+    response = client.get("/events/export?format=csv", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in response.headers
+    assert gzip.decompress(response.data) == plain.data
@@ -1,7 +1,13 @@
 # A test that includes using a context to check the database
-from sqlalchemy import func
+import threading
+
+import pytest
+from sqlalchemy import create_engine, func, inspect, text
 from paralympics import db
 from paralympics.models import Region, User
+from paralympics import utils
+from paralympics.engine import is_sqlite_file
+from paralympics.utils import bulk_load_csv, region_values, load_medal_frame, migrate_event_columns, DATA_DIR
 
 
 def test_post_region_database_update(client, app):
@@ -52,3 +58,125 @@ def test_database_after_insert(test_client, random_user_json):
     db.session.commit()
     num_rows_end = db.session.scalar(db.select(func.count(User.id)))
     assert num_rows_end - num_rows_start == 1
+
+
+def test_bulk_load_csv(test_client, tmp_path):
+    """
+    GIVEN a CSV file with a header and 5 new regions
+    WHEN the file is loaded with bulk_load_csv in chunks of 2 rows
+    THEN the database Region table should have 5 more entries
+    AND the progress callback should be called after each chunk with the running total
+    """
+    csv_file = tmp_path.joinpath("regions.csv")
+    lines = ["NOC,region,notes"] + [f"ZB{i},Bulk region {i}," for i in range(5)]
+    csv_file.write_text("\n".join(lines))
+    progress = []
+
+    num_rows_start = db.session.scalar(db.select(func.count(Region.NOC)))
+    inserted = bulk_load_csv(db, Region, csv_file, region_values, chunk_size=2, progress=progress.append)
+    db.session.commit()
+    num_rows_end = db.session.scalar(db.select(func.count(Region.NOC)))
+
+    assert inserted == 5
+    assert num_rows_end - num_rows_start == 5
+    assert progress == [2, 4, 5]
+    db.session.execute(db.delete(Region).where(Region.NOC.like("ZB_")))
+    db.session.commit()
+
+
+def test_load_medal_frame_uses_parquet_cache(tmp_path, monkeypatch):
+    """
+    GIVEN the medals workbook and a path for the Parquet cache that does not exist
+    WHEN load_medal_frame() is called twice
+    THEN the first call should create the cache
+    AND the second call should return the same data without reading the workbook
+    """
+    parquet_file = tmp_path.joinpath("medals.parquet")
+    first = load_medal_frame(DATA_DIR.joinpath("medals.xlsx"), parquet_file)
+    assert parquet_file.exists()
+
+    def fail(xlsx_file):
+        raise AssertionError("The workbook was read")
+
+    monkeypatch.setattr(utils, "read_medals_xlsx", fail)
+    second = load_medal_frame(DATA_DIR.joinpath("medals.xlsx"), parquet_file)
+    assert second.to_dict("records") == first.to_dict("records")
+
+
+def test_sqlite_pragmas_set(app):
+    """
+    GIVEN the test app with an SQLite file database
+    WHEN a connection is used
+    THEN the journal mode should be WAL and the busy timeout should be set from SQLITE_PRAGMAS
+    """
+    if not is_sqlite_file(app):
+        pytest.skip("WAL is only used for SQLite files")
+    with app.app_context():
+        assert db.session.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert db.session.execute(text("PRAGMA busy_timeout")).scalar() == app.config["SQLITE_PRAGMAS"]["busy_timeout"]
+
+
+def test_concurrent_reads_and_writes(app):
+    """
+    GIVEN the test app
+    WHEN several threads add, update and delete events while others read them
+    THEN no request should fail with a server error such as 'database is locked'
+    """
+    event_json = {"type": "summer", "year": 2050, "country": "Australia", "host": "Hobart", "NOC": "AUS",
+                  "region": "AUS"}
+    statuses = []
+
+    def writer():
+        client = app.test_client()
+        for _ in range(10):
+            response = client.post("/events", json=event_json)
+            statuses.append(response.status_code)
+            event_id = int(response.json["message"].split("=")[-1])
+            statuses.append(client.patch(f"/events/{event_id}", json={"participants": 10}).status_code)
+            statuses.append(client.delete(f"/events/{event_id}").status_code)
+
+    def reader():
+        client = app.test_client()
+        for _ in range(30):
+            statuses.append(client.get("/events?year=2050").status_code)
+            statuses.append(client.get("/events?limit=5").status_code)
+
+    threads = [threading.Thread(target=writer) for _ in range(3)] + [threading.Thread(target=reader) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(statuses) == 3 * 30 + 3 * 60
+    assert all(status == 200 for status in statuses)
+
+
+def test_migrate_event_text_columns(tmp_path):
+    """
+    GIVEN an SQLite database with an event table from before start, end and countries had their current types
+    WHEN migrate_event_columns() is run
+    THEN start and end should be Date columns with the dates converted from dd/mm/yyyy, countries should be Integer
+    AND the ids and the other values should not change
+    """
+    engine = create_engine("sqlite:///" + str(tmp_path.joinpath("old.sqlite")))
+    with engine.begin() as connection:
+        connection.execute(text(
+            'CREATE TABLE event (id INTEGER PRIMARY KEY, type TEXT NOT NULL, year INTEGER NOT NULL, '
+            'country TEXT NOT NULL, host TEXT NOT NULL, "NOC" TEXT, start TEXT, "end" TEXT, duration INTEGER, '
+            'disabilities_included TEXT, countries TEXT, events INTEGER, sports INTEGER, participants_m INTEGER, '
+            'participants_f INTEGER, participants INTEGER, highlights VARCHAR)'
+        ))
+        connection.execute(text('CREATE INDEX ix_event_year ON event (year)'))
+        connection.execute(text(
+            "INSERT INTO event (id, type, year, country, host, \"NOC\", start, \"end\", countries) VALUES "
+            "(7, 'summer', 1960, 'Italy', 'Rome', 'ITA', '18/09/1960', '25/09/1960', '23'), "
+            "(9, 'winter', 2026, 'Italy', 'Milan', 'ITA', '', NULL, '')"
+        ))
+        assert migrate_event_columns(connection)
+        assert not migrate_event_columns(connection)
+        columns = {column["name"]: column["type"] for column in inspect(connection).get_columns("event")}
+        rows = connection.execute(text('SELECT id, host, start, "end", countries FROM event ORDER BY id')).all()
+        indexes = {index["name"] for index in inspect(connection).get_indexes("event")}
+    engine.dispose()
+    assert str(columns["start"]) == "DATE" and str(columns["countries"]) == "INTEGER"
+    assert rows == [(7, "Rome", "1960-09-18", "1960-09-25", 23), (9, "Milan", None, None, None)]
+    assert {"ix_event_start", "ix_event_end", "ix_event_year"} <= indexes
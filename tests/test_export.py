@@ -0,0 +1,109 @@
+# Tests for streaming the events with /events/export
+import csv
+import io
+import json
+import os
+import tracemalloc
+
+from paralympics import create_app, db
+from paralympics.export import export_chunks
+from paralympics.schemas import EventSchema, RowSerializer
+
+# The number of rows for the memory test, set PARALYMPICS_EXPORT_TEST_ROWS=3000000 to test a multi-million-row table
+EXPORT_TEST_ROWS = int(os.environ.get("PARALYMPICS_EXPORT_TEST_ROWS", 30000))
+
+
+def test_export_ndjson_matches_events(client):
+    """
+    GIVEN a Flask test client
+    WHEN a GET request is made to /events/export?format=ndjson
+    THEN each line should be a JSON event, the same as the events from /events
+    """
+    response = client.get("/events/export?format=ndjson")
+    assert response.mimetype == "application/x-ndjson"
+    events = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert events == client.get("/events").json
+
+
+def test_export_csv(client):
+    """
+    GIVEN a Flask test client
+    WHEN a GET request is made to /events/export?format=csv&type=winter
+    THEN the response should be CSV with a header row and a row for each winter event
+    """
+    response = client.get("/events/export?format=csv&type=winter")
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert response.mimetype == "text/csv"
+    assert len(rows) == len(client.get("/events?type=winter").json)
+    assert all(row["type"] == "winter" for row in rows)
+
+
+def test_export_csv_fields(client):
+    """
+    GIVEN a Flask test client
+    WHEN a GET request is made to /events/export?format=csv&fields=region,year
+    THEN the CSV should only have the columns region and year, in the order of the schema fields
+    """
+    response = client.get("/events/export?format=csv&fields=year,region")
+    header = response.get_data(as_text=True).splitlines()[0]
+    assert header == "region,year"
+
+
+def test_export_format_not_valid(client):
+    """
+    GIVEN a Flask test client
+    WHEN a GET request is made to /events/export with a format that is not supported
+    THEN the response status code should be 400
+    """
+    response = client.get("/events/export?format=xml")
+    assert response.status_code == 400
+
+
+def add_synthetic_events(count):
+    """Adds count copies of a synthetic event using a recursive CTE, which is much faster than inserting from Python"""
+    db.session.execute(db.text(
+        "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :count) "
+        "INSERT INTO event (type, year, country, host, \"NOC\", start, \"end\", duration, countries, participants, "
+        "highlights) "
+        "SELECT 'summer', 1960 + i % 64, 'Country ' || (i % 200), 'Host ' || i, 'GBR', '2000-08-01', '2000-08-10', "
+        "9, 100, i % 5000, 'A synthetic event with a highlight that is a sentence long.' FROM n"
+    ), {"count": count})
+    db.session.commit()
+
+
+def peak_export_memory(export_format):
+    """Returns the peak memory allocated while exporting every event, and the number of rows exported."""
+    serializer = RowSerializer(EventSchema())
+    tracemalloc.start()
+    rows = 0
+    for chunk in export_chunks(serializer, serializer.select(), export_format):
+        rows += chunk.count("\n")
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak, rows
+
+
+def test_export_memory_does_not_grow_with_rows(app, tmp_path):
+    """
+    GIVEN a database of synthetic events
+    WHEN the events are exported as NDJSON and CSV when it has 1/10th of the rows and when it has all of them
+    THEN every row should be exported
+    AND the peak memory used by the export should not grow with the number of rows
+    """
+    # The app fixture is used so that the shared test app, which has the routes, is created before this one
+    test_config = {"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite:///" + str(tmp_path.joinpath("export.sqlite"))}
+    export_app = create_app(test_config=test_config)
+    with export_app.app_context():
+        db.session.execute(db.text("DELETE FROM event"))
+        add_synthetic_events(EXPORT_TEST_ROWS // 10)
+        small = {export_format: peak_export_memory(export_format) for export_format in ("ndjson", "csv")}
+        add_synthetic_events(EXPORT_TEST_ROWS - EXPORT_TEST_ROWS // 10)
+        large = {export_format: peak_export_memory(export_format) for export_format in ("ndjson", "csv")}
+        db.session.remove()
+        db.engine.dispose()
+
+    assert large["ndjson"][1] == EXPORT_TEST_ROWS
+    assert large["csv"][1] == EXPORT_TEST_ROWS + 1
+    for export_format in ("ndjson", "csv"):
+        # 10 times the rows should need about the same memory, allow 50% for noise
+        assert large[export_format][0] < small[export_format][0] * 1.5
@@ -0,0 +1,143 @@
+import datetime
+import io
+import threading
+import time
+
+from paralympics import db, jobs
+from paralympics.versions import bump_version
+from paralympics.jobs import cancel_job, execute_job
+from paralympics.models import Job, Region
+
+
+def wait_for_job(client, url, headers, timeout=120):
+    """Polls the URL of a job until it has finished and returns its JSON."""
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(url, headers=headers).json
+        if job["status"] not in ("queued", "running") or time.monotonic() > deadline:
+            return job
+        time.sleep(0.1)
+
+
+def add_import_job(app, rows, **values):
+    """Adds an import-regions job for a CSV file of the given region rows and returns its id."""
+    path = f"{app.instance_path}/test-{time.time_ns()}.csv"
+    with open(path, "w") as file:
+        file.write("NOC,region,notes\n" + "".join(f"{noc},Region {noc},\n" for noc in rows))
+    with app.app_context():
+        job = Job(type="import-regions", params={}, input_file=path, created=datetime.datetime.now(), **values)
+        db.session.add(job)
+        db.session.commit()
+        return job.id
+
+
+def test_export_job_runs_in_worker_process(client, login):
+    """
+    GIVEN a logged in user
+    WHEN an export job is posted and its status is polled until it finishes
+    THEN the job should be accepted with 202 and its URL, and succeed with the progress equal to the total
+    AND the result should be the same file as /events/export
+    AND the status and result should return 401 without the token
+    AND jobs with an unknown type, or an import without a file, should return 400
+    """
+    headers = {"Authorization": login["token"]}
+    response = client.post("/jobs", data={"type": "export-events", "format": "csv"}, headers=headers)
+    assert response.status_code == 202
+    job = wait_for_job(client, response.headers["Location"], headers)
+    assert job["status"] == "succeeded", job
+    assert job["progress"] == job["total"] > 0
+    result = client.get(job["result"], headers=headers)
+    assert result.data == client.get("/events/export?format=csv").data
+    assert client.get(response.headers["Location"]).status_code == 401
+    assert client.get(job["result"]).status_code == 401
+    assert client.delete(response.headers["Location"], headers=headers).status_code == 409
+
+    assert client.post("/jobs", json={"type": "reindex"}, headers=headers).status_code == 400
+    upload = {"type": "import-regions", "file": (io.BytesIO(b"NOC,region,notes\n"), "regions.txt")}
+    assert client.post("/jobs", data=upload, headers=headers).status_code == 400
+    assert client.post("/jobs", json={"type": "export-events"}).status_code == 401
+
+
+def test_import_job_cancel_and_success(app):
+    """
+    GIVEN import-regions jobs run in this process
+    WHEN one is cancelled while queued, one is cancelled while running and one is not cancelled
+    THEN the job cancelled while queued should not run
+    AND the job cancelled while running should stop at its first progress check with no regions added
+    AND the other job should add its regions and record its progress
+    AND no staging table should be left
+    """
+    queued = add_import_job(app, ["JQA"])
+    with app.app_context():
+        cancel_job(db.session.get(Job, queued))
+    execute_job(app, queued)
+    running = add_import_job(app, ["JRA", "JRB"], cancel_requested=True)
+    execute_job(app, running)
+    succeeded = add_import_job(app, ["JSA", "JSB"])
+    execute_job(app, succeeded)
+
+    with app.app_context():
+        jobs = {job.id: job for job in db.session.execute(db.select(Job)).scalars()}
+        assert (jobs[queued].status, jobs[queued].started) == ("cancelled", None)
+        assert (jobs[running].status, jobs[running].progress) == ("cancelled", 2)
+        assert (jobs[succeeded].status, jobs[succeeded].progress, jobs[succeeded].total) == ("succeeded", 2, 2)
+        codes = db.session.execute(
+            db.select(Region.NOC).where(Region.NOC.in_(["JQA", "JRA", "JRB", "JSA", "JSB"]))
+        ).scalars().all()
+        assert sorted(codes) == ["JSA", "JSB"]
+        db.session.execute(db.delete(Region).where(Region.NOC.in_(codes)))
+        bump_version("region", "event")
+        db.session.commit()
+    assert staging_tables(app) == []
+
+
+def staging_tables(app):
+    """Returns the names of the staging tables of the imports in the app's database."""
+    with app.app_context():
+        return db.session.execute(
+            db.text("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'staging_%'")
+        ).scalars().all()
+
+
+def test_write_succeeds_while_import_job_runs(app, client, login, new_region, monkeypatch):
+    """
+    GIVEN an import-regions job that has loaded a chunk of its rows and is waiting
+    WHEN a logged in user makes a PATCH request to /regions/<code>
+    THEN the PATCH should not wait for the import and return 200
+    AND the import should then succeed and add its regions, and leave no staging table
+    """
+    loaded = threading.Event()
+    release = threading.Event()
+    job_progress = jobs._progress
+
+    def waiting_progress(job_id):
+        progress = job_progress(job_id)
+
+        def wait_then_progress(rows):
+            loaded.set()
+            release.wait(timeout=10)
+            progress(rows)
+
+        return wait_then_progress
+
+    monkeypatch.setattr(jobs, "_progress", waiting_progress)
+    job_id = add_import_job(app, ["JWA", "JWB"])
+    worker = threading.Thread(target=execute_job, args=(app, job_id))
+    worker.start()
+    try:
+        assert loaded.wait(timeout=10)
+        response = client.patch(f"/regions/{new_region['NOC']}", json={'notes': 'Edited during an import'},
+                                headers={'Authorization': login['token']})
+        assert response.status_code == 200
+    finally:
+        release.set()
+        worker.join()
+
+    assert staging_tables(app) == []
+    with app.app_context():
+        assert db.session.get(Job, job_id).status == "succeeded"
+        codes = db.session.execute(db.select(Region.NOC).where(Region.NOC.in_(["JWA", "JWB"]))).scalars().all()
+        assert sorted(codes) == ["JWA", "JWB"]
+        db.session.execute(db.delete(Region).where(Region.NOC.in_(codes)))
+        bump_version("region", "event")
+        db.session.commit()
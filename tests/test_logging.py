@@ -0,0 +1,149 @@
+import json
+import logging
+import queue
+import threading
+
+from paralympics.logs import JSONFormatter, LogQueueHandler, get_queue_handler, start_queue_logging
+
+
+class ListHandler(logging.Handler):
+    """Handler that keeps the formatted records in a list."""
+
+    def __init__(self):
+        super().__init__()
+        self.setFormatter(JSONFormatter())
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+def make_logger(handler):
+    logger = logging.getLogger(f"paralympics.test.{id(handler)}")
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    logger.addHandler(handler)
+    return logger
+
+
+def test_queue_logging_writes_json_lines_on_close():
+    """
+    GIVEN a queue handler with a listener that writes to a list
+    WHEN a message with arguments and an exception are logged and the handler is closed
+    THEN each record should be written as a line of JSON with the formatted message
+    AND the traceback should be in its own field rather than in the message
+    """
+    target = ListHandler()
+    handler = start_queue_logging([target])
+    logger = make_logger(handler)
+    logger.info("Event %d updated", 7)
+    try:
+        raise ValueError("bad value")
+    except ValueError:
+        logger.exception("Update failed")
+    handler.close()
+    entries = [json.loads(line) for line in target.lines]
+    assert [(e["level"], e["message"]) for e in entries] == [("INFO", "Event 7 updated"), ("ERROR", "Update failed")]
+    assert "ValueError: bad value" in entries[1]["exception"]
+    assert "exception" not in entries[0]
+
+
+def test_queue_logging_samples_by_level():
+    """
+    GIVEN a queue handler that keeps none of the DEBUG records
+    WHEN DEBUG and WARNING records are logged
+    THEN only the WARNING records should be written
+    AND the DEBUG records should be counted as sampled out
+    """
+    target = ListHandler()
+    handler = start_queue_logging([target], sampling={"DEBUG": 0})
+    logger = make_logger(handler)
+    for i in range(5):
+        logger.debug("Debug %d", i)
+        logger.warning("Warning %d", i)
+    handler.close()
+    assert [json.loads(line)["level"] for line in target.lines] == ["WARNING"] * 5
+    assert handler.sampled_out == 5
+
+
+def test_queue_logging_drops_records_when_full():
+    """
+    GIVEN a queue handler with a queue of 2 records and no listener reading it
+    WHEN 5 records are logged
+    THEN logging should not block
+    AND the 3 records that do not fit should be counted as dropped
+    """
+    handler = LogQueueHandler(queue.SimpleQueue(), max_size=2)
+    logger = make_logger(handler)
+    for i in range(5):
+        logger.info("Record %d", i)
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3
+
+
+def test_flush_from_several_threads():
+    """
+    GIVEN a queue handler with a listener that writes to a list
+    WHEN several threads each log records and flush at the same time
+    THEN no flush should fail
+    AND each thread's records should have been written when its flush returns
+    AND the listener should keep running after the flushes
+    """
+    target = ListHandler()
+    handler = start_queue_logging([target])
+    logger = make_logger(handler)
+    errors = []
+
+    def log_and_flush(thread):
+        try:
+            for i in range(20):
+                logger.info("Thread %d record %d", thread, i)
+            handler.flush()
+            messages = {json.loads(line)["message"] for line in list(target.lines)}
+            assert all(f"Thread {thread} record {i}" in messages for i in range(20))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=log_and_flush, args=(thread,)) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    logger.info("After the flushes")
+    handler.flush()
+    assert errors == []
+    assert json.loads(target.lines[-1])["message"] == "After the flushes"
+    handler.close()
+
+
+def test_request_log_records_include_request(app, client):
+    """
+    GIVEN the Flask test app
+    WHEN a request for a region that does not exist is logged
+    THEN the log file should have a JSON line with the message, method and path of the request
+    """
+    client.get("/regions/ZQ9")
+    handler = get_queue_handler(app.logger)
+    handler.flush()
+    with open(handler.listener.handlers[0].baseFilename) as f:
+        # Skip any lines written before the log file was JSON
+        entries = [json.loads(line) for line in f if line.startswith("{")]
+    entry = [e for e in entries if e.get("path") == "/regions/ZQ9"][-1]
+    assert entry["method"] == "GET"
+    assert entry["message"].startswith("Region code ZQ9 was not found")
+
+
+def test_app_records_reach_root_logger(client):
+    """
+    GIVEN the Flask test app
+    AND a handler on the root logger
+    WHEN a request for a region that does not exist is logged
+    THEN the record should also be passed to the root logger's handler
+    """
+    target = ListHandler()
+    logging.getLogger().addHandler(target)
+    try:
+        client.get("/regions/ZQ8")
+    finally:
+        logging.getLogger().removeHandler(target)
+    assert any(json.loads(line)["message"].startswith("Region code ZQ8 was not found") for line in target.lines)
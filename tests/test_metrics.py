@@ -0,0 +1,53 @@
+from paralympics.metrics import Histogram
+
+
+def test_histogram_buckets():
+    """
+    GIVEN a histogram with buckets of 1, 2 and 5
+    WHEN the values 0.5, 2, 3 and 10 are observed
+    THEN the cumulative bucket counts should be 1, 2, 3 and 4 for +Inf
+    AND the sum and count should include every value
+    """
+    histogram = Histogram((1, 2, 5))
+    for value in (0.5, 2, 3, 10):
+        histogram.observe(value)
+    assert list(histogram.samples()) == [("1", 1), ("2", 2), ("5", 3), ("+Inf", 4)]
+    assert histogram.sum == 15.5
+    assert histogram.count == 4
+
+
+def metric_value(text, line_start):
+    """Returns the value of the first metric line in text that starts with line_start, or 0 if there is not one."""
+    for line in text.splitlines():
+        if line.startswith(line_start):
+            return float(line.rsplit(" ", 1)[1])
+    return 0
+
+
+def test_metrics_count_requests_by_route(client):
+    """
+    GIVEN a Flask test client
+    WHEN two different events are requested
+    THEN /metrics should count both under the route /events/<event_id> with status 200
+    AND the response should use the Prometheus text content type
+    """
+    series = 'paralympics_responses_total{method="GET",route="/events/<event_id>",status="200"}'
+    before = metric_value(client.get("/metrics").get_data(as_text=True), series)
+    client.get("/events/1")
+    client.get("/events/2")
+    response = client.get("/metrics")
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    assert metric_value(response.get_data(as_text=True), series) == before + 2
+
+
+def test_metrics_record_sql_queries(client):
+    """
+    GIVEN a Flask test client
+    WHEN a region is requested with a query string that has not been cached
+    THEN /metrics should record at least one SQL statement for the route
+    """
+    client.get("/regions/GBR?metrics_test=1")
+    text = client.get("/metrics").get_data(as_text=True)
+    assert metric_value(text, 'paralympics_request_sql_queries_sum{method="GET",route="/regions/<code>"}') >= 1
+    assert metric_value(text, 'paralympics_request_sql_seconds_count{method="GET",route="/regions/<code>"}') >= 1
+    assert 'paralympics_cache_hits_total{cache="response"}' in text
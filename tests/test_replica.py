@@ -0,0 +1,78 @@
+import pytest
+from sqlalchemy import exc
+
+from paralympics import create_app, db
+from paralympics.models import Region
+from paralympics.replica import WRITE_COOKIE, sync_replica
+
+
+@pytest.fixture()
+def replica_app(app, tmp_path):
+    """App with a read replica. The app fixture is used so that the shared test app, which has the routes, is created
+    first, so the requests are made with test_request_context() rather than a client."""
+    test_config = {"TESTING": True,
+                   "SQLALCHEMY_DATABASE_URI": "sqlite:///" + str(tmp_path.joinpath("primary.sqlite")),
+                   "SQLALCHEMY_BINDS": {"replica": "sqlite:///" + str(tmp_path.joinpath("replica.sqlite"))},
+                   "READ_REPLICA_BIND": "replica"}
+    replica_app = create_app(test_config=test_config)
+    yield replica_app
+    with replica_app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def count_regions(app, method="GET", headers=None):
+    """Returns the number of regions read by a request, after the app's before_request hooks have run."""
+    with app.test_request_context("/regions", method=method, headers=headers):
+        app.preprocess_request()
+        count = db.session.scalar(db.select(db.func.count(Region.NOC)))
+        db.session.remove()
+    return count
+
+
+def add_region(app, code):
+    """Adds a region in a POST request and returns the cookie set by the response."""
+    with app.test_request_context("/regions", method="POST"):
+        app.preprocess_request()
+        db.session.add(Region(NOC=code, region=f"Region {code}"))
+        db.session.commit()
+        response = app.process_response(app.response_class())
+        db.session.remove()
+    return response.headers["Set-Cookie"].split(";")[0]
+
+
+def test_get_reads_replica_after_sync(replica_app):
+    """
+    GIVEN an app with a read replica that has not been synced
+    WHEN regions are read in GET requests before and after a sync and after a region is added to the primary
+    THEN the reads should use the primary until the replica has been synced
+    AND then a client that has not made a change should read the replica, which does not have the new region
+    AND the client that added the region should read it from the primary until the next sync
+    """
+    primary_count = count_regions(replica_app)
+    sync_replica(replica_app)
+    assert count_regions(replica_app) == primary_count
+    cookie = add_region(replica_app, "RPL")
+    assert cookie.startswith(f"{WRITE_COOKIE}=")
+    assert count_regions(replica_app) == primary_count
+    assert count_regions(replica_app, headers={"Cookie": cookie}) == primary_count + 1
+    assert count_regions(replica_app, method="POST") == primary_count + 1
+    sync_replica(replica_app)
+    assert count_regions(replica_app) == primary_count + 1
+    assert count_regions(replica_app, headers={"Cookie": cookie}) == primary_count + 1
+
+
+def test_replica_is_query_only(replica_app):
+    """
+    GIVEN an app with a read replica that has been synced
+    WHEN a GET request tries to change the data
+    THEN the change should fail rather than be written to the replica
+    """
+    sync_replica(replica_app)
+    with replica_app.test_request_context("/regions", method="GET"):
+        replica_app.preprocess_request()
+        db.session.add(Region(NOC="RPW", region="Written to the replica"))
+        with pytest.raises(exc.OperationalError, match="readonly"):
+            db.session.commit()
+        db.session.remove()
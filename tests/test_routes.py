@@ -1,4 +1,7 @@
 from flask import current_app as app
+from sqlalchemy import event
+
+from paralympics import db
 
 
 def test_get_regions_status_code(client):
@@ -154,3 +157,460 @@ def test_delete_region_not_exists(client):
     response = client.delete(f"/regions/{code}")
     assert response.status_code == 404
     assert response.json['message'] == f'Region {code} not found.'
+
+
+def test_get_events_page(client):
+    """
+    GIVEN a Flask test client
+    AND the database contains more than 5 events
+    WHEN a GET request is made to /events?limit=5
+    THEN the response should contain 5 events ordered by id
+    AND the Link header should contain the URL of the next page starting after the last id
+    """
+    response = client.get("/events?limit=5")
+    ids = [event["id"] for event in response.json]
+    assert ids == sorted(ids)
+    assert len(ids) == 5
+    assert f"after={ids[-1]}" in response.headers["Link"]
+
+
+def test_get_events_pages_cover_all_events(client):
+    """
+    GIVEN a Flask test client
+    WHEN the pages of /events are followed using the 'after' cursor
+    THEN the pages together should contain the same events as /events without a limit
+    """
+    all_ids = [event["id"] for event in client.get("/events").json]
+    paged_ids = []
+    response = client.get("/events?limit=7")
+    paged_ids += [event["id"] for event in response.json]
+    while "Link" in response.headers:
+        next_url = response.headers["Link"].split(";")[0].strip("<>")
+        response = client.get(next_url)
+        paged_ids += [event["id"] for event in response.json]
+    assert paged_ids == all_ids
+
+
+def test_get_events_filtered(client):
+    """
+    GIVEN a Flask test client
+    WHEN a GET request is made to /events?type=winter&year=1976
+    THEN every event in the response should be a winter event in 1976
+    """
+    response = client.get("/events?type=winter&year=1976")
+    assert response.status_code == 200
+    assert len(response.json) > 0
+    for event in response.json:
+        assert event["type"] == "winter"
+        assert event["year"] == 1976
+
+
+def test_get_events_date_range(client):
+    """
+    GIVEN a Flask test client
+    WHEN a GET request is made to /events?start_after=01/01/2000&end_before=2010-01-01
+    THEN the response should be the events that start after 1 January 2000 and end before 1 January 2010
+    AND the dates should still be in the format dd/mm/yyyy
+    """
+    def iso(date):
+        day, month, year = date.split("/")
+        return f"{year}-{month}-{day}"
+
+    expected = [e["id"] for e in client.get("/events").json
+                if e["start"] and iso(e["start"]) > "2000-01-01" and iso(e["end"]) < "2010-01-01"]
+    response = client.get("/events?start_after=01/01/2000&end_before=2010-01-01")
+    assert response.status_code == 200
+    assert [e["id"] for e in response.json] == expected
+    assert len(expected) > 0
+    assert response.json[0]["start"].count("/") == 2
+
+
+def test_get_events_date_not_valid(client):
+    """
+    GIVEN a Flask test client
+    WHEN a GET request is made to /events with a start_after that is not a date
+    THEN the response status code should be 400
+    """
+    response = client.get("/events?start_after=2000/13/01")
+    assert response.status_code == 400
+
+
+def test_get_events_selective_date_uses_index(client, app):
+    """
+    GIVEN a Flask test client
+    WHEN a GET request is made to /events with a start_after and end_before that only match the first Games
+    THEN the events should be read with the index of a date column
+    """
+    statements = []
+    with app.app_context():
+        engine = db.engine
+    listener = lambda conn, cursor, statement, parameters, *args: statements.append((statement, parameters))
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        response = client.get("/events?start_after=01/01/1960&end_before=01/01/1961&fields=id,year&limit=10")
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert [e["year"] for e in response.json] == [1960]
+    statement, parameters = statements[-1]
+    with engine.connect() as connection:
+        plan = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+    assert any("ix_event_start" in row[-1] or "ix_event_end" in row[-1] for row in plan)
+
+
+def test_get_regions_limit_not_valid(client):
+    """
+    GIVEN a Flask test client
+    WHEN a GET request is made to /regions with a limit that is not a positive integer
+    THEN the response status code should be 400
+    """
+    response = client.get("/regions?limit=0")
+    assert response.status_code == 400
+
+
+def test_get_events_etag_not_modified(client):
+    """
+    GIVEN a Flask test client
+    AND the ETag from a previous GET request to /events
+    WHEN the request is repeated with the ETag in If-None-Match
+    THEN the response status code should be 304 with an empty body
+    """
+    etag = client.get("/events").headers["ETag"]
+    response = client.get("/events", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+    assert response.headers["ETag"] == etag
+
+
+def test_missing_item_with_matching_etag_not_found(client):
+    """
+    GIVEN a Flask test client
+    AND the ETags from previous GET requests to /events/1, /regions/TGA and /medals/GBR
+    WHEN the ETags are sent in If-None-Match with requests for an event, region and NOC that do not exist
+    THEN the response status code should be 404 rather than 304
+    """
+    event_etag = client.get("/events/1").headers["ETag"]
+    region_etag = client.get("/regions/TGA").headers["ETag"]
+    medal_etag = client.get("/medals/GBR").headers["ETag"]
+    assert client.get("/events/1", headers={"If-None-Match": event_etag}).status_code == 304
+    assert client.get("/events/99999", headers={"If-None-Match": event_etag}).status_code == 404
+    assert client.get("/regions/QNX", headers={"If-None-Match": region_etag}).status_code == 404
+    assert client.get("/medals/QNX", headers={"If-None-Match": medal_etag}).status_code == 404
+
+
+def test_get_regions_if_modified_since(client):
+    """
+    GIVEN a Flask test client
+    AND the Last-Modified header from a previous GET request to /regions
+    WHEN the request is repeated with the date in If-Modified-Since
+    THEN the response status code should be 304
+    """
+    last_modified = client.get("/regions").headers["Last-Modified"]
+    response = client.get("/regions", headers={"If-Modified-Since": last_modified})
+    assert response.status_code == 304
+
+
+def test_get_region_etag_changes_after_update(client, new_region):
+    """
+    GIVEN a Flask test client
+    AND the ETag for a new region
+    WHEN the region is changed by a POST request to /regions
+    AND the GET request is repeated with the old ETag in If-None-Match
+    THEN the response status code should be 200 with a new ETag and the changed region
+    """
+    code = new_region['NOC']
+    etag = client.get(f"/regions/{code}").headers["ETag"]
+    client.post("/regions", json={"NOC": code, "region": "A changed region"})
+    response = client.get(f"/regions/{code}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json["region"] == "A changed region"
+
+
+def test_not_modified_does_not_query_rows(client, app):
+    """
+    GIVEN a Flask test client
+    AND the ETag from a previous GET request to /events
+    WHEN the request is repeated with the ETag in If-None-Match
+    THEN only the data_version table should be queried
+    """
+    etag = client.get("/events").headers["ETag"]
+    statements = []
+    with app.app_context():
+        engine = db.engine
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        client.get("/events", headers={"If-None-Match": etag})
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert len(statements) == 1
+    assert "data_version" in statements[0]
+
+
+def test_post_regions_batch(client):
+    """
+    GIVEN a Flask test client
+    AND a JSON list of 2 valid new regions
+    WHEN a POST request is made to /regions/batch
+    THEN the response should report 2 regions added
+    AND both regions should be found with GET requests
+    """
+    regions = [{"NOC": "ZB1", "region": "Batch one"}, {"NOC": "ZB2", "region": "Batch two"}]
+    response = client.post("/regions/batch", json=regions)
+    assert response.status_code == 200
+    assert response.json["added"] == 2
+    assert client.get("/regions/ZB1").status_code == 200
+    assert client.get("/regions/ZB2").status_code == 200
+    client.delete("/regions/ZB1")
+    client.delete("/regions/ZB2")
+
+
+def test_post_regions_batch_atomic_error(client):
+    """
+    GIVEN a Flask test client
+    AND a JSON list of regions where the second is missing the required field 'region'
+    WHEN a POST request is made to /regions/batch
+    THEN the response status code should be 400 with the error for the item at index 1
+    AND the first region should not have been added
+    """
+    regions = [{"NOC": "ZB3", "region": "Batch three"}, {"NOC": "ZB4"}]
+    response = client.post("/regions/batch", json=regions)
+    assert response.status_code == 400
+    assert list(response.json["errors"].keys()) == ["1"]
+    assert client.get("/regions/ZB3").status_code == 404
+
+
+def test_post_events_batch_best_effort(client):
+    """
+    GIVEN a Flask test client
+    AND a JSON list of events where the first is valid and the second has a year that is not a number
+    WHEN a POST request is made to /events/batch?mode=best_effort
+    THEN the response should report 1 event added and an error for the item at index 1
+    """
+    event_json = {"type": "summer", "year": 2032, "country": "Australia", "host": "Brisbane", "NOC": "AUS",
+                  "region": "AUS"}
+    events = [event_json, dict(event_json, year="soon")]
+    response = client.post("/events/batch?mode=best_effort", json=events)
+    assert response.status_code == 200
+    assert response.json["added"] == 1
+    assert "year" in response.json["errors"]["1"]
+    added = client.get("/events?year=2032").json
+    assert len(added) == 1
+    client.delete(f"/events/{added[0]['id']}")
+
+
+def test_post_regions_batch_existing_key(client):
+    """
+    GIVEN a Flask test client
+    AND a JSON list of regions with an existing NOC, a new NOC and the same new NOC again
+    WHEN a POST request is made to /regions/batch?mode=best_effort
+    THEN the response should report 1 region added and errors for the items at index 0 and 2
+    AND the existing region should not have changed
+    """
+    name = client.get("/regions/AND").json["region"]
+    regions = [{"NOC": "AND", "region": "Changed"}, {"NOC": "ZB5", "region": "Batch five"},
+               {"NOC": "ZB5", "region": "Batch five again"}]
+    response = client.post("/regions/batch?mode=best_effort", json=regions)
+    assert response.status_code == 200
+    assert response.json["added"] == 1
+    assert sorted(response.json["errors"].keys()) == ["0", "2"]
+    assert client.get("/regions/AND").json["region"] == name
+    assert client.get("/regions/ZB5").json["region"] == "Batch five"
+    client.delete("/regions/ZB5")
+
+
+def test_post_events_batch_atomic_database_error(client):
+    """
+    GIVEN a Flask test client
+    AND a JSON list of 2 valid events where the second has a region that does not exist, which the database rejects
+    WHEN a POST request is made to /events/batch
+    THEN the response status code should be 500 with the error for the item at index 1
+    AND no events should have been added
+    """
+    event_json = {"type": "summer", "year": 2036, "country": "Australia", "host": "Brisbane", "NOC": "AUS",
+                  "region": "AUS"}
+    events = [event_json, dict(event_json, NOC="ZZX", region="ZZX")]
+    response = client.post("/events/batch", json=events)
+    assert response.status_code == 500
+    assert list(response.json["errors"].keys()) == ["1"]
+    assert client.get("/events?year=2036").json == []
+
+
+def test_get_medals_ordered_by_gold(client):
+    """
+    GIVEN a Flask test client
+    AND the database contains the medals from the workbook
+    WHEN a GET request is made to /medals?type=summer
+    THEN every row should be for summer
+    AND the rows should be ordered by gold, then silver, then bronze medals
+    """
+    response = client.get("/medals?type=summer")
+    assert response.status_code == 200
+    assert all(medal["type"] == "summer" for medal in response.json)
+    ranks = [(medal["gold"], medal["silver"], medal["bronze"]) for medal in response.json]
+    assert ranks == sorted(ranks, reverse=True)
+
+
+def test_get_region_medals(client):
+    """
+    GIVEN a Flask test client
+    WHEN a GET request is made to /medals/CHN
+    THEN the response should have the summer and winter medals for China
+    """
+    response = client.get("/medals/CHN")
+    assert response.status_code == 200
+    assert [medal["type"] for medal in response.json] == ["summer", "winter"]
+    assert response.json[0]["team"] == "China"
+
+
+def test_get_region_medals_not_exists(client):
+    """
+    GIVEN a Flask test client
+    WHEN a GET request is made to /medals for a code that has no medals
+    THEN the status code should be 404
+    """
+    response = client.get("/medals/ZZZ")
+    assert response.status_code == 404
+
+
+def test_search_events(client):
+    """
+    GIVEN a Flask test client
+    WHEN a GET request is made to /events/search?q=Rome
+    THEN the results should include the 1960 event in Rome
+    AND each result should have a snippet with the match highlighted
+    """
+    response = client.get("/events/search?q=Rome")
+    assert response.status_code == 200
+    assert any(result["year"] == 1960 and result["host"] == "Rome" for result in response.json)
+    assert all("<b>" in result["snippet"] for result in response.json)
+
+
+def test_search_events_follows_changes(client):
+    """
+    GIVEN a Flask test client
+    WHEN an event is added, its highlights are changed and it is deleted
+    THEN the search results should show each change
+    """
+    event_json = {"type": "winter", "year": 2042, "country": "Canada", "host": "Québec", "NOC": "CAN",
+                  "region": "CAN", "highlights": "Snowkiting demonstration"}
+    response = client.post("/events", json=event_json)
+    event_id = int(response.json["message"].split("=")[-1])
+    assert [r["id"] for r in client.get("/events/search?q=snowkiting").json] == [event_id]
+    # unicode61 with remove_diacritics matches Quebec without the accent
+    assert [r["id"] for r in client.get("/events/search?q=quebec").json] == [event_id]
+
+    client.patch(f"/events/{event_id}", json={"highlights": "Ice climbing demonstration"})
+    assert client.get("/events/search?q=snowkiting").json == []
+    assert [r["id"] for r in client.get("/events/search?q=climbing").json] == [event_id]
+
+    client.delete(f"/events/{event_id}")
+    assert client.get("/events/search?q=climbing").json == []
+
+
+def test_search_ranks_older_better_match(app, client, monkeypatch):
+    """
+    GIVEN an older event that matches a word better than a newer event
+    WHEN a GET request is made to /events/search for the word
+    THEN the older event should be the first result
+    AND with SEARCH_RANK_CANDIDATES set to 1 only the newer event is ranked and the response says it is truncated
+    """
+    older = {"type": "summer", "year": 2044, "country": "Canada", "host": "Toronto", "NOC": "CAN",
+             "region": "CAN", "highlights": "Zorbing zorbing"}
+    newer = dict(older, highlights="Zorbing was shown with the opening of many new venues across the city")
+    ids = [int(client.post("/events", json=event).json["message"].split("=")[-1]) for event in (older, newer)]
+    try:
+        response = client.get("/events/search?q=zorbing")
+        assert [r["id"] for r in response.json] == ids
+        assert "X-Search-Truncated" not in response.headers
+        monkeypatch.setitem(app.config, "SEARCH_RANK_CANDIDATES", 1)
+        response = client.get("/events/search?q=zorbing&limit=5")
+        assert [r["id"] for r in response.json] == ids[1:]
+        assert response.headers["X-Search-Truncated"] == "true"
+    finally:
+        for event_id in ids:
+            client.delete(f"/events/{event_id}")
+
+
+def test_search_events_operators_are_text(client):
+    """
+    GIVEN a Flask test client
+    WHEN a GET request is made to /events/search with FTS5 operator characters in q, or no words
+    THEN the characters should not cause an error
+    AND a q with no words should return 400
+    """
+    assert client.get('/events/search?q=AND "OR* NEAR(').status_code == 200
+    assert client.get("/events/search?q=+").status_code == 400
+
+
+def count_statements(app, client, url):
+    """Returns the response for a GET request to url and the number of SQL statements it ran."""
+    statements = []
+    with app.app_context():
+        engine = db.engine
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    return response, len(statements)
+
+
+def test_get_regions_embed_events_constant_queries(client, app):
+    """
+    GIVEN a Flask test client
+    WHEN /regions?embed=events is requested with a page of 5 regions and a page of 200 regions
+    THEN both requests should run the same number of SQL statements
+    AND each region should have a list of its events
+    """
+    small, small_count = count_statements(app, client, "/regions?embed=events&limit=5")
+    large, large_count = count_statements(app, client, "/regions?embed=events&limit=200")
+    assert len(large.json) > len(small.json)
+    assert small_count == large_count
+    gbr = next(r for r in large.json if r["NOC"] == "GBR")
+    assert {"year": 2012, "host": "London"} in [{"year": e["year"], "host": e["host"]} for e in gbr["events"]]
+
+
+def test_get_events_embed_region_constant_queries(client, app):
+    """
+    GIVEN a Flask test client
+    WHEN /events?embed=region is requested with a page of 2 events and a page of all the events
+    THEN both requests should run the same number of SQL statements
+    AND each event's region should be an object with the region's name
+    """
+    small, small_count = count_statements(app, client, "/events?embed=region&limit=2")
+    large, large_count = count_statements(app, client, "/events?embed=region")
+    assert len(large.json) > len(small.json)
+    assert small_count == large_count
+    assert small.json[0]["region"]["NOC"] == small.json[0]["NOC"]
+    assert "region" in small.json[0]["region"]
+
+
+def test_embed_etag_depends_on_embedded_table(client, new_region):
+    """
+    GIVEN a Flask test client and a new region
+    WHEN /events?embed=region is requested with the ETag of /events
+    THEN the ETag should be different, as the response also depends on the region table
+    AND an embed that is not supported should return 400
+    """
+    etag = client.get("/events").headers["ETag"]
+    response = client.get("/events?embed=region", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert client.get("/events?embed=medals").status_code == 400
+
+
+def test_get_events_fields(client):
+    """
+    GIVEN a Flask test client
+    WHEN a GET request is made to /events?fields=year,host&limit=3
+    THEN each event should only have the year and host
+    AND the Link header should still have the next page
+    AND an unknown field should return 400
+    """
+    response = client.get("/events?fields=year,host&limit=3")
+    assert response.status_code == 200
+    assert [set(e) for e in response.json] == [{"year", "host"}] * 3
+    assert 'rel="next"' in response.headers["Link"]
+    assert client.get("/events?fields=year,password").status_code == 400
@@ -0,0 +1,61 @@
+# Tests that the fast-path serializers give the same output as the Marshmallow schemas
+from flask import current_app
+
+from paralympics import db
+from paralympics.models import Event, Region
+from paralympics.schemas import EventSchema, RegionSchema, RowSerializer
+
+
+def test_event_serializer_matches_schema(test_client):
+    """
+    GIVEN the events in the database, including events whose NOC has no matching region
+    WHEN the events are dumped using the EventSchema and using a RowSerializer generated from it
+    THEN the JSON should be identical
+    """
+    events = db.session.execute(db.select(Event).order_by(Event.id)).scalars().all()
+    serializer = RowSerializer(EventSchema())
+    rows = db.session.execute(serializer.select().order_by(Event.id)).all()
+    schema_json = current_app.json.dumps(EventSchema(many=True).dump(events))
+    serializer_json = current_app.json.dumps(serializer.dump(rows))
+    assert serializer_json == schema_json
+
+
+def test_region_serializer_matches_schema(test_client):
+    """
+    GIVEN the regions in the database
+    WHEN the regions are dumped using the RegionSchema and using a RowSerializer generated from it
+    THEN the JSON should be identical
+    """
+    regions = db.session.execute(db.select(Region).order_by(Region.NOC)).scalars().all()
+    serializer = RowSerializer(RegionSchema())
+    rows = db.session.execute(serializer.select().order_by(Region.NOC)).all()
+    schema_json = current_app.json.dumps(RegionSchema(many=True).dump(regions))
+    serializer_json = current_app.json.dumps(serializer.dump(rows))
+    assert serializer_json == schema_json
+
+
+def test_get_events_response_matches_schema(test_client):
+    """
+    GIVEN a Flask test client
+    WHEN a GET request is made to /events
+    THEN the response body should be byte-identical to a JSON response of the EventSchema dump of all events
+    """
+    events = db.session.execute(db.select(Event).order_by(Event.id)).scalars().all()
+    expected = current_app.json.response(EventSchema(many=True).dump(events)).get_data()
+    response = test_client.get("/events")
+    assert response.get_data() == expected
+
+
+def test_pruned_serializer_matches_schema_only(test_client):
+    """
+    GIVEN a RowSerializer for events pruned to the fields year and host, always selecting the id
+    WHEN the events are dumped
+    THEN the JSON should be identical to EventSchema(only=...)
+    AND only the year, host and id columns should be selected
+    """
+    serializer = RowSerializer(EventSchema()).prune(["host", "year"], key="id")
+    rows = db.session.execute(serializer.select().order_by(Event.id)).all()
+    events = db.session.execute(db.select(Event).order_by(Event.id)).scalars().all()
+    schema_json = current_app.json.dumps(EventSchema(many=True, only=("year", "host")).dump(events))
+    assert current_app.json.dumps(serializer.dump(rows)) == schema_json
+    assert [column.name for column in serializer.columns] == ["year", "host", "id"]
@@ -0,0 +1,84 @@
+import gzip
+from urllib.parse import parse_qsl, urlsplit
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from paralympics import create_app, db
+from paralympics.models import Event
+from paralympics.snapshot import Snapshot, build_snapshot, snapshot_key
+
+
+def snapshot_response(snapshot, url, **kwargs):
+    """Returns (body, headers, encoding) from the snapshot for a URL."""
+    parts = urlsplit(url)
+    return snapshot.get(snapshot_key(parts.path, parse_qsl(parts.query)), **kwargs)
+
+
+def test_snapshot_matches_routes(app, client, tmp_path):
+    """
+    GIVEN a snapshot built from the test database
+    WHEN the responses of the routes are compared with the snapshot
+    THEN the snapshot should have the same body, ETag, Last-Modified and Link for each URL
+    AND the gzip body should decompress to the same JSON
+    """
+    path = str(tmp_path.joinpath("test.snapshot"))
+    with app.app_context():
+        build_snapshot(app, path)
+    snapshot = Snapshot(path)
+    next_page = client.get("/events?limit=10").headers["Link"].split(">")[0][1:]
+    for url in ["/regions", "/regions/GBR", "/regions?limit=50", "/events", "/events/1", "/events?limit=10",
+                next_page, "/medals", "/medals/GBR", "/analytics/participants", "/analytics/hosts"]:
+        response = client.get(url)
+        body, headers, encoding = snapshot_response(snapshot, url)
+        assert body == response.data, url
+        assert encoding is None
+        for name in ("ETag", "Last-Modified", "Link"):
+            assert headers.get(name) == response.headers.get(name), (url, name)
+    body, _, encoding = snapshot_response(snapshot, "/events", gzip=True)
+    assert encoding == "gzip"
+    assert gzip.decompress(body) == client.get("/events").data
+    assert snapshot_response(snapshot, "/events?type=winter") is None
+
+
+def test_snapshot_mode_serves_without_sql(app, tmp_path):
+    """
+    GIVEN an app in snapshot mode that rejects writes, with a snapshot built by the build-snapshot command
+    WHEN GET requests in the snapshot are made, with and without the ETag and gzip
+    THEN they should be served from the snapshot without any SQL statements
+    AND a write should return 405
+    AND a change to the database should only be served once the snapshot is built again
+    """
+    # The app fixture is used so that the shared test app, which has the routes, is created before this one
+    snapshot_file = str(tmp_path.joinpath("app.snapshot"))
+    test_config = {"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite:///" + str(tmp_path.joinpath("app.sqlite")),
+                   "SNAPSHOT_FILE": snapshot_file}
+    snapshot_app = create_app(test_config=test_config)
+    result = snapshot_app.test_cli_runner().invoke(args=["build-snapshot"])
+    assert result.exit_code == 0, result.output
+    client = snapshot_app.test_client()
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(Engine, "before_cursor_execute", listener)
+    try:
+        response = client.get("/events/1")
+        not_modified = client.get("/events/1", headers={"If-None-Match": response.headers["ETag"]})
+        compressed = client.get("/events", headers={"Accept-Encoding": "gzip"})
+    finally:
+        event.remove(Engine, "before_cursor_execute", listener)
+    assert statements == []
+    assert response.headers["X-Snapshot"] == "HIT"
+    assert not_modified.status_code == 304
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert client.post("/regions", json={"NOC": "SNP", "region": "Snapshot"}).status_code == 405
+
+    host = response.json["host"]
+    with snapshot_app.app_context():
+        db.session.execute(db.update(Event).where(Event.id == 1).values(host="Rebuilt"))
+        db.session.commit()
+        assert client.get("/events/1").json["host"] == host
+        build_snapshot(snapshot_app, snapshot_file)
+        assert client.get("/events/1").json["host"] == "Rebuilt"
+        db.session.remove()
+        db.engine.dispose()